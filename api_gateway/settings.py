@@ -60,7 +60,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'notifications.middleware.MetricsMiddleware',
     'notifications.middleware.LoggingMiddleware',
+    'notifications.middleware.RateLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'api_gateway.urls'
@@ -104,16 +106,153 @@ else:
         }
     }
 
+# Idempotency: how long finished responses are replayed, how long an
+# in-flight claim is honoured, and how long a duplicate waits for its result
+IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', default=86400, cast=int)
+IDEMPOTENCY_CLAIM_TTL = config('IDEMPOTENCY_CLAIM_TTL', default=30, cast=int)
+IDEMPOTENCY_WAIT_TIMEOUT = config('IDEMPOTENCY_WAIT_TIMEOUT', default=2.0, cast=float)
+
 # RabbitMQ configuration
 RABBITMQ_URL = config('RABBITMQ_URL', default=None)
+RABBITMQ_POOL_SIZE = config('RABBITMQ_POOL_SIZE', default=4, cast=int)
+RABBITMQ_POOL_TIMEOUT = config('RABBITMQ_POOL_TIMEOUT', default=5.0, cast=float)
+RABBITMQ_CONNECT_RETRIES = config('RABBITMQ_CONNECT_RETRIES', default=3, cast=int)
+RABBITMQ_RETRY_BACKOFF = config('RABBITMQ_RETRY_BACKOFF', default=0.2, cast=float)
+RABBITMQ_PUBLISHER_CONFIRMS = config('RABBITMQ_PUBLISHER_CONFIRMS', default=True, cast=bool)
+RABBITMQ_CONFIRM_TIMEOUT = config('RABBITMQ_CONFIRM_TIMEOUT', default=5.0, cast=float)
+
+# Bulk publishes (batches, streams, fan-out, outbox relay) pack up to this many
+# notifications for the same queue and priority into one AMQP message,
+# msgpack-encoded and deflated from the given size in bytes (0 never); 1 keeps
+# one JSON message per notification
+NOTIFICATION_ENVELOPE_SIZE = config('NOTIFICATION_ENVELOPE_SIZE', default=1, cast=int)
+NOTIFICATION_ENVELOPE_COMPRESS_MIN_BYTES = config('NOTIFICATION_ENVELOPE_COMPRESS_MIN_BYTES', default=4096, cast=int)
+
+# Write notifications to the transactional outbox and let relay_outbox publish
+# them, instead of publishing inside the request
+NOTIFICATION_USE_OUTBOX = config('NOTIFICATION_USE_OUTBOX', default=True, cast=bool)
+OUTBOX_RELAY_BATCH_SIZE = config('OUTBOX_RELAY_BATCH_SIZE', default=500, cast=int)
+OUTBOX_RELAY_INTERVAL = config('OUTBOX_RELAY_INTERVAL', default=0.5, cast=float)
+# Unpublished rows are never dropped; retries back off exponentially up to
+# this many seconds apart
+OUTBOX_RETRY_MAX_DELAY = config('OUTBOX_RETRY_MAX_DELAY', default=300, cast=int)
+
+# Notifications created with "digest": true at priority 1 are held per
+# (user_id, notification_type) and flush_digests sends each bucket as one
+# message of up to NOTIFICATION_DIGEST_MAX_ITEMS, once its oldest entry has
+# waited NOTIFICATION_DIGEST_WINDOW seconds or it is full (0 sends them at once).
+# Digests need NOTIFICATION_ENRICHMENT; without it "digest" is ignored
+NOTIFICATION_DIGEST_WINDOW = config('NOTIFICATION_DIGEST_WINDOW', default=0, cast=int)
+NOTIFICATION_DIGEST_MAX_ITEMS = config('NOTIFICATION_DIGEST_MAX_ITEMS', default=50, cast=int)
+NOTIFICATION_DIGEST_TEMPLATE = config('NOTIFICATION_DIGEST_TEMPLATE', default='digest')
+# Push digests still missing a device token or title after this many seconds
+# are given up on and their notifications marked failed
+NOTIFICATION_DIGEST_MAX_AGE = config('NOTIFICATION_DIGEST_MAX_AGE', default=86400, cast=int)
+DIGEST_FLUSH_BATCH_SIZE = config('DIGEST_FLUSH_BATCH_SIZE', default=500, cast=int)
+DIGEST_FLUSH_INTERVAL = config('DIGEST_FLUSH_INTERVAL', default=5.0, cast=float)
+
+# Monthly partitions of the notifications table kept ahead of time and kept
+# around; status updates only look at notifications this many days old
+NOTIFICATION_PARTITIONS_AHEAD = config('NOTIFICATION_PARTITIONS_AHEAD', default=3, cast=int)
+NOTIFICATION_RETENTION_MONTHS = config('NOTIFICATION_RETENTION_MONTHS', default=6, cast=int)
+NOTIFICATION_STATUS_WINDOW_DAYS = config('NOTIFICATION_STATUS_WINDOW_DAYS', default=7, cast=int)
+# How far ahead scheduled_at may be; scheduled notifications stay inside the
+# status window until this long after they were created
+NOTIFICATION_SCHEDULE_MAX_DAYS = config('NOTIFICATION_SCHEDULE_MAX_DAYS', default=30, cast=int)
+
+# Seconds the status lookup endpoints cache a record: pending and failed ones
+# (invalidated on every status change; the TTL bounds a racing lookup), and
+# delivered ones, which never change again
+STATUS_CACHE_TTL = config('STATUS_CACHE_TTL', default=60, cast=int)
+STATUS_CACHE_FINAL_TTL = config('STATUS_CACHE_FINAL_TTL', default=86400, cast=int)
+
+# Upper bound on notifications accepted by one batch request
+NOTIFICATION_BATCH_MAX_ITEMS = config('NOTIFICATION_BATCH_MAX_ITEMS', default=1000, cast=int)
+# Lines validated, inserted and published together by the NDJSON stream endpoint
+NOTIFICATION_STREAM_CHUNK_SIZE = config('NOTIFICATION_STREAM_CHUNK_SIZE', default=500, cast=int)
+# Upper bound on user_ids in one fan-out request; larger audiences are split
+# across several requests
+FANOUT_MAX_RECIPIENTS = config('FANOUT_MAX_RECIPIENTS', default=10000, cast=int)
+# Recipients expanded, inserted and published together by a fan-out job
+FANOUT_CHUNK_SIZE = config('FANOUT_CHUNK_SIZE', default=1000, cast=int)
+# run_fanouts leases a job for this many seconds, renewed after every chunk;
+# failed passes are retried at most FANOUT_RETRY_MAX_DELAY seconds apart
+FANOUT_JOB_LEASE = config('FANOUT_JOB_LEASE', default=300, cast=int)
+FANOUT_RETRY_MAX_DELAY = config('FANOUT_RETRY_MAX_DELAY', default=300, cast=int)
+FANOUT_POLL_INTERVAL = config('FANOUT_POLL_INTERVAL', default=1.0, cast=float)
+
+# Serve ingestion from the async views (run under an ASGI server); blocking
+# database work from those views runs on ASYNC_DB_THREADS threads per process
+NOTIFICATION_ASYNC_VIEWS = config('NOTIFICATION_ASYNC_VIEWS', default=False, cast=bool)
+ASYNC_DB_THREADS = config('ASYNC_DB_THREADS', default=16, cast=int)
+
+# Queues are declared with x-max-priority and messages carry their
+# notification priority; notifications at or above the lane threshold go to
+# {type}.priority.queue instead (0 turns the lanes off)
+RABBITMQ_MAX_PRIORITY = config('RABBITMQ_MAX_PRIORITY', default=10, cast=int)
+NOTIFICATION_PRIORITY_LANE_THRESHOLD = config('NOTIFICATION_PRIORITY_LANE_THRESHOLD', default=0, cast=int)
+
+# Token buckets per client on write requests, with per-client overrides as
+# "client:rate:burst,..."; rates are per second. The client is the address
+# RATE_LIMIT_TRUSTED_PROXIES hops back in X-Forwarded-For (REMOTE_ADDR at 0),
+# or RATE_LIMIT_CLIENT_HEADER if a proxy in front sets it and strips it from
+# callers. Off by default: without either, every caller behind the platform
+# proxy shares one bucket.
+RATE_LIMIT_ENABLED = config('RATE_LIMIT_ENABLED', default=False, cast=bool)
+RATE_LIMIT_PATH_PREFIX = config('RATE_LIMIT_PATH_PREFIX', default='/api/v1/notifications')
+# Delivery-status callbacks from the email and push services are never limited
+RATE_LIMIT_EXEMPT_PATHS = config('RATE_LIMIT_EXEMPT_PATHS', default=r'^/api/v1/notifications/[^/]+/status/')
+RATE_LIMIT_TRUSTED_PROXIES = config('RATE_LIMIT_TRUSTED_PROXIES', default=1, cast=int)
+RATE_LIMIT_CLIENT_HEADER = config('RATE_LIMIT_CLIENT_HEADER', default='')
+RATE_LIMIT_RATE = config('RATE_LIMIT_RATE', default=50.0, cast=float)
+RATE_LIMIT_BURST = config('RATE_LIMIT_BURST', default=100, cast=int)
+RATE_LIMIT_OVERRIDES = config('RATE_LIMIT_OVERRIDES', default='')
+# Notifications per second one recipient user_id may be sent (0 turns it off)
+USER_RATE_LIMIT_RATE = config('USER_RATE_LIMIT_RATE', default=0.0, cast=float)
+USER_RATE_LIMIT_BURST = config('USER_RATE_LIMIT_BURST', default=10, cast=int)
+
+# Suppress notifications repeating the recipient, type, template and variables
+# of one accepted within NOTIFICATION_DEDUP_WINDOW seconds, under any
+# request_id (0 turns it off). Each process remembers up to
+# NOTIFICATION_DEDUP_LOCAL_SIZE of its own recent ones to skip Redis for them.
+NOTIFICATION_DEDUP_WINDOW = config('NOTIFICATION_DEDUP_WINDOW', default=0, cast=int)
+NOTIFICATION_DEDUP_LOCAL_SIZE = config('NOTIFICATION_DEDUP_LOCAL_SIZE', default=100000, cast=int)
+
+# Enrich published messages with recipient contact data, push tokens and
+# rendered templates from the User and Template services, cached in process
+# (LRU, seconds) and in Redis (seconds)
+NOTIFICATION_ENRICHMENT = config('NOTIFICATION_ENRICHMENT', default=False, cast=bool)
+USER_SERVICE_URL = config('USER_SERVICE_URL', default='')
+TEMPLATE_SERVICE_URL = config('TEMPLATE_SERVICE_URL', default='')
+UPSTREAM_SERVICE_TOKEN = config('UPSTREAM_SERVICE_TOKEN', default='')
+UPSTREAM_TIMEOUT = config('UPSTREAM_TIMEOUT', default=3.0, cast=float)
+ENRICHMENT_LOCAL_CACHE_SIZE = config('ENRICHMENT_LOCAL_CACHE_SIZE', default=10000, cast=int)
+ENRICHMENT_LOCAL_TTL = config('ENRICHMENT_LOCAL_TTL', default=60, cast=int)
+ENRICHMENT_CACHE_TTL = config('ENRICHMENT_CACHE_TTL', default=300, cast=int)
+
+# Circuit breakers around RabbitMQ and the upstream services, shared by all
+# workers through Redis: FAILURE_THRESHOLD failures within FAILURE_WINDOW
+# seconds open one for RECOVERY_TIMEOUT seconds, then a single trial call
+# decides whether it closes
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = config('CIRCUIT_BREAKER_FAILURE_THRESHOLD', default=5, cast=int)
+CIRCUIT_BREAKER_FAILURE_WINDOW = config('CIRCUIT_BREAKER_FAILURE_WINDOW', default=60, cast=int)
+CIRCUIT_BREAKER_RECOVERY_TIMEOUT = config('CIRCUIT_BREAKER_RECOVERY_TIMEOUT', default=30, cast=int)
+
+# Seconds between the background dependency checks behind /health/ready/
+HEALTH_CHECK_INTERVAL = config('HEALTH_CHECK_INTERVAL', default=5.0, cast=float)
+
+# Status updates applied together by consume_status_updates
+STATUS_UPDATE_BATCH_SIZE = config('STATUS_UPDATE_BATCH_SIZE', default=500, cast=int)
+STATUS_UPDATE_FLUSH_INTERVAL = config('STATUS_UPDATE_FLUSH_INTERVAL', default=0.5, cast=float)
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # orjson-backed; output and parse errors match DRF's JSON classes.
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'notifications.renderers.ORJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'notifications.parsers.ORJSONParser',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20
@@ -140,6 +279,15 @@ CORS_ALLOWED_ORIGINS = [
 if DEBUG:
     CORS_ALLOW_ALL_ORIGINS = True
 
+# Logs are written by a background thread (notifications.log.QueueingHandler),
+# as JSON lines unless LOG_FORMAT=text. Access logs keep every 5xx and every
+# request slower than ACCESS_LOG_SLOW_SECONDS, and ACCESS_LOG_SAMPLE_RATE of
+# the rest
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='json')
+ACCESS_LOG_SAMPLE_RATE = config('ACCESS_LOG_SAMPLE_RATE', default=1.0, cast=float)
+ACCESS_LOG_SLOW_SECONDS = config('ACCESS_LOG_SLOW_SECONDS', default=1.0, cast=float)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -152,11 +300,14 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'notifications.log.JSONFormatter',
+        },
     },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose'
+            '()': 'notifications.log.QueueingHandler',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'verbose',
         },
     },
     'root': {
@@ -171,7 +322,7 @@ LOGGING = {
         },
         'notifications': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
     },
@@ -1,12 +1,16 @@
 from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
-from health.views import health_check
+from health.views import health_check, liveness, readiness
+from notifications.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('notifications.urls')),
     path('health/', health_check, name='health-check'),
+    path('health/live/', liveness, name='health-live'),
+    path('health/ready/', readiness, name='health-ready'),
+    path('metrics', metrics_view, name='metrics'),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
 ]
\ No newline at end of file
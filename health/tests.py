@@ -1,3 +1,64 @@
-from django.test import TestCase
+import os
+import time
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+
+from . import checker
+from .checker import HealthChecker
+
+
+class ReadinessTests(TestCase):
+    def install(self, ready=True, age=0):
+        probe = HealthChecker(interval=5)
+        probe.pid = os.getpid()
+        probe.snapshot = {
+            'ready': ready,
+            'checks': {'database': True, 'cache': True, 'message_queue': ready},
+            'queues': {'email.queue': 3},
+            'pool': None,
+            'checked_at': time.time() - age,
+        }
+        self.addCleanup(setattr, checker, '_checker', checker._checker)
+        checker._checker = probe
+
+    @override_settings(HEALTH_CHECK_INTERVAL=5)
+    def test_probe_answers_from_the_last_check(self):
+        self.install()
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/health/ready/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['queues'], {'email.queue': 3})
+
+    @override_settings(HEALTH_CHECK_INTERVAL=5)
+    def test_failing_or_stale_checks_are_unready(self):
+        self.install(ready=False)
+        self.assertEqual(self.client.get('/health/ready/').status_code, 503)
+
+        self.install(age=60)
+        self.assertEqual(self.client.get('/health/').status_code, 503)
+
+    def test_liveness_needs_no_checker(self):
+        self.addCleanup(setattr, checker, '_checker', checker._checker)
+        checker._checker = None
+
+        self.assertEqual(self.client.get('/health/live/').status_code, 200)
+        self.assertIsNone(checker._checker)
+
+
+class HealthCheckerTests(TestCase):
+    @override_settings(RABBITMQ_URL='', NOTIFICATION_USE_OUTBOX=True)
+    def test_broker_is_optional_with_the_outbox(self):
+        probe = HealthChecker(interval=5)
+        probe.refresh()
+
+        self.assertTrue(probe.snapshot['ready'])
+        self.assertFalse(probe.snapshot['checks']['message_queue'])
+
+    @override_settings(RABBITMQ_URL='', NOTIFICATION_USE_OUTBOX=False)
+    def test_broker_is_required_for_inline_publishing(self):
+        probe = HealthChecker(interval=5)
+        probe.refresh()
+
+        self.assertFalse(probe.snapshot['ready'])
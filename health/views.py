@@ -1,48 +1,36 @@
-from rest_framework.decorators import api_view
-from rest_framework.response import Response
-from django.db import connection
-from django.core.cache import cache
-import pika
-from django.conf import settings
 import time
 
-@api_view(['GET'])
-def health_check(request):
-    checks = {
-        'database': False,
-        'cache': False,
-        'message_queue': False,
-    }
-    
-   
-    try:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT 1")
-        checks['database'] = True
-    except Exception:
-        pass
-    
-   
-    try:
-        cache.set('health_check', 'ok', 1)
-        checks['cache'] = cache.get('health_check') == 'ok'
-    except Exception:
-        pass
-    
- 
-    try:
-        connection = pika.BlockingConnection(
-            pika.URLParameters(settings.RABBITMQ_URL)
-        )
-        checks['message_queue'] = connection.is_open
-        connection.close()
-    except Exception:
-        pass
-    
-    is_healthy = all(checks.values())
-    
-    return Response({
-        'status': 'healthy' if is_healthy else 'unhealthy',
-        'checks': checks,
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from .checker import get_health_checker
+
+# Probes are answered from the background checker's last result; plain Django
+# views keep them clear of DRF's negotiation and rendering.
+
+
+@require_GET
+def liveness(request):
+    return JsonResponse({'status': 'alive', 'timestamp': time.time()})
+
+
+@require_GET
+def readiness(request):
+    snapshot = get_health_checker().snapshot
+    age = time.time() - snapshot['checked_at']
+    # A checker that stopped refreshing says nothing about the dependencies.
+    is_ready = snapshot['ready'] and age < 3 * settings.HEALTH_CHECK_INTERVAL
+
+    return JsonResponse({
+        'status': 'healthy' if is_ready else 'unhealthy',
+        'checks': snapshot['checks'],
+        'queues': snapshot['queues'],
+        'pool': snapshot['pool'],
+        'checked_at': snapshot['checked_at'],
+        'age': round(age, 3),
         'timestamp': time.time()
-    }, status=200 if is_healthy else 503)
+    }, status=200 if is_ready else 503)
+
+
+health_check = readiness
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import aio_pika
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .breaker import get_circuit_breaker
+from .envelope import ENVELOPE_TYPE, encode_envelope, encode_message
+from .idempotency import DuplicateRequest, release_requests
+from .metrics import PUBLISHED
+from .services import (
+    EXCHANGE_NAME,
+    NotificationService,
+    group_envelopes,
+    mark_notifications_failed,
+    message_priority,
+    messages_for,
+    notification_ids_of,
+    queue_topology,
+)
+
+logger = logging.getLogger('notifications')
+
+# Django's async ORM runs every query on one shared thread, which would
+# serialize a process's requests on the database. Blocking work goes to this
+# pool instead, and each of its threads keeps its own connection.
+_db_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_DB_THREADS, thread_name_prefix='notifications-db'
+)
+
+
+def _call_with_connection(func, *args, **kwargs):
+    close_old_connections()
+    return func(*args, **kwargs)
+
+
+async def run_sync(func, *args, **kwargs):
+    """Run blocking ORM or Redis work without holding up the event loop."""
+    return await sync_to_async(
+        _call_with_connection, thread_sensitive=False, executor=_db_executor
+    )(func, *args, **kwargs)
+
+
+def amqp_message(messages):
+    """One notification as plain JSON, or several in an envelope."""
+    if len(messages) == 1:
+        body, content_type = encode_message(messages[0])
+        return aio_pika.Message(
+            body=body,
+            content_type=content_type,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            priority=message_priority(messages[0]),
+        )
+    body, content_type, content_encoding = encode_envelope(
+        messages, settings.NOTIFICATION_ENVELOPE_COMPRESS_MIN_BYTES
+    )
+    return aio_pika.Message(
+        body=body,
+        content_type=content_type,
+        content_encoding=content_encoding,
+        type=ENVELOPE_TYPE,
+        headers={'x-notification-count': len(messages)},
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        priority=message_priority(messages[0]),
+    )
+
+
+class AsyncRabbitMQPublisher:
+    """
+    One robust AMQP connection and confirm-mode channel per event loop.
+
+    Publishes from concurrent requests are multiplexed on the channel; each
+    one awaits its own broker confirm, so thousands can be in flight at once.
+    """
+
+    def __init__(self, url, confirms=True, confirm_timeout=5.0):
+        self.url = url
+        self.confirms = confirms
+        self.confirm_timeout = confirm_timeout
+        self.breaker = get_circuit_breaker('rabbitmq')
+        self._connection = None
+        self._channel = None
+        self._exchange = None
+        self._lock = asyncio.Lock()
+
+    async def _get_exchange(self):
+        if self._exchange is not None and not self._channel.is_closed:
+            return self._exchange
+
+        async with self._lock:
+            if self._exchange is None or self._channel.is_closed:
+                if self._connection is None or self._connection.is_closed:
+                    self._connection = await aio_pika.connect_robust(self.url)
+                self._channel = await self._connection.channel(publisher_confirms=self.confirms)
+                self._exchange = await self._channel.declare_exchange(
+                    EXCHANGE_NAME, aio_pika.ExchangeType.DIRECT, durable=True
+                )
+                await self._declare_queues()
+        return self._exchange
+
+    async def _declare_queues(self):
+        for queue_name, arguments, bound in queue_topology():
+            try:
+                queue = await self._channel.declare_queue(queue_name, durable=True, arguments=arguments)
+            except aio_pika.exceptions.ChannelPreconditionFailed as e:
+                # Same as the sync pool: keep a queue declared with other
+                # arguments, on a fresh channel since this one was closed.
+                logger.warning("Using existing %s: %s", queue_name, e)
+                self._channel = await self._connection.channel(publisher_confirms=self.confirms)
+                self._exchange = await self._channel.get_exchange(EXCHANGE_NAME)
+                queue = await self._channel.declare_queue(queue_name, passive=True)
+            if bound:
+                await queue.bind(self._exchange, routing_key=queue_name)
+
+    async def publish(self, routing_key, message):
+        return await self.publish_envelope(routing_key, [message])
+
+    async def publish_envelope(self, routing_key, messages):
+        # Same protocol as the sync PublishPipeline: ask first, then report
+        # the outcome with the state allow() handed out.
+        state = await run_sync(self.breaker.allow)
+        if state is None:
+            logger.warning("Not publishing %s messages to %s: broker circuit is open", len(messages), routing_key)
+            PUBLISHED.labels('failed').inc(len(messages))
+            return False
+        try:
+            exchange = await self._get_exchange()
+            await asyncio.wait_for(
+                exchange.publish(amqp_message(messages), routing_key=routing_key),
+                self.confirm_timeout
+            )
+        except Exception as e:
+            notification_ids = ', '.join(str(i) for message in messages for i in notification_ids_of(message))
+            logger.error("Failed to publish message %s: %s", notification_ids, e)
+            PUBLISHED.labels('failed').inc(len(messages))
+            await run_sync(self.breaker.record_failure, state)
+            return False
+        PUBLISHED.labels('published').inc(len(messages))
+        # Usually nothing to write; skip the thread hop then.
+        if self.breaker.reports_success(state):
+            await run_sync(self.breaker.record_success, state)
+        return True
+
+    async def publish_many(self, messages):
+        """Publish ``(routing_key, message)`` pairs concurrently; returns the failed ids."""
+        envelopes = group_envelopes(list(messages))
+        results = await asyncio.gather(
+            *(self.publish_envelope(routing_key, envelope) for routing_key, envelope in envelopes)
+        )
+        return {
+            notification_id
+            for (_, envelope), published in zip(envelopes, results)
+            if not published
+            for message in envelope
+            for notification_id in notification_ids_of(message)
+        }
+
+    async def close(self):
+        if self._connection is not None and not self._connection.is_closed:
+            await self._connection.close()
+
+
+_publishers = weakref.WeakKeyDictionary()
+
+
+def get_async_publisher():
+    """Return the publisher that belongs to the running event loop."""
+    loop = asyncio.get_running_loop()
+    publisher = _publishers.get(loop)
+    if publisher is None:
+        publisher = AsyncRabbitMQPublisher(
+            settings.RABBITMQ_URL,
+            confirms=settings.RABBITMQ_PUBLISHER_CONFIRMS,
+            confirm_timeout=settings.RABBITMQ_CONFIRM_TIMEOUT,
+        )
+        _publishers[loop] = publisher
+    return publisher
+
+
+class AsyncNotificationService:
+    """``NotificationService`` for async views: database work runs in the
+    executor and inline publishes go through the per-loop publisher."""
+
+    def __init__(self):
+        self.service = NotificationService()
+
+    async def claim_idempotency(self, request_id):
+        return await run_sync(self.service.claim_idempotency, request_id)
+
+    async def store_idempotency_key(self, request_id, response_data):
+        await run_sync(self.service.store_idempotency_key, request_id, response_data)
+
+    async def release_idempotency_key(self, request_id):
+        await run_sync(self.service.release_idempotency_key, request_id)
+
+    async def send_notification(self, notification_data):
+        try:
+            outbox = await run_sync(self.service.via_outbox)
+            try:
+                notification = await run_sync(self.service.create_notification, notification_data, outbox)
+            except DuplicateRequest:
+                logger.info("Request %s already has a notification", notification_data['request_id'])
+                return True
+            if notification.digest:
+                logger.info("Notification %s held for the next digest", notification.id)
+                return True
+            if outbox or notification.scheduled_at:
+                logger.info("Notification %s written to outbox", notification.id)
+                return True
+
+            [(routing_key, message)] = await run_sync(messages_for, [notification])
+            published = await get_async_publisher().publish(routing_key, message)
+            if not published:
+                await run_sync(mark_notifications_failed, [notification.id])
+                await run_sync(release_requests, [notification])
+                return False
+
+            logger.info("Notification %s queued successfully", notification.id)
+            return True
+
+        except Exception as e:
+            logger.error("Failed to send notification: %s", e)
+            return False
+
+    async def send_batch(self, items):
+        outbox = await run_sync(self.service.via_outbox)
+        batch = await run_sync(self.service.insert_batch, items, outbox)
+
+        publish = self.service.to_publish(batch.notifications, outbox)
+        if publish:
+            messages = await run_sync(messages_for, publish)
+            batch.failed = await get_async_publisher().publish_many(messages)
+            if batch.failed:
+                await run_sync(mark_notifications_failed, list(batch.failed))
+
+        return await run_sync(self.service.finish_batch, batch, batch.failed)
+
+    async def suppress_duplicate(self, notification_data):
+        return await run_sync(self.service.suppress_duplicate, notification_data)
+
+    async def user_retry_after(self, notification_data):
+        return await run_sync(self.service.user_retry_after, notification_data)
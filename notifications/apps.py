@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def ensure_notification_partitions(sender, using, **kwargs):
+    from django.conf import settings
+    from django.db import connections
+    from .partitions import ensure_partitions
+
+    ensure_partitions(settings.NOTIFICATION_PARTITIONS_AHEAD, connections[using])
 
 
 class NotificationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'notifications'
+
+    def ready(self):
+        # Every deploy runs migrate, which keeps future partitions in place.
+        post_migrate.connect(ensure_notification_partitions, sender=self)
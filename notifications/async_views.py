@@ -0,0 +1,233 @@
+import logging
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import status
+
+from .aio import AsyncNotificationService, run_sync
+from .fastjson import loads
+from .middleware import rate_limited_response
+from .serializers import (
+    NotificationCreateSerializer,
+    NotificationStatusUpdateSerializer,
+    api_response,
+)
+from .services import suppressed_response
+from .status_updates import apply_status_update, apply_status_updates
+from .views import (
+    _batch_response,
+    _status_batch_response,
+    _validate_batch,
+    _validate_status_updates,
+    list_notifications,
+)
+from .validation import validate_notification
+
+logger = logging.getLogger('notifications')
+
+# Async counterparts of the ingestion views in views.py, served when
+# NOTIFICATION_ASYNC_VIEWS is on and the app runs under an ASGI server. They
+# return the same envelopes; DRF views cannot be coroutines, so these are
+# plain Django views.
+
+
+def _error_response(error, message, response_status, data=None):
+    return JsonResponse(
+        api_response({
+            'success': False,
+            'error': error,
+            'message': message,
+            'data': data
+        }),
+        status=response_status
+    )
+
+
+def _load_body(request):
+    content_type = request.content_type or ''
+    body = request.body.decode(request.encoding or settings.DEFAULT_CHARSET)
+    if content_type == 'application/x-ndjson':
+        return [loads(line) for line in body.splitlines() if line.strip()]
+    return loads(body)
+
+
+@csrf_exempt
+async def notifications_collection(request):
+    if request.method == 'GET':
+        return await run_sync(list_notifications, request)
+    return await create_notification(request)
+
+
+@csrf_exempt
+@require_POST
+async def create_notification(request):
+
+    claimed = None
+    notification_service = AsyncNotificationService()
+    try:
+        try:
+            payload = _load_body(request)
+        except ValueError as e:
+            return _error_response('Parse error', f'JSON parse error - {e}', status.HTTP_400_BAD_REQUEST)
+
+        data = validate_notification(payload)
+        if data is None:
+            serializer = NotificationCreateSerializer(data=payload)
+            if not serializer.is_valid():
+                return _error_response(
+                    'Validation failed', 'Invalid request data', status.HTTP_400_BAD_REQUEST, serializer.errors
+                )
+            data = serializer.validated_data
+        request_id = data['request_id']
+
+        claim = await notification_service.claim_idempotency(request_id)
+        if claim.response is not None:
+            logger.info("Idempotent request detected: %s", request_id)
+            return JsonResponse(claim.response)
+        if not claim.claimed:
+            return _error_response(
+                'Request in progress',
+                'A request with this request_id is already being processed',
+                status.HTTP_409_CONFLICT
+            )
+        claimed = request_id
+
+        if await notification_service.suppress_duplicate(data):
+            logger.info("Notification %s repeats recent content, suppressed", request_id)
+            response_data = suppressed_response(request_id)
+            await notification_service.store_idempotency_key(request_id, response_data)
+            return JsonResponse(response_data)
+
+        retry_after = await notification_service.user_retry_after(data)
+        if retry_after:
+            await notification_service.release_idempotency_key(request_id)
+            return rate_limited_response(retry_after, 'Too many notifications for this user')
+
+        if await notification_service.send_notification(data):
+            response_data = api_response({
+                'success': True,
+                'data': {
+                    'notification_id': data['request_id'],
+                    'status': 'queued'
+                },
+                'message': 'Notification queued successfully'
+            })
+            await notification_service.store_idempotency_key(request_id, response_data)
+            return JsonResponse(response_data, status=status.HTTP_202_ACCEPTED)
+
+        await notification_service.release_idempotency_key(request_id)
+        return _error_response('Queueing failed', 'Failed to queue notification', status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    except Exception as e:
+        logger.error("Error creating notification: %s", e)
+        if claimed is not None:
+            await notification_service.release_idempotency_key(claimed)
+        return _error_response(
+            'Internal server error',
+            'An error occurred while processing your request',
+            status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@csrf_exempt
+@require_POST
+async def create_notifications_batch(request):
+
+    try:
+        try:
+            items = _load_body(request)
+        except ValueError as e:
+            return _error_response('Parse error', f'JSON parse error - {e}', status.HTTP_400_BAD_REQUEST)
+
+        max_items = settings.NOTIFICATION_BATCH_MAX_ITEMS
+        if not isinstance(items, list) or not items or len(items) > max_items:
+            return _error_response(
+                'Validation failed',
+                f'Expected a JSON array or NDJSON body of 1 to {max_items} notifications',
+                status.HTTP_400_BAD_REQUEST
+            )
+
+        results, valid, valid_indexes = _validate_batch(NotificationCreateSerializer(), items)
+        if valid:
+            notification_service = AsyncNotificationService()
+            for index, result in zip(valid_indexes, await notification_service.send_batch(valid)):
+                results[index] = {'index': index, **result}
+
+        response_data, response_status = _batch_response(results)
+        return JsonResponse(response_data, status=response_status)
+
+    except Exception as e:
+        logger.error("Error creating notification batch: %s", e)
+        return _error_response(
+            'Internal server error',
+            'An error occurred while processing your request',
+            status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@csrf_exempt
+@require_POST
+async def update_notification_status(request, notification_type):
+
+    try:
+        try:
+            payload = _load_body(request)
+        except ValueError as e:
+            return _error_response('Parse error', f'JSON parse error - {e}', status.HTTP_400_BAD_REQUEST)
+
+        serializer = NotificationStatusUpdateSerializer(data=payload)
+        if not serializer.is_valid():
+            return _error_response('Validation failed', 'Invalid status update data', status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        notification_id = data['notification_id']
+        updated = await run_sync(apply_status_update, notification_id, data['status'])
+        if updated is None:
+            return _error_response('Not found', 'Notification not found', status.HTTP_404_NOT_FOUND)
+
+        if updated:
+            logger.info("Notification %s status updated to %s", notification_id, data['status'])
+            message = 'Status updated successfully'
+        else:
+            logger.info("Notification %s kept its status, ignoring %s", notification_id, data['status'])
+            message = 'Status unchanged'
+        return JsonResponse(api_response({'success': True, 'message': message}))
+
+    except Exception as e:
+        logger.error("Error updating notification status: %s", e)
+        return _error_response('Internal server error', 'Failed to update status', status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@require_POST
+async def update_notification_status_batch(request, notification_type):
+
+    try:
+        try:
+            items = _load_body(request)
+        except ValueError as e:
+            return _error_response('Parse error', f'JSON parse error - {e}', status.HTTP_400_BAD_REQUEST)
+
+        max_items = settings.NOTIFICATION_BATCH_MAX_ITEMS
+        if not isinstance(items, list) or not items or len(items) > max_items:
+            return _error_response(
+                'Validation failed',
+                f'Expected a JSON array of 1 to {max_items} status updates',
+                status.HTTP_400_BAD_REQUEST
+            )
+
+        updates, invalid = _validate_status_updates(items)
+        if not updates:
+            return _error_response(
+                'Validation failed', 'Invalid status update data', status.HTTP_400_BAD_REQUEST, {'invalid': invalid}
+            )
+
+        updated = await run_sync(apply_status_updates, updates)
+        logger.info("Applied %s of %s %s status updates", len(updated), len(updates), notification_type)
+        return JsonResponse(_status_batch_response(items, updates, invalid, updated))
+
+    except Exception as e:
+        logger.error("Error updating notification statuses: %s", e)
+        return _error_response('Internal server error', 'Failed to update statuses', status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,283 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .caching import redis_client
+
+logger = logging.getLogger('notifications')
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+
+# Returns 0 while open (or while another caller holds the half-open trial),
+# 1 when closed, 2 when this caller won the trial.
+ALLOW_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 1
+end
+if redis.call('SET', KEYS[3], '1', 'NX', 'PX', ARGV[1]) then
+    return 2
+end
+return 0
+"""
+
+# Counts a failure within the window; opens the breaker at the threshold, or
+# straight away when the failure ends a half-open trial. Returns 1 if it
+# opened the breaker.
+FAILURE_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 0 then
+    local failures = redis.call('INCR', KEYS[1])
+    if failures == 1 then
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+    if failures < tonumber(ARGV[1]) then
+        return 0
+    end
+elseif redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('SET', KEYS[2], '1', 'EX', ARGV[3])
+redis.call('SET', KEYS[3], '1')
+redis.call('DEL', KEYS[1], KEYS[4])
+return 1
+"""
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class LocalFailure(Exception):
+    """
+    A call that failed on this side, e.g. for want of a free connection.
+    It says nothing about the dependency, so the breaker does not count it.
+    """
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker whose state lives in Redis, so every worker on every
+    node trips and recovers together.
+
+    ``failure_threshold`` failures within ``failure_window`` seconds open it
+    for ``recovery_timeout`` seconds. After that it is half-open: one caller,
+    chosen with ``SET NX``, makes a trial call that closes the breaker or
+    opens it again, and everyone else keeps failing fast. While closed, a
+    worker only reads Redis once per ``refresh`` seconds and writes to it
+    after a failure. Other cache backends keep the state per process.
+    """
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30, failure_window=60, refresh=1.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failure_window = failure_window
+        self.refresh = refresh
+        self.redis = redis_client()
+        if self.redis is not None:
+            self._allow_script = self.redis.register_script(ALLOW_SCRIPT)
+            self._failure_script = self.redis.register_script(FAILURE_SCRIPT)
+        self._lock = threading.Lock()
+        self._closed_until = 0
+        self._failed = False
+        # Process-local state for non-Redis caches
+        self._failures = []
+        self._opened_at = None
+        self._trial_at = None
+
+    def _keys(self, *names):
+        return [cache.make_key(f"circuit:{self.name}:{name}") for name in names]
+
+    def call(self, func, *args, **kwargs):
+        state = self.allow()
+        if state is None:
+            raise CircuitOpenError(f"Circuit breaker {self.name} is open")
+        try:
+            result = func(*args, **kwargs)
+        except LocalFailure:
+            self.record_skipped(state)
+            raise
+        except Exception:
+            self.record_failure(state)
+            raise
+        self.record_success(state)
+        return result
+
+    def allow(self):
+        """
+        Returns None if the call must not be made, else the state to pass to
+        ``record_success`` or ``record_failure`` afterwards.
+        """
+        if time.monotonic() < self._closed_until:
+            return CLOSED
+        try:
+            if self.redis is None:
+                allowed = self._allow_local()
+            else:
+                allowed = self._allow_script(
+                    keys=self._keys('open', 'tripped', 'trial'),
+                    args=[int(self.recovery_timeout * 1000)]
+                )
+        except Exception as e:
+            # Without Redis there is no shared state; let calls through.
+            logger.error("Circuit breaker %s unavailable: %s", self.name, e)
+            return CLOSED
+
+        if allowed == 1:
+            self._closed_until = time.monotonic() + self.refresh
+            return CLOSED
+        if allowed == 2:
+            logger.info("Circuit breaker %s half-open, trying one call", self.name)
+            return HALF_OPEN
+        return None
+
+    def is_open(self):
+        """True while calls are refused, without claiming the half-open trial."""
+        if time.monotonic() < self._closed_until:
+            return False
+        try:
+            if self.redis is None:
+                with self._lock:
+                    return self._opened_at is not None and (
+                        time.monotonic() - self._opened_at < self.recovery_timeout
+                        or self._trial_at is not None
+                    )
+            open_key, tripped, trial = self._keys('open', 'tripped', 'trial')
+            return bool(self.redis.exists(open_key)) or (
+                bool(self.redis.exists(tripped)) and bool(self.redis.exists(trial))
+            )
+        except Exception as e:
+            logger.error("Circuit breaker %s unavailable: %s", self.name, e)
+            return False
+
+    def retry_in(self):
+        """Seconds until a half-open trial may be claimed; 0 unless the breaker is open."""
+        if time.monotonic() < self._closed_until:
+            return 0
+        try:
+            if self.redis is None:
+                now = time.monotonic()
+                with self._lock:
+                    if self._opened_at is None:
+                        return 0
+                    since = self._opened_at if self._trial_at is None else self._trial_at
+                    return max(0, self.recovery_timeout - (now - since))
+            open_key, trial = self._keys('open', 'trial')
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.pttl(open_key)
+            pipe.pttl(trial)
+            # -2 or -1 when a key is missing or has no expiry
+            return max(0, *pipe.execute()) / 1000
+        except Exception as e:
+            logger.error("Circuit breaker %s unavailable: %s", self.name, e)
+            return 0
+
+    def reports_success(self, state):
+        """Whether ``record_success(state)`` has anything to write."""
+        return state != CLOSED or self._failed
+
+    def record_success(self, state):
+        if not self.reports_success(state):
+            return
+        try:
+            if self.redis is None:
+                self._success_local(state)
+            elif state == HALF_OPEN:
+                self.redis.delete(*self._keys('tripped', 'trial', 'failures'))
+            else:
+                self.redis.delete(*self._keys('failures'))
+        except Exception as e:
+            logger.error("Circuit breaker %s unavailable: %s", self.name, e)
+            return
+        self._failed = False
+        if state == HALF_OPEN:
+            logger.info("Circuit breaker %s closed", self.name)
+
+    def record_failure(self, state):
+        self._closed_until = 0
+        self._failed = True
+        try:
+            if self.redis is None:
+                opened = self._failure_local()
+            else:
+                opened = self._failure_script(
+                    keys=self._keys('failures', 'open', 'tripped', 'trial'),
+                    args=[self.failure_threshold, int(self.failure_window), int(self.recovery_timeout)]
+                )
+        except Exception as e:
+            logger.error("Circuit breaker %s unavailable: %s", self.name, e)
+            return
+        if opened:
+            logger.warning("Circuit breaker %s opened for %ss", self.name, self.recovery_timeout)
+
+    def record_skipped(self, state):
+        """The call never reached the dependency; a half-open trial goes to the next caller."""
+        if state != HALF_OPEN:
+            return
+        try:
+            if self.redis is None:
+                with self._lock:
+                    self._trial_at = None
+            else:
+                self.redis.delete(*self._keys('trial'))
+        except Exception as e:
+            logger.error("Circuit breaker %s unavailable: %s", self.name, e)
+
+    def _allow_local(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._opened_at is None:
+                return 1
+            if now - self._opened_at < self.recovery_timeout:
+                return 0
+            if self._trial_at is not None and now - self._trial_at < self.recovery_timeout:
+                return 0
+            self._trial_at = now
+            return 2
+
+    def _success_local(self, state):
+        with self._lock:
+            self._failures = []
+            if state == HALF_OPEN:
+                self._opened_at = None
+                self._trial_at = None
+
+    def _failure_local(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._opened_at is None:
+                self._failures = [t for t in self._failures if now - t < self.failure_window]
+                self._failures.append(now)
+                if len(self._failures) < self.failure_threshold:
+                    return 0
+            elif now - self._opened_at < self.recovery_timeout:
+                return 0
+            self._opened_at = now
+            self._trial_at = None
+            self._failures = []
+            return 1
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name):
+    """The process-wide breaker for ``name``; its state is shared through Redis."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    name,
+                    failure_threshold=settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                    recovery_timeout=settings.CIRCUIT_BREAKER_RECOVERY_TIMEOUT,
+                    failure_window=settings.CIRCUIT_BREAKER_FAILURE_WINDOW,
+                )
+                _breakers[name] = breaker
+    return breaker
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from django.conf import settings
+
+
+def redis_client():
+    """The raw Redis client behind the default cache, or ``None`` without django-redis."""
+    if 'django_redis' not in settings.CACHES['default']['BACKEND']:
+        return None
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
+
+
+class LocalCache:
+    """A thread-safe LRU of at most ``size`` entries, each kept for ``ttl`` seconds."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                value, expires_at = entry
+                if expires_at <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, values):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class SingleFlight:
+    """Lets one caller fetch a key while concurrent callers wait for its result."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def claim(self, keys):
+        """Returns the keys this caller must fetch and futures for the others."""
+        owned = []
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                future = self._calls.get(key)
+                if future is None:
+                    self._calls[key] = Future()
+                    owned.append(key)
+                else:
+                    waiting[key] = future
+        return owned, waiting
+
+    def resolve(self, keys, values):
+        with self._lock:
+            futures = [(key, self._calls.pop(key)) for key in keys]
+        for key, future in futures:
+            future.set_result(values.get(key))
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .caching import LocalCache, redis_client
+from .fastjson import orjson
+from .metrics import SUPPRESSED, timed
+
+logger = logging.getLogger('notifications')
+
+
+def content_hash(item):
+    """Hash of what the recipient would receive, whatever the request_id."""
+    content = [str(item['user_id']), item['notification_type'], item['template_code'], item['variables']]
+    if orjson is not None:
+        canonical = orjson.dumps(content, option=orjson.OPT_SORT_KEYS)
+    else:
+        canonical = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
+    return hashlib.blake2b(canonical, digest_size=16).hexdigest()
+
+
+class ContentDeduplicator:
+    """
+    Suppresses notifications whose content repeats one accepted within the
+    last ``window`` seconds, which request_id idempotency cannot see when
+    upstream retries with a new id.
+
+    Redis is authoritative: each new hash is claimed with ``SET NX EX``, one
+    pipelined round trip per batch. Hashes this process claimed are also
+    kept in memory, so its own repeats are suppressed without a round trip.
+
+    There is deliberately no Bloom or cuckoo filter in front of Redis. A
+    local "never seen" answer only covers this process, so unique content
+    still has to be claimed where every process can see it; and a filter's
+    false positives would drop notifications nobody sent before. The exact
+    LRU above skips Redis only for repeats it is certain of.
+    """
+
+    def __init__(self, window, local_size):
+        self.window = window
+        self.recent = LocalCache(local_size, window) if local_size else None
+        self.redis = redis_client()
+
+    def cache_key(self, content):
+        return f"dedup:{content}"
+
+    def claim(self, items):
+        """
+        Claim the content of ``items``. Returns the request ids to suppress
+        and ``{request_id: hash}`` for the ones claimed. Later items repeating
+        an earlier one in the same call are suppressed.
+        """
+        contents = [content_hash(item) for item in items]
+        recent = self.recent.get_many(contents) if self.recent is not None else {}
+        suppressed = set()
+        pending = {}
+        local = 0
+        for item, content in zip(items, contents):
+            if content in pending or content in recent:
+                suppressed.add(item['request_id'])
+                local += 1
+            else:
+                pending[content] = item['request_id']
+
+        taken = set()
+        if pending:
+            with timed('cache', 'dedup'):
+                taken = self._claim_remote(pending)
+
+        claimed = {}
+        for content, request_id in pending.items():
+            if content in taken:
+                suppressed.add(request_id)
+            else:
+                claimed[request_id] = content
+        if self.recent is not None:
+            self.recent.set_many({content: True for content in claimed.values()})
+
+        SUPPRESSED.labels('local').inc(local)
+        SUPPRESSED.labels('redis').inc(len(taken))
+        return suppressed, claimed
+
+    def _claim_remote(self, pending):
+        if self.redis is None:
+            return {
+                content for content, request_id in pending.items()
+                if not cache.add(self.cache_key(content), request_id, timeout=self.window)
+            }
+        pipe = self.redis.pipeline(transaction=False)
+        for content, request_id in pending.items():
+            pipe.set(cache.make_key(self.cache_key(content)), request_id, nx=True, ex=self.window)
+        return {content for content, claimed in zip(pending, pipe.execute()) if not claimed}
+
+    def release(self, contents):
+        """Forget claims for notifications that were not sent after all."""
+        if not contents:
+            return
+        if self.recent is not None:
+            self.recent.delete_many(contents)
+        try:
+            cache.delete_many([self.cache_key(content) for content in contents])
+        except Exception as e:
+            logger.error("Could not release %s content claims: %s", len(contents), e)
+
+
+_deduplicator = None
+
+
+def get_deduplicator():
+    """The content deduplicator, or ``None`` when NOTIFICATION_DEDUP_WINDOW is 0."""
+    global _deduplicator
+    if not settings.NOTIFICATION_DEDUP_WINDOW:
+        return None
+    if _deduplicator is None:
+        _deduplicator = ContentDeduplicator(
+            settings.NOTIFICATION_DEDUP_WINDOW, settings.NOTIFICATION_DEDUP_LOCAL_SIZE
+        )
+    return _deduplicator
@@ -0,0 +1,198 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from .enrichment import get_enricher
+from .metrics import timed
+from .models import DigestEntry, Notification, NotificationDigest, NotificationStatus
+from .services import RabbitMQService, routing_key_for
+from .status_cache import get_status_cache
+
+logger = logging.getLogger('notifications')
+
+# What each held notification contributes to a digest's variables; the
+# recipient and priority are the digest's own.
+DIGEST_ITEM_KEYS = ('notification_id', 'template_code', 'variables', 'request_id')
+
+
+def digest_message(entries):
+    """
+    One message for a recipient's held notifications. A lone entry goes out
+    as the plain message it would have been.
+    """
+    if len(entries) == 1:
+        return entries[0].payload
+    first = entries[0].payload
+    return {
+        'notification_ids': [str(entry.notification_id) for entry in entries],
+        'user_id': first['user_id'],
+        'template_code': settings.NOTIFICATION_DIGEST_TEMPLATE,
+        'variables': {
+            'notifications': [
+                {key: entry.payload[key] for key in DIGEST_ITEM_KEYS}
+                for entry in entries
+            ],
+        },
+        'request_id': f"digest:{first['notification_id']}",
+        'priority': 1,
+    }
+
+
+def deliverable(routing_key, message):
+    """Whether a consumer can act on ``message`` as it is."""
+    if routing_key.split('.', 1)[0] == 'push':
+        return bool(message.get('device_token') and (message.get('payload') or {}).get('title'))
+    return True
+
+
+def looked_up(message):
+    """Whether both the recipient and the template were found for ``message``."""
+    return 'preferences' in message and 'body' in message
+
+
+class DigestFlusher:
+    """
+    Publishes held notifications as one message per (user_id,
+    notification_type).
+
+    A bucket is due once its oldest entry has waited ``window`` seconds or it
+    holds ``max_items`` entries, which its entries' indexed ``due_at``
+    records; each pass reads only due entries and takes up to ``batch_size``
+    due buckets, oldest first. The rest of a full bucket that was flushed
+    waits for its own window again. Their entries are locked with ``SKIP LOCKED`` so
+    flushers can run side by side, published with confirms in chunks of
+    ``max_items``, and deleted once the broker accepted them. Rejected ones
+    stay and go out on a later pass; their notifications are never marked
+    failed here.
+
+    Digests are always enriched, since no consumer can look up a digest's
+    recipient by itself. When enrichment fails the whole pass is retried, and
+    a push digest whose recipient or template could not be found waits for a
+    later pass. One still without a device token or title once both were
+    found, or once its oldest entry is ``max_age`` seconds old, is
+    undeliverable: its notifications are marked failed and its entries
+    dropped.
+
+    Each multi-entry digest's request_id is recorded with the request_ids it
+    carries, so a status reported for the digest applies to all of them.
+    """
+
+    def __init__(self, batch_size=None, window=None, max_items=None, max_age=None, rabbitmq=None,
+                 enricher=None):
+        self.batch_size = batch_size or settings.DIGEST_FLUSH_BATCH_SIZE
+        self.window = window or settings.NOTIFICATION_DIGEST_WINDOW
+        self.max_items = max_items or settings.NOTIFICATION_DIGEST_MAX_ITEMS
+        self.max_age = max_age or settings.NOTIFICATION_DIGEST_MAX_AGE
+        self.rabbitmq = rabbitmq or RabbitMQService()
+        self.enricher = enricher
+
+    def due_buckets(self, now):
+        # Every entry at least ``window`` old is due, so a bucket's oldest
+        # due entry is its oldest entry whenever the bucket has timed out.
+        return list(
+            DigestEntry.objects
+            .filter(due_at__lte=now)
+            .values('user_id', 'notification_type')
+            .annotate(oldest=Min('created_at'))
+            .order_by('oldest')[:self.batch_size]
+        )
+
+    def flush_batch(self):
+        now = timezone.now()
+        with timed('database', 'digest_buckets'):
+            buckets = self.due_buckets(now)
+        if not buckets:
+            return 0
+
+        cutoff = now - timedelta(seconds=self.window)
+        timed_out = {(b['user_id'], b['notification_type']) for b in buckets if b['oldest'] <= cutoff}
+        wanted = {(b['user_id'], b['notification_type']) for b in buckets}
+        with transaction.atomic():
+            rows = (
+                DigestEntry.objects
+                .select_for_update(skip_locked=True)
+                .filter(
+                    user_id__in={user_id for user_id, _ in wanted},
+                    notification_type__in={notification_type for _, notification_type in wanted}
+                )
+                .order_by('id')
+            )
+            grouped = {}
+            for row in rows:
+                bucket = (row.user_id, row.notification_type)
+                if bucket in wanted:
+                    grouped.setdefault(bucket, []).append(row)
+
+            digests = []
+            waiting = []
+            for bucket, entries in grouped.items():
+                for start in range(0, len(entries), self.max_items):
+                    chunk = entries[start:start + self.max_items]
+                    # Full buckets only send full digests; the rest waits for
+                    # its own window.
+                    if len(chunk) < self.max_items and bucket not in timed_out:
+                        waiting += chunk
+                        break
+                    digests.append(chunk)
+            if waiting:
+                DigestEntry.objects.filter(id__in=[row.id for row in waiting]).update(
+                    due_at=F('created_at') + timedelta(seconds=self.window)
+                )
+            if not digests:
+                return 0
+
+            messages = [
+                (routing_key_for(chunk[0].notification_type, 1), digest_message(chunk)) for chunk in digests
+            ]
+            try:
+                messages = (self.enricher or get_enricher()).enrich(messages)
+            except Exception as e:
+                logger.error("Digest enrichment failed, retrying on the next pass: %s", e)
+                return 0
+
+            expired = now - timedelta(seconds=self.max_age)
+            ready, undeliverable = [], []
+            for chunk, (routing_key, message) in zip(digests, messages):
+                if deliverable(routing_key, message):
+                    ready.append((chunk, (routing_key, message)))
+                elif looked_up(message) or chunk[0].created_at <= expired:
+                    undeliverable.append(chunk)
+            NotificationDigest.objects.bulk_create(
+                [
+                    NotificationDigest(
+                        request_id=message['request_id'],
+                        request_ids=[item['request_id'] for item in message['variables']['notifications']]
+                    )
+                    for chunk, (_, message) in ready if len(chunk) > 1
+                ],
+                ignore_conflicts=True
+            )
+            failed = set()
+            if ready:
+                failed = self.rabbitmq.publish_batch([pair for _, pair in ready], mark_failed=False)
+            sent = [
+                row.id for chunk, _ in ready for row in chunk if str(row.notification_id) not in failed
+            ]
+            dropped = [row for chunk in undeliverable for row in chunk]
+            if dropped:
+                self.fail(dropped)
+            DigestEntry.objects.filter(id__in=sent + [row.id for row in dropped]).delete()
+
+        logger.info(
+            "Flushed %s digests carrying %s notifications (%s to retry, %s undeliverable)",
+            len(ready), len(sent),
+            sum(len(chunk) for chunk in digests) - len(sent) - len(dropped), len(dropped)
+        )
+        return len(sent) + len(dropped)
+
+    def fail(self, rows):
+        notification_ids = [row.notification_id for row in rows]
+        updated = Notification.objects.recent().filter(
+            id__in=notification_ids, status=NotificationStatus.PENDING
+        ).update(status=NotificationStatus.FAILED, updated_at=timezone.now())
+        get_status_cache().invalidate(notification_ids)
+        logger.warning("Marked %s notifications failed: their push digest has no device token or title", updated)
@@ -0,0 +1,317 @@
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+
+import requests
+
+from .breaker import get_circuit_breaker
+from .caching import LocalCache, SingleFlight
+
+logger = logging.getLogger('notifications')
+
+# Cached for entities the upstream service does not know, so that they are
+# not looked up again on every message.
+MISSING = False
+
+PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+
+def render(text, variables):
+    if not text:
+        return text
+    return PLACEHOLDER.sub(lambda match: str(variables.get(match.group(1), match.group(0))), text)
+
+
+class CachedLookup:
+    """
+    Looks entities up in process memory, then Redis (one multi-get), then
+    upstream. Concurrent misses for the same key share one upstream fetch.
+    """
+
+    def __init__(self, name, fetch_many, local_size, local_ttl, shared_ttl, wait_timeout):
+        self.name = name
+        self.fetch_many = fetch_many
+        self.local = LocalCache(local_size, local_ttl)
+        self.shared_ttl = shared_ttl
+        self.wait_timeout = wait_timeout
+        self.inflight = SingleFlight()
+
+    def cache_key(self, key):
+        return f"enrichment_{self.name}_{key}"
+
+    def get_many(self, keys):
+        keys = set(keys)
+        found = self.local.get_many(keys)
+        missing = keys - found.keys()
+        if missing:
+            found.update(self._get_shared(missing))
+            missing = keys - found.keys()
+        if missing:
+            found.update(self._fetch(missing))
+        return {key: value for key, value in found.items() if value is not MISSING and value is not None}
+
+    def _get_shared(self, keys):
+        try:
+            cached = cache.get_many([self.cache_key(key) for key in keys])
+        except Exception as e:
+            logger.error("Enrichment cache unavailable: %s", e)
+            return {}
+        found = {key: cached[self.cache_key(key)] for key in keys if self.cache_key(key) in cached}
+        self.local.set_many(found)
+        return found
+
+    def _fetch(self, keys):
+        owned, waiting = self.inflight.claim(keys)
+        found = {}
+        fetched = {}
+        try:
+            if owned:
+                fetched = self.fetch_many(owned)
+                found.update(fetched)
+        except Exception as e:
+            logger.error("Failed to fetch %s for enrichment: %s", self.name, e)
+        finally:
+            self.inflight.resolve(owned, fetched)
+
+        # Failed lookups are left uncached so the next message retries them.
+        results = {key: value for key, value in fetched.items() if value is not None}
+        if results:
+            self.local.set_many(results)
+            try:
+                cache.set_many({self.cache_key(key): value for key, value in results.items()}, timeout=self.shared_ttl)
+            except Exception as e:
+                logger.error("Enrichment cache unavailable: %s", e)
+
+        for key, future in waiting.items():
+            try:
+                found[key] = future.result(timeout=self.wait_timeout)
+            except Exception:
+                pass
+        return found
+
+
+class UserServiceClient:
+    """Fetches contact data, preferences and push tokens from the User Service."""
+
+    def __init__(self, base_url, token='', timeout=3.0, max_workers=8):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='user-service')
+        self.breaker = get_circuit_breaker('user-service')
+
+    def fetch_many(self, user_ids):
+        """
+        Returns ``{user_id: user}``, MISSING for unknown users and None on
+        errors. The User Service has no bulk lookup, so each user costs two
+        requests: the user, which embeds its preferences, and its push
+        tokens. All of them are in flight at once, up to ``max_workers``.
+        """
+        if self.breaker.is_open():
+            logger.warning("User service circuit is open, skipping %s lookups", len(user_ids))
+            return dict.fromkeys(user_ids)
+        users = {
+            user_id: self.executor.submit(self._call, f"/api/v1/users/{user_id}") for user_id in user_ids
+        }
+        push_tokens = {
+            user_id: self.executor.submit(self._call, f"/api/v1/users/{user_id}/push-tokens")
+            for user_id in user_ids
+        }
+        return {
+            user_id: self._combine(user_id, users[user_id], push_tokens[user_id]) for user_id in user_ids
+        }
+
+    def _get(self, path):
+        response = self.session.get(f"{self.base_url}{path}", timeout=self.timeout)
+        # 403: the push-tokens route only answers for the caller's own user;
+        # that is not an outage, so it must not count against the breaker.
+        if response.status_code in (403, 404):
+            return MISSING
+        response.raise_for_status()
+        return response.json().get('data')
+
+    def _call(self, path):
+        return self.breaker.call(self._get, path)
+
+    def _combine(self, user_id, user, push_tokens):
+        try:
+            user = user.result()
+        except Exception as e:
+            logger.error("User service lookup failed for %s: %s", user_id, e)
+            return None
+        if user is MISSING:
+            return MISSING
+        try:
+            push_tokens = push_tokens.result()
+        except Exception as e:
+            # The contact data is still worth sending; push consumers look
+            # the device up themselves when device_token is absent.
+            logger.error("Push token lookup failed for %s: %s", user_id, e)
+            push_tokens = []
+        if push_tokens is MISSING:
+            push_tokens = []
+        return {
+            'email': user.get('email'),
+            'name': ' '.join(filter(None, [user.get('first_name'), user.get('last_name')])),
+            'preferences': user.get('preferences') or {},
+            'push_tokens': [
+                token['token'] for token in push_tokens or [] if token.get('token') and token.get('is_active', True)
+            ],
+        }
+
+
+class TemplateServiceClient:
+    """Fetches templates by name (the notification's template_code)."""
+
+    def __init__(self, base_url, token='', timeout=3.0, max_workers=4):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='template-service')
+        self.breaker = get_circuit_breaker('template-service')
+
+    def fetch_many(self, template_codes):
+        if self.breaker.is_open():
+            logger.warning("Template service circuit is open, skipping %s lookups", len(template_codes))
+            return dict.fromkeys(template_codes)
+        return dict(zip(template_codes, self.executor.map(self._fetch, template_codes)))
+
+    def _load(self, template_code):
+        response = self.session.get(
+            f"{self.base_url}/api/v1/templates/name/{template_code}", timeout=self.timeout
+        )
+        if response.status_code == 404:
+            return MISSING
+        response.raise_for_status()
+        return response.json().get('data') or {}
+
+    def _fetch(self, template_code):
+        try:
+            template = self.breaker.call(self._load, template_code)
+        except Exception as e:
+            logger.error("Template service lookup failed for %s: %s", template_code, e)
+            return None
+        if template is MISSING:
+            return MISSING
+        return {key: template.get(key) for key in ('id', 'name', 'type', 'subject', 'body')}
+
+
+class InMemoryUserService:
+    """Stands in for the User Service in tests and local runs."""
+
+    def __init__(self, users=None):
+        self.users = users or {}
+        self.calls = 0
+
+    def fetch_many(self, user_ids):
+        self.calls += 1
+        return {user_id: self.users.get(user_id, MISSING) for user_id in user_ids}
+
+
+class InMemoryTemplateService:
+    """Stands in for the Template Service in tests and local runs."""
+
+    def __init__(self, templates=None):
+        self.templates = templates or {}
+        self.calls = 0
+
+    def fetch_many(self, template_codes):
+        self.calls += 1
+        return {code: self.templates.get(code, MISSING) for code in template_codes}
+
+
+class Enricher:
+    """
+    Adds what delivery workers need to each message: ``recipient_id``, the
+    user's email and preferences, a ``device_token`` for push, and the
+    template rendered into ``subject``/``body`` and a push ``payload``.
+
+    One pass looks up each distinct user and template once, so the cost per
+    message falls with batch size and cache hit rate.
+    """
+
+    def __init__(self, user_service, template_service, local_size=10000, local_ttl=60,
+                 shared_ttl=300, wait_timeout=3.0):
+        self.user_service = user_service
+        self.users = CachedLookup('user', user_service.fetch_many, local_size, local_ttl, shared_ttl, wait_timeout)
+        self.templates = CachedLookup(
+            'template', template_service.fetch_many, local_size, local_ttl, shared_ttl, wait_timeout
+        )
+
+    def enrich(self, messages):
+        """Enrich ``(routing_key, message)`` pairs; returns new pairs."""
+        users = self.users.get_many({message['user_id'] for _, message in messages})
+        templates = self.templates.get_many({message['template_code'] for _, message in messages})
+        return [
+            (routing_key, self._enrich(routing_key, message, users, templates))
+            for routing_key, message in messages
+        ]
+
+    def _enrich(self, routing_key, message, users, templates):
+        message = dict(message, recipient_id=message['user_id'])
+        notification_type = routing_key.split('.', 1)[0]
+        variables = message.get('variables') or {}
+
+        user = users.get(message['user_id'])
+        if user is not None:
+            message['email'] = user.get('email')
+            message['preferences'] = user.get('preferences')
+            if notification_type == 'push' and user.get('push_tokens'):
+                message['device_token'] = user['push_tokens'][0]
+
+        template = templates.get(message['template_code'])
+        if template is not None:
+            message['subject'] = render(template.get('subject'), variables)
+            message['body'] = render(template.get('body'), variables)
+            if notification_type == 'push':
+                message['payload'] = {
+                    'title': message['subject'] or template.get('name'),
+                    'body': message['body'],
+                    'data': variables,
+                }
+        return message
+
+
+_enricher = None
+_enricher_lock = threading.Lock()
+
+
+def get_enricher():
+    global _enricher
+    if _enricher is None:
+        with _enricher_lock:
+            if _enricher is None:
+                token = settings.UPSTREAM_SERVICE_TOKEN
+                timeout = settings.UPSTREAM_TIMEOUT
+                _enricher = Enricher(
+                    UserServiceClient(settings.USER_SERVICE_URL, token, timeout),
+                    TemplateServiceClient(settings.TEMPLATE_SERVICE_URL, token, timeout),
+                    local_size=settings.ENRICHMENT_LOCAL_CACHE_SIZE,
+                    local_ttl=settings.ENRICHMENT_LOCAL_TTL,
+                    shared_ttl=settings.ENRICHMENT_CACHE_TTL,
+                    wait_timeout=timeout,
+                )
+    return _enricher
+
+
+def enrich_messages(messages, enricher=None):
+    """
+    Enrich ``(routing_key, message)`` pairs when NOTIFICATION_ENRICHMENT is
+    on. Messages go out as they are if enrichment fails; consumers can still
+    look the data up themselves.
+    """
+    messages = list(messages)
+    if not messages or (enricher is None and not settings.NOTIFICATION_ENRICHMENT):
+        return messages
+    try:
+        return (enricher or get_enricher()).enrich(messages)
+    except Exception as e:
+        logger.error("Enrichment failed, publishing unenriched messages: %s", e)
+        return messages
@@ -0,0 +1,53 @@
+import json
+import zlib
+
+from .fastjson import dumps
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Wire formats for notification messages. A plain message is one JSON object.
+# An envelope carries several notifications for the same queue and priority
+# in one AMQP message: a msgpack array (a JSON array without msgpack), deflated
+# once it reaches the compression threshold. Consumers tell them apart by the
+# AMQP type property and decode either with decode_messages().
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+DEFLATE = 'deflate'
+ENVELOPE_TYPE = 'notification.batch'
+
+# Envelopes are compressed on the publish path; level 1 gets most of the size
+# reduction of the default level at a fraction of the cost.
+COMPRESSION_LEVEL = 1
+
+
+def encode_message(message):
+    """``(body, content_type)`` for one notification in the plain format."""
+    return dumps(message), JSON
+
+
+def encode_envelope(messages, compress_min_bytes=0):
+    """``(body, content_type, content_encoding)`` for a list of notifications."""
+    if msgpack is not None:
+        body, content_type = msgpack.packb(messages), MSGPACK
+    else:
+        body, content_type = dumps(messages), JSON
+    if compress_min_bytes and len(body) >= compress_min_bytes:
+        return zlib.compress(body, COMPRESSION_LEVEL), content_type, DEFLATE
+    return body, content_type, None
+
+
+def decode_messages(body, content_type=None, content_encoding=None, message_type=None):
+    """The notifications carried by an AMQP message, in either format."""
+    if content_encoding == DEFLATE:
+        body = zlib.decompress(body)
+    if content_type == MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack is not installed")
+        payload = msgpack.unpackb(body)
+    else:
+        payload = json.loads(body)
+    return payload if message_type == ENVELOPE_TYPE else [payload]
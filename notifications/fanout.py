@@ -0,0 +1,211 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .enrichment import get_enricher
+from .models import FanOutJob, FanOutStatus
+from .services import NotificationService
+
+logger = logging.getLogger('notifications')
+
+# The User Service preference that switches each channel on or off.
+CHANNEL_PREFERENCES = {
+    'email': 'email_notifications',
+    'push': 'push_notifications',
+}
+
+
+class FanOut:
+    """
+    Expands one request into a notification per recipient and channel.
+
+    Recipients are read ``chunk_size`` at a time from the request's user ids.
+    Channels a recipient has switched off in their preferences (cached, as
+    for enrichment) are dropped. Each chunk is then inserted and published as
+    one batch, so memory use does not grow with the audience. Every notification gets the request id
+    ``<request_id>:<user_id>:<channel>``, which makes a retried fan-out skip
+    whatever already went out.
+    """
+
+    def __init__(self, notification_service=None, enricher=None, chunk_size=None):
+        self.service = notification_service or NotificationService()
+        self.enricher = enricher
+        self.chunk_size = chunk_size or settings.FANOUT_CHUNK_SIZE
+
+    def _get_enricher(self):
+        if self.enricher is None and settings.USER_SERVICE_URL:
+            self.enricher = get_enricher()
+        return self.enricher
+
+    def recipients(self, data):
+        chunk = []
+        for user_id in (str(user_id) for user_id in data['user_ids']):
+            chunk.append(user_id)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def preferences(self, user_ids):
+        enricher = self._get_enricher()
+        if enricher is None:
+            return {}
+        users = enricher.users.get_many(user_ids)
+        return {user_id: user.get('preferences') or {} for user_id, user in users.items()}
+
+    def expand(self, data, user_ids):
+        """Returns the notifications for ``user_ids`` and how many were opted out."""
+        channels = sorted(data['channels'])
+        preferences = self.preferences(user_ids)
+        items = []
+        opted_out = 0
+        for user_id in user_ids:
+            user_preferences = preferences.get(user_id, {})
+            for channel in channels:
+                # Unknown users and missing preferences count as opted in.
+                if user_preferences.get(CHANNEL_PREFERENCES[channel], True) is False:
+                    opted_out += 1
+                    continue
+                items.append({
+                    'notification_type': channel,
+                    'user_id': user_id,
+                    'template_code': data['template_code'],
+                    'variables': data['variables'],
+                    'request_id': f"{data['request_id']}:{user_id}:{channel}",
+                    'priority': data.get('priority', 1),
+                    'metadata': data.get('metadata'),
+                    'scheduled_at': data.get('scheduled_at'),
+                    'digest': data.get('digest', False),
+                })
+        return items, opted_out
+
+    def run(self, data, progress=None):
+        """Expand and send ``data``; ``progress(counts)`` is called after each chunk."""
+        counts = {
+            'recipients': 0, 'queued': 0, 'opted_out': 0,
+            'duplicate': 0, 'suppressed': 0, 'failed': 0, 'rate_limited': 0,
+        }
+        failed = set()
+        pending = None
+
+        def finish(batch):
+            for result in self.service.finish_batch(batch, failed):
+                counts[result['status']] += 1
+            for notification in batch.notifications:
+                failed.discard(str(notification.id))
+            if progress is not None:
+                progress(counts)
+
+        # As on the stream endpoint, a chunk's confirms are collected only
+        # after the next chunk has been expanded and published.
+        with self.service.rabbitmq.pipeline() as pipeline:
+            for user_ids in self.recipients(data):
+                items, opted_out = self.expand(data, user_ids)
+                counts['recipients'] += len(user_ids)
+                counts['opted_out'] += opted_out
+                batch = self.service.queue_batch(items, pipeline)
+                failed |= batch.failed
+                if pending is not None:
+                    failed |= pipeline.wait(up_to_tag=pending.last_tag)
+                    finish(pending)
+                pending = batch
+
+            if pending is not None:
+                failed |= pipeline.wait()
+                finish(pending)
+
+        logger.info(
+            "Fan-out %s: %s queued for %s recipients, %s opted out",
+            data['request_id'], counts['queued'], counts['recipients'], counts['opted_out']
+        )
+        return counts
+
+
+def job_payload(data):
+    """Validated fan-out data as JSON for a FanOutJob."""
+    payload = dict(data, channels=sorted(data['channels']), user_ids=[str(u) for u in data['user_ids']])
+    if payload.get('scheduled_at') is not None:
+        payload['scheduled_at'] = payload['scheduled_at'].isoformat()
+    return payload
+
+
+def job_data(payload):
+    """The fan-out data a FanOutJob's payload was made from."""
+    data = dict(payload)
+    if data.get('scheduled_at'):
+        data['scheduled_at'] = parse_datetime(data['scheduled_at'])
+    return data
+
+
+class FanOutWorker:
+    """
+    Runs accepted fan-out jobs outside the request that submitted them.
+
+    A job is claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` and leased
+    for ``lease`` seconds; the lease is renewed after every chunk, so a job
+    whose worker died is picked up again once it runs out. Only the worker
+    holding the latest claim records the outcome. A pass that raised or left
+    notifications failed is retried with backoff capped at ``max_delay``
+    seconds; notifications that already went out are skipped as duplicates.
+    """
+
+    def __init__(self, lease=None, max_delay=None, notification_service=None):
+        self.lease = lease or settings.FANOUT_JOB_LEASE
+        self.max_delay = max_delay or settings.FANOUT_RETRY_MAX_DELAY
+        self.notification_service = notification_service
+
+    def claim(self):
+        now = timezone.now()
+        with transaction.atomic():
+            job = (
+                FanOutJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(status__in=[FanOutStatus.PENDING, FanOutStatus.RUNNING], available_at__lte=now)
+                .order_by('available_at')
+                .first()
+            )
+            if job is None:
+                return None
+            job.status = FanOutStatus.RUNNING
+            job.attempts += 1
+            job.available_at = now + timedelta(seconds=self.lease)
+            job.save(update_fields=['status', 'attempts', 'available_at', 'updated_at'])
+        return job
+
+    def run_once(self):
+        """Run one due job; returns it, or ``None`` when none is due."""
+        job = self.claim()
+        if job is None:
+            return None
+
+        held = FanOutJob.objects.filter(id=job.id, attempts=job.attempts)
+
+        def progress(counts):
+            held.update(
+                counts=counts, available_at=timezone.now() + timedelta(seconds=self.lease),
+                updated_at=timezone.now()
+            )
+
+        service = self.notification_service or NotificationService()
+        try:
+            counts = FanOut(service).run(job_data(job.payload), progress)
+        except Exception as e:
+            logger.error("Fan-out job %s failed: %s", job.id, e)
+            job.status, job.error = FanOutStatus.PENDING, str(e)
+        else:
+            job.counts, job.error = counts, None
+            job.status = FanOutStatus.PENDING if counts['failed'] else FanOutStatus.DONE
+
+        update = {'status': job.status, 'error': job.error, 'updated_at': timezone.now()}
+        if job.counts is not None:
+            update['counts'] = job.counts
+        if job.status == FanOutStatus.PENDING:
+            update['available_at'] = timezone.now() + timedelta(seconds=self.retry_delay(job.attempts))
+        held.update(**update)
+        return job
+
+    def retry_delay(self, attempts):
+        return min(2 ** min(attempts, 32), self.max_delay)
@@ -0,0 +1,29 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON encoding for the hot paths, with orjson when it is installed. Whatever
+# orjson refuses goes through the stdlib, so failures (and their messages)
+# are the same with or without it.
+
+
+def dumps(obj):
+    """Compact JSON as bytes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def loads(data):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            pass
+    return json.loads(data)
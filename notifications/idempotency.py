@@ -0,0 +1,300 @@
+import json
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from .caching import redis_client
+from .models import IdempotencyKey, NotificationRequest, idempotency_expiry
+from .status_cache import get_status_cache
+
+logger = logging.getLogger('notifications')
+
+IN_PROGRESS = '__in_progress__'
+
+# Returns the stored value, or claims the key with the in-progress marker and
+# returns nothing. One round trip either way.
+CLAIM_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    return current
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return false
+"""
+
+class DuplicateRequest(Exception):
+    """Another notification already holds this request_id."""
+
+
+# How often a duplicate polls for the in-flight request's result.
+WAIT_POLL_INTERVAL = 0.05
+
+
+class Claim:
+    CLAIMED = 'claimed'
+    DONE = 'done'
+    IN_PROGRESS = 'in_progress'
+
+    def __init__(self, state, response=None):
+        self.state = state
+        self.response = response
+
+    @property
+    def claimed(self):
+        return self.state == self.CLAIMED
+
+
+class IdempotencyStore:
+    """
+    Claim-first idempotency keyed on ``request_id``.
+
+    A request reserves its key before doing any work: in Redis with an
+    in-progress marker (one Lua call that also returns a finished response)
+    and in Postgres with ``INSERT ... ON CONFLICT``, which stays
+    authoritative if Redis loses the key. Keys expire after
+    ``IDEMPOTENCY_TTL`` in both stores. Duplicates of an in-flight request
+    wait briefly for its result. Cache hits never touch the database.
+    """
+
+    def __init__(self):
+        self.ttl = settings.IDEMPOTENCY_TTL
+        self.claim_ttl = settings.IDEMPOTENCY_CLAIM_TTL
+        self.wait_timeout = settings.IDEMPOTENCY_WAIT_TIMEOUT
+        self.redis = redis_client()
+        self._claim_script = self.redis.register_script(CLAIM_SCRIPT) if self.redis else None
+
+    def cache_key(self, request_id):
+        return f"idempotency_{request_id}"
+
+    def claim(self, request_id):
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                current = self._cache_claim(request_id)
+            except Exception as e:
+                logger.error("Idempotency cache unavailable, using database: %s", e)
+                return self._db_claim(request_id)
+
+            if current is None:
+                return self._db_claim(request_id)
+            if current != IN_PROGRESS:
+                return Claim(Claim.DONE, json.loads(current))
+            if time.monotonic() >= deadline:
+                return Claim(Claim.IN_PROGRESS)
+            time.sleep(WAIT_POLL_INTERVAL)
+
+    def _cache_claim(self, request_id):
+        if self._claim_script is not None:
+            key = cache.make_key(self.cache_key(request_id))
+            current = self._claim_script(keys=[key], args=[IN_PROGRESS, self.claim_ttl])
+            return current.decode() if current else None
+
+        key = self.cache_key(request_id)
+        if cache.add(key, IN_PROGRESS, timeout=self.claim_ttl):
+            return None
+        return cache.get(key, IN_PROGRESS)
+
+    def _db_claim(self, request_id):
+        if self._db_insert(request_id):
+            return Claim(Claim.CLAIMED)
+
+        record = IdempotencyKey.objects.filter(
+            key=request_id, expires_at__gt=timezone.now()
+        ).values_list('response', 'created_at').first()
+        if record is None:
+            # Released between our insert and read; let the client retry.
+            self._cache_delete(request_id)
+            return Claim(Claim.IN_PROGRESS)
+
+        response, created_at = record
+        if response is not None:
+            self._cache_set(request_id, response)
+            return Claim(Claim.DONE, response)
+
+        # A claim older than claim_ttl belongs to a request that died.
+        stale_before = timezone.now() - timedelta(seconds=self.claim_ttl)
+        taken_over = IdempotencyKey.objects.filter(
+            key=request_id, response__isnull=True, created_at__lt=stale_before
+        ).update(created_at=timezone.now(), expires_at=idempotency_expiry())
+        if taken_over:
+            return Claim(Claim.CLAIMED)
+
+        self._cache_delete(request_id)
+        return Claim(Claim.IN_PROGRESS)
+
+    def _db_insert(self, request_id):
+        # An expired row is not a duplicate: it is reclaimed in place until
+        # prune_idempotency_keys gets to it.
+        table = IdempotencyKey._meta.db_table
+        now = timezone.now()
+        expires_at = idempotency_expiry()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} (key, response, created_at, expires_at) "
+                    f"VALUES (%s, NULL, %s, %s) "
+                    f"ON CONFLICT (key) DO UPDATE SET response = NULL, "
+                    f"created_at = EXCLUDED.created_at, expires_at = EXCLUDED.expires_at "
+                    f"WHERE {table}.expires_at <= EXCLUDED.created_at "
+                    f"RETURNING key",
+                    [request_id, now, expires_at]
+                )
+                return cursor.fetchone() is not None
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(key=request_id, response=None, expires_at=expires_at)
+            return True
+        except IntegrityError:
+            return bool(
+                IdempotencyKey.objects.filter(key=request_id, expires_at__lte=now).update(
+                    response=None, created_at=now, expires_at=expires_at
+                )
+            )
+
+    def claim_many(self, request_ids):
+        """Claim many keys in the database at once; returns the set claimed."""
+        table = IdempotencyKey._meta.db_table
+        now = timezone.now()
+        expires_at = idempotency_expiry()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} (key, response, created_at, expires_at) "
+                    f"SELECT key, NULL, %s, %s FROM unnest(%s::varchar[]) AS key "
+                    f"ON CONFLICT (key) DO UPDATE SET response = NULL, "
+                    f"created_at = EXCLUDED.created_at, expires_at = EXCLUDED.expires_at "
+                    f"WHERE {table}.expires_at <= EXCLUDED.created_at "
+                    f"RETURNING key",
+                    [now, expires_at, list(request_ids)]
+                )
+                return {row[0] for row in cursor.fetchall()}
+        return {request_id for request_id in request_ids if self._db_insert(request_id)}
+
+    def complete(self, request_id, response):
+        try:
+            IdempotencyKey.objects.filter(key=request_id).update(
+                response=response, expires_at=idempotency_expiry()
+            )
+            self._cache_set(request_id, response)
+        except Exception as e:
+            logger.error("Error storing idempotency key: %s", e)
+
+    def complete_many(self, responses):
+        """Store finished responses for keys that were never claimed one by one."""
+        try:
+            expires_at = idempotency_expiry()
+            IdempotencyKey.objects.bulk_create(
+                [
+                    IdempotencyKey(key=key, response=response, expires_at=expires_at)
+                    for key, response in responses.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['key'],
+                update_fields=['response', 'expires_at']
+            )
+            if self.redis is not None:
+                pipe = self.redis.pipeline(transaction=False)
+                for request_id, response in responses.items():
+                    pipe.set(cache.make_key(self.cache_key(request_id)), json.dumps(response), ex=self.ttl)
+                pipe.execute()
+            else:
+                cache.set_many(
+                    {self.cache_key(key): json.dumps(response) for key, response in responses.items()},
+                    timeout=self.ttl
+                )
+        except Exception as e:
+            logger.error("Error storing idempotency keys: %s", e)
+
+    def release(self, request_id):
+        """Give up a claim so that a retry of the request can run."""
+        try:
+            IdempotencyKey.objects.filter(key=request_id, response__isnull=True).delete()
+            self._cache_delete(request_id)
+        except Exception as e:
+            logger.error("Error releasing idempotency key: %s", e)
+
+    def release_many(self, request_ids):
+        try:
+            IdempotencyKey.objects.filter(key__in=request_ids, response__isnull=True).delete()
+        except Exception as e:
+            logger.error("Error releasing idempotency keys: %s", e)
+
+    def _cache_set(self, request_id, response):
+        if self.redis is not None:
+            self.redis.set(cache.make_key(self.cache_key(request_id)), json.dumps(response), ex=self.ttl)
+        else:
+            cache.set(self.cache_key(request_id), json.dumps(response), timeout=self.ttl)
+
+    def _cache_delete(self, request_id):
+        try:
+            cache.delete(self.cache_key(request_id))
+        except Exception as e:
+            logger.error("Error deleting idempotency marker: %s", e)
+
+
+def reserve_requests(notifications):
+    """
+    Record the request ids of unsaved ``notifications`` in the unpartitioned
+    guard table; call inside the transaction that inserts them. Returns the
+    request ids already held by another notification, which must not be
+    inserted. A request id older than IDEMPOTENCY_TTL can be used again,
+    as its idempotency key can.
+    """
+    if not notifications:
+        return set()
+    table = NotificationRequest._meta.db_table
+    now = timezone.now()
+    reusable_before = now - timedelta(seconds=settings.IDEMPOTENCY_TTL)
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (request_id, notification_id, created_at) "
+                f"SELECT request_id, notification_id, %s "
+                f"FROM unnest(%s::varchar[], %s::uuid[]) AS t (request_id, notification_id) "
+                f"ON CONFLICT (request_id) DO UPDATE SET "
+                f"notification_id = EXCLUDED.notification_id, created_at = EXCLUDED.created_at "
+                f"WHERE {table}.created_at <= %s "
+                f"RETURNING request_id",
+                [now, [n.request_id for n in notifications], [str(n.id) for n in notifications], reusable_before]
+            )
+            reserved = {row[0] for row in cursor.fetchall()}
+        taken = {n.request_id for n in notifications} - reserved
+    else:
+        taken = set()
+        for notification in notifications:
+            try:
+                with transaction.atomic():
+                    NotificationRequest.objects.create(
+                        request_id=notification.request_id, notification_id=notification.id, created_at=now
+                    )
+            except IntegrityError:
+                reclaimed = NotificationRequest.objects.filter(
+                    request_id=notification.request_id, created_at__lte=reusable_before
+                ).update(notification_id=notification.id, created_at=now)
+                if not reclaimed:
+                    taken.add(notification.request_id)
+
+    # A cached request_id lookup may still point at the notification that
+    # held the id before.
+    reserved = [n.request_id for n in notifications if n.request_id not in taken]
+    transaction.on_commit(lambda: get_status_cache().forget_requests(reserved))
+    return taken
+
+
+def release_requests(notifications):
+    """Free the request ids of ``notifications`` that failed, so a retry can use them."""
+    if not notifications:
+        return
+    try:
+        # Only rows still pointing at these notifications; a request id that
+        # was reclaimed since belongs to someone else.
+        NotificationRequest.objects.filter(
+            request_id__in=[n.request_id for n in notifications],
+            notification_id__in=[n.id for n in notifications]
+        ).delete()
+    except Exception as e:
+        logger.error("Error releasing %s request ids: %s", len(notifications), e)
+    get_status_cache().forget_requests([n.request_id for n in notifications])
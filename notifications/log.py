@@ -0,0 +1,122 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Attributes every LogRecord has; anything else was passed in ``extra`` and
+# becomes a field of the JSON line.
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with ``extra`` fields at the top level."""
+
+    def format(self, record):
+        entry = {
+            'timestamp': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a background thread that formats and writes them, so
+    logging never blocks a request on stream I/O.
+
+    The queue is bounded; when the writer falls behind, records are dropped
+    (and counted in ``dropped``) rather than stalling the caller. The writer
+    is restarted in each forked worker.
+    """
+
+    def __init__(self, formatter=None, stream=None, maxsize=10000):
+        super().__init__(queue.SimpleQueue())
+        self.maxsize = maxsize
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        if formatter is not None:
+            self.target.setFormatter(formatter)
+        self.dropped = 0
+        self.pid = None
+        self.listener = None
+        self._start()
+        atexit.register(self._stop)
+
+    def setFormatter(self, formatter):
+        # dictConfig sets the formatter here; it belongs to the writer, since
+        # records are formatted on its thread.
+        self.target.setFormatter(formatter)
+
+    def _start(self):
+        self.pid = os.getpid()
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+
+    def _stop(self):
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+
+    def prepare(self, record):
+        # Only merge the arguments here; JSON formatting happens on the
+        # writer thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            # Threads do not survive a fork; the queue may hold the parent's
+            # records, which the parent writes itself.
+            self.queue = queue.SimpleQueue()
+            self._start()
+        super().emit(record)
+
+
+class AccessLogSampler:
+    """
+    Decides which requests get an access log line: all failed (5xx) and slow
+    requests, and ``rate`` of the rest.
+    """
+
+    def __init__(self, rate, slow_seconds):
+        self.rate = rate
+        self.slow_seconds = slow_seconds
+        self._counter = 0
+
+    def keep(self, status_code, duration):
+        if status_code >= 500 or duration >= self.slow_seconds:
+            return True
+        if self.rate >= 1:
+            return True
+        if self.rate <= 0:
+            return False
+        # Deterministic 1-in-N sampling; cheaper than a random draw and
+        # spreads kept lines evenly.
+        self._counter += 1
+        return self._counter % round(1 / self.rate) == 0
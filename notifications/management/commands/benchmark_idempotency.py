@@ -0,0 +1,58 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from notifications.models import IdempotencyKey
+
+PREFIX = 'bench-idem-'
+
+
+class Command(BaseCommand):
+    help = 'Measure idempotency key lookup latency as the table grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help='Comma-separated row counts to measure at')
+        parser.add_argument('--lookups', type=int, default=2000)
+        parser.add_argument('--insert-batch', type=int, default=5000)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated keys')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        expires_at = timezone.now() + timedelta(days=1)
+        rows = 0
+        try:
+            for size in sizes:
+                while rows < size:
+                    count = min(options['insert_batch'], size - rows)
+                    IdempotencyKey.objects.bulk_create([
+                        IdempotencyKey(key=f"{PREFIX}{rows + i}", response={}, expires_at=expires_at)
+                        for i in range(count)
+                    ])
+                    rows += count
+
+                hit = self._measure(rows, options['lookups'], hit=True)
+                miss = self._measure(rows, options['lookups'], hit=False)
+                self.stdout.write(
+                    f"{rows:>12} keys: hit {hit:8.1f} us/lookup, miss {miss:8.1f} us/lookup"
+                )
+        finally:
+            if not options['keep']:
+                IdempotencyKey.objects.filter(key__startswith=PREFIX).delete()
+
+    def _measure(self, rows, lookups, hit):
+        now = timezone.now()
+        if hit:
+            keys = [f"{PREFIX}{random.randrange(rows)}" for _ in range(lookups)]
+        else:
+            keys = [f"{PREFIX}missing-{i}" for i in range(lookups)]
+
+        start = time.perf_counter()
+        for key in keys:
+            IdempotencyKey.objects.filter(key=key, expires_at__gt=now).values_list(
+                'response', 'created_at'
+            ).first()
+        return (time.perf_counter() - start) / lookups * 1e6
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from notifications.metrics import IDEMPOTENCY, prometheus_client, timed
+from notifications.middleware import MetricsMiddleware
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-call overhead of the hot-path instrumentation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        request = RequestFactory().get('/health/live/')
+        request.resolver_match = resolve('/health/live/')
+        response = HttpResponse()
+        middleware = MetricsMiddleware(lambda request: response)
+
+        def timed_block():
+            with timed('database', 'benchmark'):
+                pass
+
+        cases = [
+            ('baseline (empty call)', lambda: None),
+            ('counter inc', lambda: IDEMPOTENCY.labels('miss').inc()),
+            ('timed() block', timed_block),
+            ('request middleware', lambda: middleware(request)),
+        ]
+        backend = 'prometheus_client' if prometheus_client else 'no-op (prometheus_client not installed)'
+        self.stdout.write(f"Metrics backend: {backend}")
+        for name, func in cases:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                func()
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{name:>22}: {elapsed / iterations * 1e9:8.0f} ns per call")
@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+
+import pika
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+PREFIX = 'bench-priority'
+SCENARIOS = ('fifo', 'priority', 'lanes')
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure queue latency of priority-10 messages published while a bulk backlog '
+        'drains: one plain queue, one x-max-priority queue, and a separate priority lane'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=settings.RABBITMQ_URL)
+        parser.add_argument('--backlog', type=int, default=20000, help='Priority-1 messages queued up front')
+        parser.add_argument('--urgent', type=int, default=200, help='Priority-10 messages sent while draining')
+        parser.add_argument('--interval-ms', type=float, default=10.0, help='Gap between urgent messages')
+        parser.add_argument('--work-ms', type=float, default=0.5, help='Consumer time per message')
+        parser.add_argument('--prefetch', type=int, default=10)
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+
+    def handle(self, *args, **options):
+        for scenario in options['scenarios'].split(','):
+            latencies, drained = self._run(scenario, options)
+            latencies.sort()
+            self.stdout.write(
+                f"{scenario:>9}: urgent p50 {_percentile(latencies, 0.50) * 1000:8.1f} ms  "
+                f"p99 {_percentile(latencies, 0.99) * 1000:8.1f} ms  "
+                f"({drained} of {options['backlog']} bulk messages consumed meanwhile)"
+            )
+
+    def _run(self, scenario, options):
+        parameters = pika.URLParameters(options['url'])
+        connection = pika.BlockingConnection(parameters)
+        channel = connection.channel()
+
+        bulk_queue = f'{PREFIX}.{scenario}'
+        urgent_queue = f'{PREFIX}.{scenario}.lane' if scenario == 'lanes' else bulk_queue
+        arguments = {'x-max-priority': 10} if scenario == 'priority' else None
+        for queue_name in {bulk_queue, urgent_queue}:
+            channel.queue_delete(queue=queue_name)
+            channel.queue_declare(queue=queue_name, arguments=arguments)
+
+        for _ in range(options['backlog']):
+            self._send(channel, bulk_queue, 1)
+
+        state = {'urgent': [], 'bulk': 0}
+        done = threading.Event()
+        consumer = threading.Thread(
+            target=self._consume,
+            args=(parameters, {bulk_queue, urgent_queue}, options, state, done),
+            daemon=True
+        )
+        consumer.start()
+
+        for _ in range(options['urgent']):
+            self._send(channel, urgent_queue, 10)
+            time.sleep(options['interval_ms'] / 1000)
+        done.wait()
+        consumer.join()
+
+        for queue_name in {bulk_queue, urgent_queue}:
+            channel.queue_delete(queue=queue_name)
+        connection.close()
+        return state['urgent'], state['bulk']
+
+    def _send(self, channel, queue_name, priority):
+        channel.basic_publish(
+            exchange='',
+            routing_key=queue_name,
+            body=json.dumps({'sent_at': time.time(), 'priority': priority}),
+            properties=pika.BasicProperties(priority=priority)
+        )
+
+    def _consume(self, parameters, queue_names, options, state, done):
+        connection = pika.BlockingConnection(parameters)
+        channel = connection.channel()
+        channel.basic_qos(prefetch_count=options['prefetch'])
+        work = options['work_ms'] / 1000
+
+        def on_message(ch, method, properties, body):
+            message = json.loads(body)
+            if message['priority'] == 10:
+                state['urgent'].append(time.time() - message['sent_at'])
+                if len(state['urgent']) == options['urgent']:
+                    done.set()
+            else:
+                state['bulk'] += 1
+            time.sleep(work)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        for queue_name in queue_names:
+            channel.basic_consume(queue=queue_name, on_message_callback=on_message)
+        while not done.is_set():
+            connection.process_data_events(time_limit=0.1)
+        connection.close()
@@ -0,0 +1,112 @@
+import threading
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+
+from notifications.services import RabbitMQPool, RabbitMQService
+
+
+class StandInChannel:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+
+    def exchange_declare(self, **kwargs):
+        self.broker.round_trip()
+
+    def queue_declare(self, **kwargs):
+        self.broker.round_trip()
+
+    def queue_bind(self, **kwargs):
+        self.broker.round_trip()
+
+    def basic_publish(self, **kwargs):
+        # Publishes are asynchronous frames; only the socket write is paid.
+        self.broker.published += 1
+
+
+class StandInConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self.is_closed = False
+        # protocol header, Start/StartOk, Tune/TuneOk, Open/OpenOk
+        broker.round_trip(3)
+        broker.connections += 1
+
+    def channel(self):
+        self.broker.round_trip()
+        return StandInChannel(self.broker)
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+    def close(self):
+        self.is_open = False
+        self.is_closed = True
+
+
+class StandInBroker:
+    """In-process broker that charges a fixed latency per synchronous AMQP method."""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.connections = 0
+        self.published = 0
+
+    def round_trip(self, count=1):
+        time.sleep(self.rtt * count)
+
+    def connect(self, parameters):
+        return StandInConnection(self)
+
+
+class Command(BaseCommand):
+    help = 'Compare publish throughput of per-request connections against the pooled publisher'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--rtt-ms', type=float, default=0.5)
+        parser.add_argument('--pool-size', type=int, default=4)
+
+    def handle(self, *args, **options):
+        broker = StandInBroker(options['rtt_ms'] / 1000.0)
+        message = {'request_id': 'bench', 'user_id': 'bench', 'variables': {}}
+
+        def per_request():
+            # Old behaviour: every request builds its own connection and topology.
+            service = RabbitMQService(pool=RabbitMQPool('amqp://stand-in', size=1))
+            service.publish_message('email.queue', message)
+
+        pool = RabbitMQPool('amqp://stand-in', size=options['pool_size'])
+
+        def pooled():
+            RabbitMQService(pool=pool).publish_message('email.queue', message)
+
+        with mock.patch('pika.BlockingConnection', side_effect=broker.connect), \
+                mock.patch('notifications.services.logger'):
+            for label, func in (('per-request', per_request), ('pooled', pooled)):
+                broker.connections = 0
+                elapsed = self._run(func, options['requests'], options['threads'])
+                self.stdout.write(
+                    f"{label:>12}: {options['requests'] / elapsed:10.0f} req/s "
+                    f"({broker.connections} connections opened)"
+                )
+            pool.close()
+
+    def _run(self, func, total, threads):
+        per_thread = total // threads
+
+        def worker():
+            for _ in range(per_thread):
+                func()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return time.perf_counter() - start
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from notifications.ratelimit import ClientRateLimiter
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request cost of the client rate limiter against the configured cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000)
+        parser.add_argument('--clients', type=int, default=100)
+
+    def handle(self, *args, **options):
+        limiter = ClientRateLimiter()
+        backend = 'redis' if limiter.default.redis is not None else 'in-process'
+        timings = []
+        for i in range(options['requests']):
+            client = f"bench-ratelimit-{i % options['clients']}"
+            start = time.perf_counter()
+            limiter.hit(client)
+            timings.append(time.perf_counter() - start)
+
+        timings.sort()
+        mean = sum(timings) / len(timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(
+            f"{backend} buckets: mean {mean * 1e6:.1f} us, p99 {p99 * 1e6:.1f} us per request "
+            f"over {len(timings)} requests"
+        )
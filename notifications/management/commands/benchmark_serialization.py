@@ -0,0 +1,79 @@
+import io
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from notifications.fastjson import orjson
+from notifications.parsers import ORJSONParser
+from notifications.renderers import ORJSONRenderer
+from notifications.serializers import APIResponseSerializer, NotificationCreateSerializer, api_response
+from notifications.validation import validate_notification
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request parse, validation and rendering cost: DRF versus the fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+        parser.add_argument(
+            '--unique-links', action='store_true',
+            help='Give every request its own link, so the fast path cannot reuse a validated URL'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        payload = {
+            'notification_type': 'email',
+            'user_id': str(uuid.uuid4()),
+            'template_code': 'welcome',
+            'variables': {'name': 'Ada', 'link': 'https://example.com/welcome', 'meta': {'plan': 'pro'}},
+            'request_id': 'benchmark-request',
+            'priority': 2,
+            'metadata': {'campaign': 'spring'},
+        }
+        if options['unique_links']:
+            variables = payload['variables']
+            bodies = [
+                ORJSONRenderer().render({**payload, 'variables': {**variables, 'link': f'https://example.com/{i}'}})
+                for i in range(iterations + 1)
+            ]
+        else:
+            bodies = [ORJSONRenderer().render(payload)] * (iterations + 1)
+        drf_parser, drf_renderer = JSONParser(), JSONRenderer()
+        fast_parser, fast_renderer = ORJSONParser(), ORJSONRenderer()
+
+        def drf(body):
+            data = drf_parser.parse(io.BytesIO(body))
+            serializer = NotificationCreateSerializer(data=data)
+            serializer.is_valid()
+            return drf_renderer.render(APIResponseSerializer({
+                'success': True,
+                'data': {'notification_id': serializer.validated_data['request_id'], 'status': 'queued'},
+                'message': 'Notification queued successfully'
+            }).data)
+
+        def fast(body):
+            data = validate_notification(fast_parser.parse(io.BytesIO(body)))
+            return fast_renderer.render(api_response({
+                'success': True,
+                'data': {'notification_id': data['request_id'], 'status': 'queued'},
+                'message': 'Notification queued successfully'
+            }))
+
+        if validate_notification(payload) is None:
+            self.stderr.write('The benchmark payload does not take the fast path')
+            return
+
+        self.stdout.write(f"JSON backend: {'orjson' if orjson else 'stdlib (orjson not installed)'}")
+        results = {}
+        for name, func in [('DRF', drf), ('fast path', fast)]:
+            func(bodies[-1])
+            start = time.perf_counter()
+            for body in bodies[:iterations]:
+                func(body)
+            results[name] = (time.perf_counter() - start) / iterations * 1e6
+            self.stdout.write(f"{name:>10}: {results[name]:8.1f} us per request")
+        self.stdout.write(f"   speedup: {results['DRF'] / results['fast path']:8.1f}x")
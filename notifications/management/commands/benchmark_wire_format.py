@@ -0,0 +1,98 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from pika import frame, spec
+
+from notifications.envelope import decode_messages, msgpack
+from notifications.services import PooledChannel, RabbitMQService, group_envelopes
+
+# pika's default frame_max; larger bodies are split over several body frames
+FRAME_MAX = 131072
+
+
+class WireChannel:
+    """Stands in for a channel, counting the frames pika would write to the socket."""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.last = None
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        frames = [
+            frame.Method(1, spec.Basic.Publish(exchange=exchange, routing_key=routing_key)),
+            frame.Header(1, len(body), properties),
+        ]
+        frames += [frame.Body(1, body[i:i + FRAME_MAX]) for i in range(0, len(body), FRAME_MAX)]
+        self.bytes += sum(len(f.marshal()) for f in frames)
+        self.messages += 1
+        self.last = (body, properties)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare one JSON message per notification with envelopes: broker messages, bytes on the '
+        'wire, publisher throughput, and notifications/s at a given broker message rate'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notifications', type=int, default=20000)
+        parser.add_argument('--envelope-sizes', default='10,100,500')
+        parser.add_argument('--compress-min-bytes', type=int, default=4096)
+        parser.add_argument(
+            '--broker-rate', type=int, default=20000,
+            help='Persistent messages per second the broker sustains, to project notifications/s'
+        )
+
+    def handle(self, *args, **options):
+        total = options['notifications']
+        pairs = [
+            ('email.queue', {
+                'notification_id': str(uuid.uuid4()),
+                'user_id': str(uuid.uuid4()),
+                'template_code': 'order_shipped',
+                'variables': {
+                    'name': f'Customer {i}',
+                    'link': f'https://shop.example.com/orders/{i}/tracking',
+                    'meta': {'carrier': 'DHL', 'eta_days': 3},
+                },
+                'request_id': f'order-{i}-shipped',
+                'priority': 1,
+            })
+            for i in range(total)
+        ]
+
+        self.stdout.write(f"Envelope encoding: {'msgpack' if msgpack else 'JSON (msgpack not installed)'}")
+        broker_rate = options['broker_rate']
+        self.stdout.write(
+            f"{'format':>16} {'broker msgs':>12} {'bytes/notif':>12} {'publish notif/s':>16} "
+            f"{f'notif/s @ {broker_rate} msg/s':>26}"
+        )
+        sizes = [1] + [int(size) for size in options['envelope_sizes'].split(',') if size]
+        for size in sizes:
+            with override_settings(NOTIFICATION_ENVELOPE_SIZE=size,
+                                   NOTIFICATION_ENVELOPE_COMPRESS_MIN_BYTES=options['compress_min_bytes']):
+                channel, elapsed = self._publish(pairs)
+            body, properties = channel.last
+            decoded = decode_messages(body, properties.content_type, properties.content_encoding, properties.type)
+            if decoded[-1] != pairs[-1][1]:
+                self.stderr.write(f"Envelope of {size} did not decode to what was published")
+            label = 'JSON per message' if size == 1 else f'envelope of {size}'
+            # The broker's cost is mostly per message (routing, the persistent
+            # write and its ack), so its message rate bounds notifications/s.
+            projected = min(total / elapsed, broker_rate * total / channel.messages)
+            self.stdout.write(
+                f"{label:>16} {channel.messages:>12} {channel.bytes / total:>12.0f} "
+                f"{total / elapsed:>16.0f} {projected:>26.0f}"
+            )
+
+    def _publish(self, pairs):
+        channel = WireChannel()
+        slot = PooledChannel(None, channel)
+        service = RabbitMQService(pool=object(), breaker=object())
+        start = time.perf_counter()
+        for routing_key, envelope in group_envelopes(pairs):
+            service._publish_envelope(slot, routing_key, envelope)
+        return channel, time.perf_counter() - start
@@ -0,0 +1,77 @@
+import json
+import signal
+import time
+
+import pika
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.exceptions import ValidationError
+
+from notifications.serializers import NotificationStatusUpdateSerializer
+from notifications.services import EXCHANGE_NAME
+from notifications.status_updates import apply_status_updates
+
+STATUS_QUEUE = 'status.queue'
+
+
+class Command(BaseCommand):
+    help = 'Apply delivery status updates from the status queue in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.STATUS_UPDATE_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=settings.STATUS_UPDATE_FLUSH_INTERVAL,
+                            help='Seconds to wait for more updates before applying a partial batch')
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        batch_size = options['batch_size']
+        connection = pika.BlockingConnection(pika.URLParameters(settings.RABBITMQ_URL))
+        channel = connection.channel()
+        channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='direct', durable=True)
+        channel.queue_declare(queue=STATUS_QUEUE, durable=True)
+        channel.queue_bind(exchange=EXCHANGE_NAME, queue=STATUS_QUEUE, routing_key=STATUS_QUEUE)
+        channel.basic_qos(prefetch_count=batch_size)
+
+        serializer = NotificationStatusUpdateSerializer()
+        updates = []
+        last_tag = None
+        self.stdout.write(f"Status consumer started (batch size {batch_size})")
+        try:
+            for method, properties, body in channel.consume(STATUS_QUEUE, inactivity_timeout=options['interval']):
+                if method is not None:
+                    last_tag = method.delivery_tag
+                    try:
+                        updates.append(serializer.run_validation(json.loads(body)))
+                    except (ValueError, ValidationError) as e:
+                        self.stderr.write(f"Dropping invalid status update: {str(e)}")
+                    if len(updates) < batch_size:
+                        continue
+
+                if last_tag is not None:
+                    self._flush(channel, updates, last_tag)
+                    updates = []
+                    last_tag = None
+                if not self.running:
+                    break
+        finally:
+            if connection.is_open:
+                connection.close()
+        self.stdout.write("Status consumer stopped")
+
+    def _flush(self, channel, updates, last_tag):
+        try:
+            updated = apply_status_updates(updates) if updates else set()
+        except Exception as e:
+            self.stderr.write(f"Applying status updates failed: {str(e)}")
+            channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+            time.sleep(1)
+            return
+        # One ack covers every message up to last_tag, invalid ones included.
+        channel.basic_ack(delivery_tag=last_tag, multiple=True)
+        self.stdout.write(f"Applied {len(updated)} of {len(updates)} status updates")
+
+    def _stop(self, signum, frame):
+        self.running = False
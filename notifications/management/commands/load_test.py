@@ -0,0 +1,125 @@
+import asyncio
+import json
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive concurrent create requests at a running gateway and report throughput and '
+        'latency; run it against the WSGI and the ASGI deployment to compare them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8001/api/v1/notifications/')
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help='Keep-alive connections, each with one request in flight')
+        parser.add_argument('--notification-type', default='email', choices=['email', 'push'])
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError('Only plain http:// targets are supported')
+
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.path = url.path or '/'
+        self.notification_type = options['notification_type']
+        self.remaining = options['requests']
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+        started = time.perf_counter()
+        asyncio.run(self._run(options['concurrency']))
+        elapsed = time.perf_counter() - started
+
+        self.latencies.sort()
+        completed = len(self.latencies)
+        self.stdout.write(f"Target:      {options['url']}")
+        self.stdout.write(f"Concurrency: {options['concurrency']}")
+        self.stdout.write(f"Completed:   {completed} in {elapsed:.2f}s ({completed / elapsed:.0f} req/s)")
+        self.stdout.write(f"Statuses:    {dict(sorted(self.statuses.items()))}, {self.errors} connection errors")
+        self.stdout.write(
+            f"Latency ms:  p50 {_percentile(self.latencies, 0.50) * 1000:.1f}  "
+            f"p95 {_percentile(self.latencies, 0.95) * 1000:.1f}  "
+            f"p99 {_percentile(self.latencies, 0.99) * 1000:.1f}  "
+            f"max {self.latencies[-1] * 1000 if self.latencies else 0:.1f}"
+        )
+
+    async def _run(self, concurrency):
+        await asyncio.gather(*(self._worker() for _ in range(concurrency)))
+
+    def _body(self):
+        return json.dumps({
+            'notification_type': self.notification_type,
+            'user_id': str(uuid.uuid4()),
+            'template_code': 'load_test',
+            'variables': {'name': 'Load Test', 'link': 'https://example.com'},
+            'request_id': f'load_{uuid.uuid4().hex}',
+            'priority': 1,
+        }).encode()
+
+    async def _worker(self):
+        reader = writer = None
+        while self.remaining > 0:
+            self.remaining -= 1
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(self.host, self.port)
+                started = time.perf_counter()
+                status_code, keep_alive = await self._post(reader, writer, self._body())
+                self.latencies.append(time.perf_counter() - started)
+                self.statuses[status_code] = self.statuses.get(status_code, 0) + 1
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                self.errors += 1
+                keep_alive = False
+            if not keep_alive and writer is not None:
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    async def _post(self, reader, writer, body):
+        writer.write(
+            f"POST {self.path} HTTP/1.1\r\n"
+            f"Host: {self.host}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"\r\n".encode() + body
+        )
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b'', None)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+
+        if 'content-length' in headers:
+            await reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await reader.read()
+            return int(status_line.split()[1]), False
+        return int(status_line.split()[1]), headers.get('connection') != 'close'
@@ -0,0 +1,52 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notifications.partitions import ensure_partitions, is_partitioned, retire_partitions
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming notification partitions and retire expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=settings.NOTIFICATION_PARTITIONS_AHEAD)
+        parser.add_argument('--retention-months', type=int, default=settings.NOTIFICATION_RETENTION_MONTHS)
+        parser.add_argument('--detach-only', action='store_true',
+                            help='Detach expired partitions (e.g. for archiving) instead of dropping them')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running and repeat every this many seconds (default: run once)')
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            self.stdout.write("The notifications table is not partitioned; nothing to do")
+            return
+
+        self.running = True
+        if options['interval']:
+            signal.signal(signal.SIGTERM, self._stop)
+            signal.signal(signal.SIGINT, self._stop)
+        while self.running:
+            try:
+                self.maintain(options)
+            except Exception as e:
+                if not options['interval']:
+                    raise
+                self.stderr.write(f"Partition maintenance failed: {str(e)}")
+            if not options['interval']:
+                break
+            deadline = time.monotonic() + options['interval']
+            while self.running and time.monotonic() < deadline:
+                time.sleep(max(0, min(1.0, deadline - time.monotonic())))
+
+    def maintain(self, options):
+        created = ensure_partitions(options['months_ahead'])
+        retired = retire_partitions(options['retention_months'], detach_only=options['detach_only'])
+        self.stdout.write(
+            f"Created {len(created)} partitions, "
+            f"{'detached' if options['detach_only'] else 'dropped'} {len(retired)}"
+        )
+
+    def _stop(self, signum, frame):
+        self.running = False
@@ -0,0 +1,55 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from notifications.models import IdempotencyKey, NotificationDigest, NotificationRequest, status_window
+
+
+class Command(BaseCommand):
+    help = 'Delete expired idempotency keys, request_id guards and digest mappings in index-ordered batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches to limit I/O')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        keys = self.prune(IdempotencyKey._meta.db_table, 'key', 'expires_at', now, options)
+        # A request id may be reused once its idempotency key has expired.
+        guards = self.prune(
+            NotificationRequest._meta.db_table, 'request_id', 'created_at',
+            now - timedelta(seconds=settings.IDEMPOTENCY_TTL), options
+        )
+        # Status updates only reach notifications sent inside the status
+        # window; mappings are written when a digest is sent, and digests are
+        # never scheduled.
+        digests = self.prune(
+            NotificationDigest._meta.db_table, 'request_id', 'created_at', status_window()[0], options
+        )
+        self.stdout.write(
+            f"Pruned {keys} expired idempotency keys, {guards} request_id guards and {digests} digest mappings"
+        )
+
+    def prune(self, table, key, column, cutoff, options):
+        total = 0
+        while True:
+            # Each batch walks the index on ``column`` and commits on its own,
+            # so locks and WAL stay bounded however far behind pruning is.
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE {key} IN ("
+                    f"SELECT {key} FROM {table} WHERE {column} <= %s "
+                    f"ORDER BY {column} LIMIT %s)",
+                    [cutoff, options['batch_size']]
+                )
+                deleted = cursor.rowcount
+            total += deleted
+            if deleted < options['batch_size']:
+                return total
+            if options['pause']:
+                time.sleep(options['pause'])
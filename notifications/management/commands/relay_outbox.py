@@ -0,0 +1,43 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notifications.services import OutboxRelay, close_rabbitmq_pool
+
+
+class Command(BaseCommand):
+    help = 'Publish notifications from the transactional outbox to RabbitMQ'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_RELAY_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=settings.OUTBOX_RELAY_INTERVAL,
+                            help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit')
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        relay = OutboxRelay(batch_size=options['batch_size'])
+        self.stdout.write(f"Outbox relay started (batch size {relay.batch_size})")
+        try:
+            while self.running:
+                try:
+                    relayed = relay.relay_batch()
+                except Exception as e:
+                    self.stderr.write(f"Outbox relay pass failed: {str(e)}")
+                    relayed = 0
+                if not relayed:
+                    if options['once']:
+                        break
+                    # Longer while the broker's breaker is open: until its trial.
+                    time.sleep(relay.idle_delay(options['interval']))
+        finally:
+            close_rabbitmq_pool()
+        self.stdout.write("Outbox relay stopped")
+
+    def _stop(self, signum, frame):
+        self.running = False
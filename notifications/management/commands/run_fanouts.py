@@ -0,0 +1,42 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notifications.fanout import FanOutWorker
+from notifications.services import close_rabbitmq_pool
+
+
+class Command(BaseCommand):
+    help = 'Expand accepted fan-out requests into notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=settings.FANOUT_POLL_INTERVAL,
+                            help='Seconds to sleep when no job is due')
+        parser.add_argument('--once', action='store_true', help='Run the due jobs once and exit')
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        worker = FanOutWorker()
+        self.stdout.write(f"Fan-out worker started (lease {worker.lease}s)")
+        try:
+            while self.running:
+                try:
+                    job = worker.run_once()
+                except Exception as e:
+                    self.stderr.write(f"Fan-out pass failed: {str(e)}")
+                    job = None
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        finally:
+            close_rabbitmq_pool()
+        self.stdout.write("Fan-out worker stopped")
+
+    def _stop(self, signum, frame):
+        self.running = False
@@ -0,0 +1,111 @@
+import functools
+import os
+import time
+from collections import Counter as Tally
+
+from django.http import HttpResponse
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+# Metrics for /metrics. Under gunicorn, set PROMETHEUS_MULTIPROC_DIR (see
+# gunicorn.conf.py) so every worker writes its samples to shared files and
+# the endpoint adds them up. Without prometheus_client every metric is a
+# no-op.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DEPENDENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class NoopMetric:
+    def labels(self, *labelvalues):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+class CachedLabels:
+    """
+    Wraps a metric so that each label combination is resolved once;
+    prometheus_client's own ``labels()`` takes a lock and costs more than
+    the update that follows it.
+    """
+
+    def __init__(self, metric):
+        self.metric = metric
+        self.labels = functools.lru_cache(maxsize=None)(metric.labels)
+
+
+def _metric(kind, name, documentation, labelnames, **kwargs):
+    if prometheus_client is None:
+        return NoopMetric()
+    return CachedLabels(getattr(prometheus_client, kind)(name, documentation, labelnames, **kwargs))
+
+
+REQUEST_LATENCY = _metric(
+    'Histogram', 'http_request_duration_seconds', 'Request latency by route',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS
+)
+DEPENDENCY_LATENCY = _metric(
+    'Histogram', 'notification_dependency_duration_seconds',
+    'Time spent in database, broker and cache calls', ['dependency', 'operation'],
+    buckets=DEPENDENCY_BUCKETS
+)
+PUBLISHED = _metric(
+    'Counter', 'notifications_published_total',
+    'Messages handed to RabbitMQ: published, failed, or unconfirmed by the broker', ['result']
+)
+IDEMPOTENCY = _metric(
+    'Counter', 'notification_idempotency_claims_total',
+    'Idempotency claims: miss (new request), hit (replayed or duplicate) or in_progress', ['result']
+)
+SUPPRESSED = _metric(
+    'Counter', 'notifications_suppressed_total',
+    'Notifications suppressed as repeats of recent content, by where the repeat was found', ['source']
+)
+STATUS_LOOKUPS = _metric(
+    'Counter', 'notification_status_lookups_total',
+    'Status lookups answered from the cache (hit) or the database (miss)', ['result']
+)
+STATUS_TRANSITIONS = _metric(
+    'Counter', 'notification_status_transitions_total', 'Status changes applied, by new status', ['status']
+)
+
+
+class timed:
+    """Observe the seconds spent in a ``with`` block on DEPENDENCY_LATENCY."""
+
+    __slots__ = ('metric', 'start')
+
+    def __init__(self, dependency, operation):
+        self.metric = DEPENDENCY_LATENCY.labels(dependency, operation)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metric.observe(time.perf_counter() - self.start)
+
+
+def count_transitions(statuses):
+    for new_status, count in Tally(statuses).items():
+        STATUS_TRANSITIONS.labels(new_status).inc(count)
+
+
+def metrics_view(request):
+    if prometheus_client is None:
+        return HttpResponse('prometheus_client is not installed\n', status=501, content_type='text/plain')
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return HttpResponse(prometheus_client.generate_latest(registry), content_type=prometheus_client.CONTENT_TYPE_LATEST)
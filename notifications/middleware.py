@@ -1,31 +1,184 @@
+import math
+import re
 import time
 import logging
 import uuid
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+
+from .aio import run_sync
+from .log import AccessLogSampler
+from .metrics import REQUEST_LATENCY
+from .ratelimit import get_client_limiter
+from .serializers import api_response
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
 logger = logging.getLogger('notifications')
+access_logger = logging.getLogger('notifications.access')
 
 class LoggingMiddleware:
+    """
+    One access log line per request, on the ``notifications.access`` logger:
+    every failed or slow request and ACCESS_LOG_SAMPLE_RATE of the rest.
+    """
+    # Works in both modes so that under ASGI Django does not push every
+    # request through a sync thread just for this middleware.
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.sampler = AccessLogSampler(settings.ACCESS_LOG_SAMPLE_RATE, settings.ACCESS_LOG_SLOW_SECONDS)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
     
     def __call__(self, request):
-      
-        request_id = str(uuid.uuid4())
-        request.request_id = request_id
-        
-        start_time = time.time()
-     
-        logger.info(f"Request {request_id}: {request.method} {request.path}")
-        
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        start_time = self._start(request)
         response = self.get_response(request)
-        
-  
-        response_time = time.time() - start_time
-        
-   
-        logger.info(
-            f"Response {request_id}: {response.status_code} "
-            f"- {response_time:.2f}s"
+        return self._finish(request, response, start_time)
+
+    async def __acall__(self, request):
+        start_time = self._start(request)
+        response = await self.get_response(request)
+        return self._finish(request, response, start_time)
+
+    def _start(self, request):
+        request.request_id = str(uuid.uuid4())
+        return time.perf_counter()
+
+    def _finish(self, request, response, start_time):
+        response_time = time.perf_counter() - start_time
+        level = logging.WARNING if response.status_code >= 500 else logging.INFO
+        if access_logger.isEnabledFor(level) and self.sampler.keep(response.status_code, response_time):
+            access_logger.log(
+                level,
+                "%s %s %s %.1fms",
+                request.method, request.path, response.status_code, response_time * 1000,
+                extra={
+                    'request_id': request.request_id,
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'duration_ms': round(response_time * 1000, 2),
+                }
+            )
+        return response
+
+class MetricsMiddleware:
+    """Observes request latency per method, route pattern and status code."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, start)
+        return response
+
+    def _observe(self, request, response, start):
+        match = getattr(request, 'resolver_match', None)
+        REQUEST_LATENCY.labels(
+            request.method, match.route if match else 'unmatched', response.status_code
+        ).observe(time.perf_counter() - start)
+
+class RateLimitMiddleware:
+    """
+    Token-bucket limit per client on write requests, one Redis call each.
+
+    Clients are told apart by RATE_LIMIT_CLIENT_HEADER when one is set,
+    else by the address RATE_LIMIT_TRUSTED_PROXIES hops back in
+    X-Forwarded-For; entries before that were written by the caller and are
+    ignored. Requests over the limit get 429 with Retry-After. If Redis is
+    down the request is let through.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        header = settings.RATE_LIMIT_CLIENT_HEADER
+        self.header = 'HTTP_' + header.upper().replace('-', '_') if header else None
+        self.trusted_proxies = settings.RATE_LIMIT_TRUSTED_PROXIES
+        self.exempt = re.compile(settings.RATE_LIMIT_EXEMPT_PATHS) if settings.RATE_LIMIT_EXEMPT_PATHS else None
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self._reject(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        # Only limited requests pay for the thread hop; a slow or unreachable
+        # Redis must not stall every request on the event loop.
+        if self._limited(request):
+            rejected = await run_sync(self._reject, request)
+            if rejected is not None:
+                return rejected
+        return await self.get_response(request)
+
+    def _limited(self, request):
+        return (
+            settings.RATE_LIMIT_ENABLED
+            and request.method not in SAFE_METHODS
+            and request.path.startswith(settings.RATE_LIMIT_PATH_PREFIX)
+            and not (self.exempt and self.exempt.match(request.path))
         )
-        
-        return response
\ No newline at end of file
+
+    def client(self, request):
+        if self.header and request.META.get(self.header):
+            return request.META[self.header]
+        if self.trusted_proxies:
+            forwarded = [a.strip() for a in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if a.strip()]
+            if len(forwarded) >= self.trusted_proxies:
+                return forwarded[-self.trusted_proxies]
+        return request.META.get('REMOTE_ADDR', '')
+
+    def _reject(self, request):
+        if not self._limited(request):
+            return None
+
+        client = self.client(request)
+        try:
+            retry_after = get_client_limiter().hit(client)
+        except Exception as e:
+            logger.error("Rate limiter unavailable, allowing request: %s", e)
+            return None
+        if not retry_after:
+            return None
+
+        logger.warning("Rate limited client %s on %s", client, request.path)
+        return rate_limited_response(retry_after, 'Too many requests from this client')
+
+
+def rate_limited_response(retry_after, message):
+    response = JsonResponse(
+        api_response({
+            'success': False,
+            'error': 'Rate limit exceeded',
+            'message': message
+        }),
+        status=429
+    )
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.14 on 2026-10-17 06:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('notification_id', models.UUIDField()),
+                ('routing_key', models.CharField(max_length=255)),
+                ('payload', models.JSONField()),
+                ('attempts', models.IntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'notification_outbox',
+                'indexes': [models.Index(fields=['available_at'], name='notificatio_availab_6d2459_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 06:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_outbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='response',
+            field=models.JSONField(null=True),
+        ),
+    ]
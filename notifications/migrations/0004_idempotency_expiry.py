@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-17 06:29
+
+import notifications.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0003_idempotency_claims'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='expires_at',
+            field=models.DateTimeField(default=notifications.models.idempotency_expiry),
+        ),
+        migrations.AddIndex(
+            model_name='idempotencykey',
+            index=models.Index(fields=['expires_at'], name='idempotency_expires_6c9d28_idx'),
+        ),
+    ]
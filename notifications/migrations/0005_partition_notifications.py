@@ -0,0 +1,79 @@
+# Generated by Django 5.0.14 on 2026-10-17 06:31
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+from notifications.partitions import DEFAULT_PARTITION, add_months, create_partition, month_start
+
+
+def partition_notifications(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    Notification = apps.get_model('notifications', 'Notification')
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        # Build the partitioned table next to the live one, copy the rows and
+        # swap names. Index names are global, so indexes are recreated last.
+        cursor.execute(
+            'CREATE TABLE notifications_partitioned (LIKE notifications) '
+            'PARTITION BY RANGE (created_at)'
+        )
+        cursor.execute('SELECT min(created_at) FROM notifications')
+        oldest = cursor.fetchone()[0] or timezone.now()
+
+        start = month_start(oldest)
+        last = add_months(month_start(timezone.now()), settings.NOTIFICATION_PARTITIONS_AHEAD)
+        while start <= last:
+            create_partition(start, connection, parent='notifications_partitioned')
+            start = add_months(start, 1)
+        cursor.execute(
+            f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF notifications_partitioned DEFAULT'
+        )
+
+        cursor.execute('INSERT INTO notifications_partitioned SELECT * FROM notifications')
+        cursor.execute('DROP TABLE notifications')
+        cursor.execute('ALTER TABLE notifications_partitioned RENAME TO notifications')
+        # The partition key has to be part of the primary key.
+        cursor.execute(
+            'ALTER TABLE notifications ADD CONSTRAINT notifications_pkey '
+            'PRIMARY KEY (id, created_at)'
+        )
+
+    for index in Notification._meta.indexes:
+        schema_editor.add_index(Notification, index)
+
+
+def unpartition_notifications(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    Notification = apps.get_model('notifications', 'Notification')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE notifications_plain (LIKE notifications)')
+        cursor.execute('INSERT INTO notifications_plain SELECT * FROM notifications')
+        cursor.execute('DROP TABLE notifications CASCADE')
+        cursor.execute('ALTER TABLE notifications_plain RENAME TO notifications')
+        cursor.execute(
+            'ALTER TABLE notifications ADD CONSTRAINT notifications_pkey PRIMARY KEY (id)'
+        )
+
+    for index in Notification._meta.indexes:
+        schema_editor.add_index(Notification, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_idempotency_expiry'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='request_id',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.RunPython(partition_notifications, unpartition_notifications),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.14 on 2026-10-17 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_partition_notifications'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notificatio_user_id_e78525_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notificatio_created_e4c995_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notificatio_status_fce6f5_idx',
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['created_at', 'id'], name='notificatio_created_c6e228_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user_id', 'created_at', 'id'], name='notificatio_user_id_66dee4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='notificatio_status_3e067c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['notification_type', 'created_at', 'id'], name='notificatio_notific_fbc531_idx'),
+        ),
+    ]
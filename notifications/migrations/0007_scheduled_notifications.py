@@ -0,0 +1,26 @@
+# Generated by Django 5.0.14 on 2026-10-17 06:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0006_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outboxmessage',
+            name='notificatio_availab_6d2459_idx',
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='scheduled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['available_at', 'id'], name='notificatio_availab_6f82ba_idx'),
+        ),
+    ]
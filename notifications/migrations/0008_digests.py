@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-17 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0007_scheduled_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='digest',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='DigestEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('notification_id', models.UUIDField()),
+                ('user_id', models.UUIDField()),
+                ('notification_type', models.CharField(choices=[('email', 'Email'), ('push', 'Push')], max_length=10)),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'notification_digest_entries',
+                'indexes': [models.Index(fields=['user_id', 'notification_type', 'id'], name='notificatio_user_id_a5e7e9_idx'), models.Index(fields=['created_at'], name='notificatio_created_50b54f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.14 on 2026-10-17 07:20
+
+from datetime import timedelta
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_requests(apps, schema_editor):
+    # Only request ids that can still be replayed need guarding.
+    since = django.utils.timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_TTL)
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO notification_requests (request_id, notification_id, created_at) '
+                'SELECT DISTINCT ON (request_id) request_id, id, created_at FROM notifications '
+                'WHERE created_at >= %s ORDER BY request_id, created_at DESC',
+                [since]
+            )
+        return
+
+    Notification = apps.get_model('notifications', 'Notification')
+    NotificationRequest = apps.get_model('notifications', 'NotificationRequest')
+    latest = {}
+    rows = Notification.objects.filter(created_at__gte=since).order_by('created_at')
+    for request_id, notification_id, created_at in rows.values_list('request_id', 'id', 'created_at').iterator():
+        latest[request_id] = (notification_id, created_at)
+    NotificationRequest.objects.bulk_create(
+        [
+            NotificationRequest(request_id=request_id, notification_id=notification_id, created_at=created_at)
+            for request_id, (notification_id, created_at) in latest.items()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0008_digests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationRequest',
+            fields=[
+                ('request_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('notification_id', models.UUIDField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'notification_requests',
+                'indexes': [models.Index(fields=['created_at'], name='notificatio_created_7878a4_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_requests, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.14 on 2026-10-17 07:25
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0009_notification_requests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FanOutJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('request_id', models.CharField(max_length=200, unique=True)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done')], default='pending', max_length=10)),
+                ('counts', models.JSONField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'notification_fanout_jobs',
+                'indexes': [models.Index(fields=['status', 'available_at'], name='notificatio_status_de24e1_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.14 on 2026-10-17 07:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0010_fanout_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationDigest',
+            fields=[
+                ('request_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('request_ids', models.JSONField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'notification_digests',
+                'indexes': [models.Index(fields=['created_at'], name='notificatio_created_b10c61_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.14 on 2026-10-17 07:59
+
+from datetime import timedelta
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_due_at(apps, schema_editor):
+    # Entries held before this migration fall due when they would have.
+    DigestEntry = apps.get_model('notifications', 'DigestEntry')
+    DigestEntry.objects.update(due_at=F('created_at') + timedelta(seconds=settings.NOTIFICATION_DIGEST_WINDOW))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0011_notification_digests'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='digestentry',
+            name='notificatio_created_50b54f_idx',
+        ),
+        migrations.AddField(
+            model_name='digestentry',
+            name='due_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_due_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='digestentry',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='digestentry',
+            index=models.Index(fields=['due_at'], name='notificatio_due_at_da9668_idx'),
+        ),
+    ]
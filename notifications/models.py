@@ -1,4 +1,7 @@
+from datetime import timedelta
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 import uuid
 
 class NotificationStatus(models.TextChoices):
@@ -10,15 +13,42 @@ class NotificationType(models.TextChoices):
     EMAIL = 'email', 'Email'
     PUSH = 'push', 'Push'
 
+def status_window():
+    """
+    ``(since, created_since)``: notifications sent since ``since`` accept
+    status updates. Scheduled ones are sent at ``scheduled_at``, at most
+    NOTIFICATION_SCHEDULE_MAX_DAYS after they were created, so none of them
+    is older than ``created_since``.
+    """
+    since = timezone.now() - timedelta(days=settings.NOTIFICATION_STATUS_WINDOW_DAYS)
+    return since, since - timedelta(days=settings.NOTIFICATION_SCHEDULE_MAX_DAYS)
+
+class NotificationQuerySet(models.QuerySet):
+    def recent(self):
+        # Status updates only target notifications sent inside this window.
+        # Both branches bound created_at, so Postgres still skips every
+        # older partition.
+        since, created_since = status_window()
+        return self.filter(
+            models.Q(created_at__gte=since)
+            | models.Q(created_at__gte=created_since, scheduled_at__gte=since)
+        )
+
 class Notification(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     notification_type = models.CharField(max_length=10, choices=NotificationType.choices)
     user_id = models.UUIDField()
     template_code = models.CharField(max_length=255)
     variables = models.JSONField(default=dict)
-    request_id = models.CharField(max_length=255, unique=True)
+    # Unique per NotificationRequest; a partitioned table cannot enforce it.
+    request_id = models.CharField(max_length=255)
     priority = models.IntegerField(default=1)
     metadata = models.JSONField(default=dict, null=True, blank=True)
+    # Set for notifications held back until then; the outbox row carries the
+    # due time and the relay publishes it.
+    scheduled_at = models.DateTimeField(null=True, blank=True)
+    # Held back and sent in a per-recipient digest; see DigestEntry.
+    digest = models.BooleanField(default=False)
     status = models.CharField(
         max_length=10, 
         choices=NotificationStatus.choices, 
@@ -26,20 +56,126 @@ class Notification(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = NotificationQuerySet.as_manager()
     
     class Meta:
+        # On Postgres this is range-partitioned by month on created_at; see
+        # migration 0005 and notifications.partitions.
         db_table = 'notifications'
+        # Each filter the list endpoint offers leads an index that ends in
+        # the (created_at, id) keyset order.
         indexes = [
-            models.Index(fields=['user_id']),
             models.Index(fields=['request_id']),
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['user_id', 'created_at', 'id']),
+            models.Index(fields=['status', 'created_at', 'id']),
+            models.Index(fields=['notification_type', 'created_at', 'id']),
+        ]
+
+class NotificationRequest(models.Model):
+    # Unpartitioned, so the database can enforce what the partitioned
+    # notifications table cannot: one notification per request_id. Written in
+    # the same transaction as the notification; rows older than
+    # IDEMPOTENCY_TTL may be reclaimed and are pruned with the idempotency keys.
+    request_id = models.CharField(max_length=255, primary_key=True)
+    notification_id = models.UUIDField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'notification_requests'
+        indexes = [
             models.Index(fields=['created_at']),
-            models.Index(fields=['status']),
         ]
 
+class FanOutStatus(models.TextChoices):
+    PENDING = 'pending', 'Pending'
+    RUNNING = 'running', 'Running'
+    DONE = 'done', 'Done'
+
+class FanOutJob(models.Model):
+    # A fan-out request, accepted by the API and expanded by run_fanouts.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    request_id = models.CharField(max_length=200, unique=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=FanOutStatus.choices, default=FanOutStatus.PENDING)
+    # Counts from the latest pass, updated after every chunk
+    counts = models.JSONField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    # When a pending job may start, or a running job's lease runs out
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'notification_fanout_jobs'
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+def idempotency_expiry():
+    return timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_TTL)
+
 class IdempotencyKey(models.Model):
     key = models.CharField(max_length=255, primary_key=True)
-    response = models.JSONField()
+    # NULL while the request that claimed the key is still in flight
+    response = models.JSONField(null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(default=idempotency_expiry)
     
     class Meta:
-        db_table = 'idempotency_keys'
\ No newline at end of file
+        db_table = 'idempotency_keys'
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+class OutboxMessage(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    notification_id = models.UUIDField()
+    routing_key = models.CharField(max_length=255)
+    payload = models.JSONField()
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'notification_outbox'
+        # Relays read due rows off the front of this index, however many
+        # scheduled rows lie further ahead.
+        indexes = [
+            models.Index(fields=['available_at', 'id']),
+        ]
+
+class DigestEntry(models.Model):
+    # Rows are inserted with their notification and deleted once a digest
+    # carrying them has been published. due_at is when the flusher should
+    # look at the row's bucket: NOTIFICATION_DIGEST_WINDOW after created_at,
+    # or at once while the bucket is full.
+    id = models.BigAutoField(primary_key=True)
+    notification_id = models.UUIDField()
+    user_id = models.UUIDField()
+    notification_type = models.CharField(max_length=10, choices=NotificationType.choices)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+    due_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'notification_digest_entries'
+        indexes = [
+            models.Index(fields=['user_id', 'notification_type', 'id']),
+            models.Index(fields=['due_at']),
+        ]
+
+class NotificationDigest(models.Model):
+    # Maps a digest's own request_id to the request_ids it carries, so a
+    # status reported for the digest reaches each of its notifications.
+    request_id = models.CharField(max_length=255, primary_key=True)
+    request_ids = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'notification_digests'
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
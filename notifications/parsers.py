@@ -0,0 +1,45 @@
+import io
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from .fastjson import loads, orjson
+
+
+class NDJSONParser(BaseParser):
+    """Parses a newline-delimited JSON body into a list of objects."""
+
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        items = []
+        for line_number, line in enumerate(stream, start=1):
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+            try:
+                items.append(loads(line))
+            except ValueError as exc:
+                raise ParseError(f'NDJSON parse error on line {line_number} - {exc}')
+        return items
+
+
+class ORJSONParser(JSONParser):
+    """
+    DRF's JSONParser on orjson. Bodies orjson rejects are parsed again by the
+    stdlib parser, so parse errors read exactly as before.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except ValueError:
+            return super().parse(io.BytesIO(body), media_type, parser_context)
@@ -0,0 +1,165 @@
+import logging
+from datetime import date
+from django.db import connection as default_connection, transaction
+from django.utils import timezone
+from .models import status_window
+
+logger = logging.getLogger('notifications')
+
+TABLE = 'notifications'
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start:%Y%m}'
+
+
+def is_partitioned(connection=default_connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace",
+            [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def monthly_partitions(connection=default_connection):
+    """Return ``{start_date: partition_name}`` for the attached monthly partitions."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    prefix = f'{TABLE}_p'
+    for name in names:
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            partitions[date(int(suffix[:4]), int(suffix[4:]), 1)] = name
+    return partitions
+
+
+def create_partition(start, connection=default_connection, parent=TABLE):
+    end = add_months(start, 1)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF {parent} '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+
+
+def default_partition_months(connection=default_connection):
+    """Start dates of the months that have rows in the default partition."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')::date "
+            f"FROM {DEFAULT_PARTITION}"
+        )
+        return sorted(row[0] for row in cursor.fetchall())
+
+
+def move_out_of_default(start, connection=default_connection):
+    """
+    Create the partition for the month starting at ``start`` from the rows the
+    default partition holds for it. ``CREATE TABLE ... PARTITION OF`` refuses
+    while such rows exist, so they are copied into a standalone table, deleted
+    from the default partition and the table attached, in one transaction.
+    """
+    name = partition_name(start)
+    bounds = [start.isoformat(), add_months(start, 1).isoformat()]
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(
+            f'INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} '
+            f'WHERE created_at >= %s AND created_at < %s',
+            bounds
+        )
+        moved = cursor.rowcount
+        cursor.execute(
+            f'DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s',
+            bounds
+        )
+        cursor.execute(
+            f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{bounds[0]}') TO ('{bounds[1]}')"
+        )
+    logger.warning("Moved %s notifications from %s into partition %s", moved, DEFAULT_PARTITION, name)
+    return moved
+
+
+def ensure_partitions(months_ahead, connection=default_connection):
+    """
+    Create monthly partitions from the current month through ``months_ahead``,
+    first giving any month that rows in the default partition fall into a
+    partition of its own.
+    """
+    if not is_partitioned(connection):
+        return []
+
+    existing = monthly_partitions(connection)
+    created = []
+    for start in default_partition_months(connection):
+        if start in existing:
+            continue
+        try:
+            move_out_of_default(start, connection)
+            created.append(partition_name(start))
+        except Exception as e:
+            logger.error("Could not move %s rows into partition %s: %s", DEFAULT_PARTITION, partition_name(start), e)
+
+    current = month_start(timezone.now())
+    for offset in range(months_ahead + 1):
+        start = add_months(current, offset)
+        if start in existing or partition_name(start) in created:
+            continue
+        try:
+            create_partition(start, connection)
+            created.append(partition_name(start))
+        except Exception as e:
+            logger.error("Could not create partition %s: %s", partition_name(start), e)
+    if created:
+        logger.info("Created notification partitions: %s", ', '.join(created))
+    return created
+
+
+def retire_partitions(retention_months, detach_only=False, connection=default_connection):
+    """Detach or drop monthly partitions that end before the retention window."""
+    if not is_partitioned(connection):
+        return []
+
+    cutoff = add_months(month_start(timezone.now()), -retention_months)
+    # Notifications scheduled up to NOTIFICATION_SCHEDULE_MAX_DAYS ahead may
+    # not have been sent yet; keep their partitions until they leave the
+    # status window.
+    cutoff = min(cutoff, month_start(status_window()[1]))
+    retired = []
+    for start, name in sorted(monthly_partitions(connection).items()):
+        if add_months(start, 1) > cutoff:
+            break
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+            if not detach_only:
+                cursor.execute(f'DROP TABLE {name}')
+        retired.append(name)
+    if retired:
+        action = 'Detached' if detach_only else 'Dropped'
+        logger.info("%s notification partitions: %s", action, ', '.join(retired))
+    return retired
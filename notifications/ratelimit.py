@@ -0,0 +1,165 @@
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .caching import redis_client
+
+logger = logging.getLogger('notifications')
+
+# Refills and takes from every bucket in KEYS in one round trip, on the Redis
+# clock so that all gateway processes agree. Each key gets up to its cost in
+# tokens; returns granted count and milliseconds until the rest is available,
+# per key.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local ttl = math.ceil(capacity / rate) + 1
+local result = {}
+for i, key in ipairs(KEYS) do
+    local cost = tonumber(ARGV[i + 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local elapsed = math.max(0, now - (tonumber(bucket[2]) or now))
+    tokens = math.min(capacity, tokens + elapsed * rate)
+    local granted = math.min(cost, math.floor(tokens))
+    tokens = tokens - granted
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', key, ttl)
+    local wait = 0
+    if granted < cost then
+        wait = math.ceil((cost - granted - tokens) / rate * 1000)
+    end
+    result[#result + 1] = granted
+    result[#result + 1] = wait
+end
+return result
+"""
+
+
+def parse_limits(value):
+    """Parse ``"client:rate:burst,..."`` into ``{client: (rate, burst)}``."""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in value.split(','))):
+        client, rate, burst = entry.rsplit(':', 2)
+        limits[client] = (float(rate), int(burst))
+    return limits
+
+
+class TokenBucket:
+    """
+    Token buckets of ``capacity`` tokens refilled at ``rate`` per second.
+
+    Backed by one Lua call per ``take`` when the cache is django-redis. Other
+    cache backends fall back to buckets held in this process, which only
+    limit per worker.
+    """
+
+    def __init__(self, prefix, rate, capacity):
+        self.prefix = prefix
+        self.rate = rate
+        self.capacity = capacity
+        self.redis = redis_client()
+        self._script = self.redis.register_script(TOKEN_BUCKET_SCRIPT) if self.redis else None
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def take(self, costs):
+        """
+        Take ``{identity: cost}`` tokens. Returns ``{identity: (granted,
+        retry_after)}`` where ``retry_after`` is in seconds.
+        """
+        identities = list(costs)
+        if self._script is None:
+            return {identity: self._take_local(identity, costs[identity]) for identity in identities}
+
+        keys = [cache.make_key(f"{self.prefix}:{identity}") for identity in identities]
+        reply = self._script(
+            keys=keys, args=[self.rate, self.capacity] + [costs[identity] for identity in identities]
+        )
+        return {
+            identity: (int(reply[2 * i]), int(reply[2 * i + 1]) / 1000)
+            for i, identity in enumerate(identities)
+        }
+
+    def _take_local(self, identity, cost):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._local.get(identity, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            granted = min(cost, math.floor(tokens))
+            tokens -= granted
+            self._local[identity] = (tokens, now)
+        retry_after = 0 if granted == cost else (cost - granted - tokens) / self.rate
+        return granted, retry_after
+
+
+class ClientRateLimiter:
+    """Per-client request limits; clients listed in RATE_LIMIT_OVERRIDES get their own."""
+
+    def __init__(self):
+        self.default = TokenBucket('ratelimit:client', settings.RATE_LIMIT_RATE, settings.RATE_LIMIT_BURST)
+        self.overrides = {
+            client: TokenBucket('ratelimit:client', rate, burst)
+            for client, (rate, burst) in parse_limits(settings.RATE_LIMIT_OVERRIDES).items()
+        }
+
+    def hit(self, client):
+        """Take one token for ``client``; returns seconds to wait, 0 if allowed."""
+        bucket = self.overrides.get(client, self.default)
+        granted, retry_after = bucket.take({client: 1})[client]
+        return 0 if granted else retry_after
+
+
+class UserRateLimiter:
+    """Caps how many notifications one recipient ``user_id`` is sent."""
+
+    def __init__(self):
+        self.bucket = TokenBucket('ratelimit:user', settings.USER_RATE_LIMIT_RATE, settings.USER_RATE_LIMIT_BURST)
+
+    def limit(self, items):
+        """
+        Returns the request ids of ``items`` over their recipient's cap and
+        the longest wait among them. Earlier items win within a batch.
+        """
+        costs = {}
+        for item in items:
+            user_id = str(item['user_id'])
+            costs[user_id] = costs.get(user_id, 0) + 1
+        granted = self.bucket.take(costs)
+
+        limited = set()
+        retry_after = 0
+        remaining = {user_id: allowed for user_id, (allowed, _) in granted.items()}
+        for item in items:
+            user_id = str(item['user_id'])
+            if remaining[user_id] > 0:
+                remaining[user_id] -= 1
+                continue
+            limited.add(item['request_id'])
+            retry_after = max(retry_after, granted[user_id][1])
+        return limited, retry_after
+
+
+_client_limiter = None
+_user_limiter = None
+
+
+def get_client_limiter():
+    global _client_limiter
+    if _client_limiter is None:
+        _client_limiter = ClientRateLimiter()
+    return _client_limiter
+
+
+def get_user_limiter():
+    """The per-recipient limiter, or ``None`` when USER_RATE_LIMIT_RATE is 0."""
+    global _user_limiter
+    if not settings.USER_RATE_LIMIT_RATE:
+        return None
+    if _user_limiter is None:
+        _user_limiter = UserRateLimiter()
+    return _user_limiter
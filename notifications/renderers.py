@@ -0,0 +1,31 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+from .fastjson import orjson
+
+# Datetimes and anything else orjson does not know natively go through DRF's
+# own encoder, so both renderers produce the same output.
+_encoder = encoders.JSONEncoder()
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    DRF's JSONRenderer on orjson. Indented or ASCII-only output, and anything
+    orjson cannot encode, is left to the stdlib renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Like JSONRenderer, escape the two characters that are valid JSON
+        # but not valid JavaScript.
+        if b'\xe2\x80' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
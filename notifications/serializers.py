@@ -1,3 +1,6 @@
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Notification, NotificationType, NotificationStatus
 
@@ -6,6 +9,21 @@ class UserDataSerializer(serializers.Serializer):
     link = serializers.URLField()
     meta = serializers.DictField(required=False, allow_null=True)
 
+class ScheduledAtField(serializers.DateTimeField):
+    """
+    Optional send time; times already past mean "send now". It may be at
+    most NOTIFICATION_SCHEDULE_MAX_DAYS ahead, which keeps scheduled
+    notifications inside the partitions status updates look at.
+    """
+
+    def to_internal_value(self, value):
+        value = super().to_internal_value(value)
+        now = timezone.now()
+        max_days = settings.NOTIFICATION_SCHEDULE_MAX_DAYS
+        if value > now + timedelta(days=max_days):
+            raise serializers.ValidationError(f'Must be at most {max_days} days ahead.')
+        return value if value > now else None
+
 class NotificationCreateSerializer(serializers.Serializer):
     notification_type = serializers.ChoiceField(choices=NotificationType.choices)
     user_id = serializers.UUIDField()
@@ -14,6 +32,32 @@ class NotificationCreateSerializer(serializers.Serializer):
     request_id = serializers.CharField(max_length=255)
     priority = serializers.IntegerField(min_value=1, max_value=10, default=1)
     metadata = serializers.DictField(required=False, allow_null=True)
+    scheduled_at = ScheduledAtField(required=False, allow_null=True)
+    # Priority 1 only: hold for the recipient's next digest instead of sending now
+    digest = serializers.BooleanField(default=False)
+
+class RecipientListField(serializers.ListField):
+    """At most FANOUT_MAX_RECIPIENTS items, checked before any of them is parsed."""
+
+    def to_internal_value(self, data):
+        max_items = settings.FANOUT_MAX_RECIPIENTS
+        if isinstance(data, list) and len(data) > max_items:
+            raise serializers.ValidationError(f'Provide at most {max_items} user_ids.')
+        return super().to_internal_value(data)
+
+class NotificationFanoutSerializer(serializers.Serializer):
+    channels = serializers.MultipleChoiceField(choices=NotificationType.choices, allow_empty=False)
+    # Stored whole in FanOutJob.payload and reloaded on every lease
+    user_ids = RecipientListField(child=serializers.UUIDField(), allow_empty=False)
+    template_code = serializers.CharField(max_length=255)
+    variables = UserDataSerializer()
+    # Leaves room for the ":<user_id>:<channel>" suffix of each notification's request_id
+    request_id = serializers.CharField(max_length=200)
+    priority = serializers.IntegerField(min_value=1, max_value=10, default=1)
+    metadata = serializers.DictField(required=False, allow_null=True)
+    scheduled_at = ScheduledAtField(required=False, allow_null=True)
+    # Priority 1 only: hold for the recipient's next digest instead of sending now
+    digest = serializers.BooleanField(default=False)
 
 class NotificationStatusUpdateSerializer(serializers.Serializer):
     notification_id = serializers.CharField(max_length=255)
@@ -21,6 +65,16 @@ class NotificationStatusUpdateSerializer(serializers.Serializer):
     timestamp = serializers.DateTimeField(required=False, allow_null=True)
     error = serializers.CharField(required=False, allow_null=True, allow_blank=True)
 
+class NotificationListQuerySerializer(serializers.Serializer):
+    user_id = serializers.UUIDField(required=False)
+    status = serializers.ChoiceField(choices=NotificationStatus.choices, required=False)
+    notification_type = serializers.ChoiceField(choices=NotificationType.choices, required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    cursor = serializers.CharField(required=False, allow_blank=True)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    include_total = serializers.ChoiceField(choices=['exact', 'estimate'], required=False)
+
 class NotificationResponseSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
@@ -32,9 +86,35 @@ class NotificationResponseSerializer(serializers.ModelSerializer):
             'request_id', 
             'priority', 
             'status', 
+            'scheduled_at',
+            'digest',
             'created_at'
         ]
 
+class NotificationStatusSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = [
+            'id',
+            'request_id',
+            'notification_type',
+            'status',
+            'scheduled_at',
+            'created_at',
+            'updated_at'
+        ]
+
+class NotificationStatusLookupSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.UUIDField(format='hex_verbose'), required=False)
+    request_ids = serializers.ListField(child=serializers.CharField(max_length=255), required=False)
+
+    def validate(self, attrs):
+        count = len(attrs.get('ids', [])) + len(attrs.get('request_ids', []))
+        max_items = settings.NOTIFICATION_BATCH_MAX_ITEMS
+        if not 0 < count <= max_items:
+            raise serializers.ValidationError(f'Provide 1 to {max_items} ids and request_ids in total.')
+        return attrs
+
 class PaginationMetaSerializer(serializers.Serializer):
     total = serializers.IntegerField()
     limit = serializers.IntegerField()
@@ -48,4 +128,20 @@ class APIResponseSerializer(serializers.Serializer):
     data = serializers.DictField(required=False, allow_null=True)
     error = serializers.CharField(required=False, allow_null=True)
     message = serializers.CharField()
-    meta = PaginationMetaSerializer(required=False, allow_null=True)
\ No newline at end of file
+    meta = PaginationMetaSerializer(required=False, allow_null=True)
+
+def api_response(payload):
+    """
+    The same dict as ``APIResponseSerializer(payload).data``, built directly;
+    envelopes are made on every request and need none of the field machinery.
+    """
+    data = payload.get('data')
+    error = payload.get('error')
+    meta = payload.get('meta')
+    return {
+        'success': bool(payload['success']),
+        'data': None if data is None else {str(key): value for key, value in data.items()},
+        'error': None if error is None else str(error),
+        'message': str(payload['message']),
+        'meta': None if meta is None else PaginationMetaSerializer(meta).data,
+    }
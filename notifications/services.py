@@ -1,194 +1,1148 @@
-import json
+import atexit
 import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
 import pika
 from django.conf import settings
-from django.core.cache import cache
-from .models import Notification, IdempotencyKey
-import time
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from .breaker import CircuitOpenError, LocalFailure, get_circuit_breaker
+from .dedup import get_deduplicator
+from .enrichment import enrich_messages
+from .envelope import ENVELOPE_TYPE, encode_envelope, encode_message
+from .idempotency import DuplicateRequest, IdempotencyStore, release_requests, reserve_requests
+from .metrics import DEPENDENCY_LATENCY, IDEMPOTENCY, PUBLISHED, timed
+from .models import DigestEntry, Notification, NotificationStatus, OutboxMessage
+from .ratelimit import get_user_limiter
+from .status_cache import get_status_cache
 
 logger = logging.getLogger('notifications')
 
-class RabbitMQService:
-    def __init__(self):
-        self.connection = None
-        self.channel = None
-        self.connect()
-    
-    def connect(self):
+EXCHANGE_NAME = 'notifications.direct'
+QUEUE_NAMES = ('email.queue', 'push.queue', 'failed.queue')
+BOUND_QUEUES = ('email.queue', 'push.queue')
+# Separate queues for notifications at or above
+# NOTIFICATION_PRIORITY_LANE_THRESHOLD, so urgent traffic never sits behind a
+# bulk backlog, whatever the consumers' prefetch.
+PRIORITY_LANES = ('email.priority.queue', 'push.priority.queue')
+
+# Granularity of the ioloop while waiting for broker confirms.
+CONFIRM_POLL_INTERVAL = 0.001
+
+
+class ConfirmTracker:
+    """
+    Matches broker publisher confirms back to the notifications they carry.
+
+    Delivery tags are assigned by the channel in publish order, so a
+    ``multiple`` ack/nack settles every outstanding tag up to and including
+    the one in the frame. Nacked and timed-out notification ids collect in
+    ``failed`` until the owner drains them.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.next_tag = 1
+        self.outstanding = OrderedDict()
+        self.failed = []
+
+    def track(self, notification_ids):
+        tag = self.next_tag
+        self.next_tag += 1
+        self.outstanding[tag] = (notification_ids, time.monotonic() + self.timeout)
+        return tag
+
+    def on_confirm(self, frame):
+        method = frame.method
+        nacked = isinstance(method, pika.spec.Basic.Nack)
+        if method.multiple:
+            while self.outstanding:
+                tag = next(iter(self.outstanding))
+                if tag > method.delivery_tag:
+                    break
+                self._settle(tag, nacked)
+        else:
+            self._settle(method.delivery_tag, nacked)
+
+    def _settle(self, tag, nacked):
+        entry = self.outstanding.pop(tag, None)
+        if entry and nacked:
+            self.failed.extend(nid for nid in entry[0] if nid)
+
+    def expire(self):
+        now = time.monotonic()
+        while self.outstanding:
+            tag, (notification_ids, deadline) = next(iter(self.outstanding.items()))
+            if deadline > now:
+                break
+            del self.outstanding[tag]
+            self.failed.extend(nid for nid in notification_ids if nid)
+
+    def expire_through(self, up_to_tag):
+        while self.outstanding and next(iter(self.outstanding)) <= up_to_tag:
+            _, (notification_ids, _) = self.outstanding.popitem(last=False)
+            self.failed.extend(nid for nid in notification_ids if nid)
+
+    def is_settled(self, up_to_tag):
+        return not self.outstanding or next(iter(self.outstanding)) > up_to_tag
+
+    def abandon(self):
+        # The channel is gone; anything unconfirmed may never have arrived.
+        self.failed.extend(nid for ids, _ in self.outstanding.values() for nid in ids if nid)
+        self.outstanding.clear()
+
+    def take_failed(self):
+        failed, self.failed = self.failed, []
+        return failed
+
+
+class PooledChannel:
+    """One long-lived connection/channel pair checked out of the pool."""
+
+    def __init__(self, connection, channel, confirms=None):
+        self.connection = connection
+        self.channel = channel
+        self.confirms = confirms
+
+    def enable_confirms(self, timeout):
+        # BlockingChannel.confirm_delivery() would block every publish until
+        # its own ack arrives; registering on the underlying channel keeps
+        # publishes pipelined and lets acks arrive in (multiple) batches.
+        # _impl is private, which is why requirements.txt pins pika exactly;
+        # check this call before upgrading it.
+        tracker = ConfirmTracker(timeout)
+        selected = []
+        self.channel._impl.confirm_delivery(
+            ack_nack_callback=tracker.on_confirm,
+            callback=selected.append
+        )
+        deadline = time.monotonic() + timeout
+        while not selected:
+            if time.monotonic() > deadline:
+                raise TimeoutError("Broker did not acknowledge Confirm.Select")
+            self.connection.process_data_events(time_limit=CONFIRM_POLL_INTERVAL)
+        self.confirms = tracker
+
+    def settle(self, up_to_tag=None, timeout=0):
+        """Process pending confirms, optionally waiting for ``up_to_tag``."""
+        if self.confirms is None:
+            return
+        self.connection.process_data_events(time_limit=0)
+        if up_to_tag is not None:
+            deadline = time.monotonic() + timeout
+            while not self.confirms.is_settled(up_to_tag):
+                if time.monotonic() >= deadline:
+                    break
+                self.connection.process_data_events(time_limit=CONFIRM_POLL_INTERVAL)
+        self.confirms.expire()
+
+    @property
+    def is_open(self):
+        return (
+            self.connection is not None
+            and self.connection.is_open
+            and self.channel is not None
+            and self.channel.is_open
+        )
+
+    def close(self):
+        if self.confirms is not None:
+            self.confirms.abandon()
         try:
-            self.connection = pika.BlockingConnection(
-                pika.URLParameters(settings.RABBITMQ_URL)
-            )
-            self.channel = self.connection.channel()
-            
-          
-            self.channel.exchange_declare(
-                exchange='notifications.direct', 
-                exchange_type='direct', 
+            if self.connection and self.connection.is_open:
+                self.connection.close()
+        except Exception as e:
+            logger.warning("Error closing RabbitMQ connection: %s", e)
+
+
+class PoolExhausted(LocalFailure):
+    """No RabbitMQ channel was free within this process's limits."""
+
+
+class RabbitMQPool:
+    """
+    Bounded pool of long-lived RabbitMQ channels for one worker process.
+
+    pika's BlockingConnection is not thread-safe, so every slot owns its own
+    connection and a caller holds a slot exclusively while publishing. Slots
+    are created lazily, topology is declared once per process and broken
+    slots are replaced with exponential backoff.
+    """
+
+    def __init__(self, url, size=4, connect_retries=3, retry_backoff=0.2,
+                 acquire_timeout=5.0, confirms=False, confirm_timeout=5.0):
+        self.url = url
+        self.size = size
+        self.connect_retries = connect_retries
+        self.retry_backoff = retry_backoff
+        self.acquire_timeout = acquire_timeout
+        self.confirms = confirms
+        self.confirm_timeout = confirm_timeout
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._declared = False
+        self._closed = False
+        self._unconfirmed = []
+
+    def _open(self):
+        delay = self.retry_backoff
+        for attempt in range(1, self.connect_retries + 1):
+            try:
+                connection = pika.BlockingConnection(pika.URLParameters(self.url))
+                channel = connection.channel()
+                if not self._declared:
+                    channel = self._declare_topology(connection, channel)
+                slot = PooledChannel(connection, channel)
+                if self.confirms:
+                    slot.enable_confirms(self.confirm_timeout)
+                logger.info("Successfully connected to RabbitMQ")
+                return slot
+            except pika.exceptions.NoFreeChannels as e:
+                # channel_max is a local limit; retrying will not lift it.
+                connection.close()
+                raise PoolExhausted("No free RabbitMQ channel on a new connection") from e
+            except Exception as e:
+                logger.error(
+                    "Failed to connect to RabbitMQ (attempt %s/%s): %s",
+                    attempt, self.connect_retries, e
+                )
+                if attempt == self.connect_retries:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    def _declare_topology(self, connection, channel):
+        with self._lock:
+            if self._declared:
+                return channel
+
+            channel.exchange_declare(
+                exchange=EXCHANGE_NAME,
+                exchange_type='direct',
                 durable=True
             )
-            
-          
-            self.channel.queue_declare(queue='email.queue', durable=True)
-            self.channel.queue_declare(queue='push.queue', durable=True)
-            self.channel.queue_declare(queue='failed.queue', durable=True)
-            
-           
-            self.channel.queue_bind(
-                exchange='notifications.direct', 
-                queue='email.queue', 
-                routing_key='email.queue'
+            for queue_name, arguments, bound in queue_topology():
+                try:
+                    channel.queue_declare(queue=queue_name, durable=True, arguments=arguments)
+                except pika.exceptions.ChannelClosedByBroker as e:
+                    # Consumers may own the queue with different arguments
+                    # (e.g. a dead-letter exchange, or no x-max-priority on a
+                    # queue created before it was added); use it as it is.
+                    if e.reply_code != 406:
+                        raise
+                    logger.warning("Using existing %s: %s", queue_name, e.reply_text)
+                    channel = connection.channel()
+                    channel.queue_declare(queue=queue_name, passive=True)
+                if bound:
+                    channel.queue_bind(
+                        exchange=EXCHANGE_NAME,
+                        queue=queue_name,
+                        routing_key=queue_name
+                    )
+
+            self._declared = True
+            return channel
+
+    def acquire(self):
+        if self._closed:
+            raise RuntimeError("RabbitMQ pool is closed")
+
+        slot = None
+        try:
+            slot = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if not can_create:
+                try:
+                    slot = self._idle.get(timeout=self.acquire_timeout)
+                except queue.Empty:
+                    raise PoolExhausted("Timed out waiting for a RabbitMQ channel")
+
+        if slot is not None:
+            try:
+                if slot.is_open:
+                    # Service heartbeats that piled up while the slot sat idle.
+                    slot.connection.process_data_events(time_limit=0)
+                    return slot
+            except Exception as e:
+                logger.warning("Discarding stale RabbitMQ connection: %s", e)
+            self._discard(slot)
+
+        try:
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def release(self, slot, discard=False):
+        if discard or self._closed or not slot.is_open:
+            self._discard(slot)
+            with self._lock:
+                self._created -= 1
+            return
+        self._collect(slot)
+        self._idle.put_nowait(slot)
+
+    def _discard(self, slot):
+        slot.close()
+        self._collect(slot)
+
+    def _collect(self, slot):
+        if slot.confirms is not None and slot.confirms.failed:
+            failed = slot.confirms.take_failed()
+            with self._lock:
+                self._unconfirmed.extend(failed)
+
+    def take_unconfirmed(self):
+        """Notification ids that were nacked, timed out or lost with a channel."""
+        with self._lock:
+            failed, self._unconfirmed = self._unconfirmed, []
+        return failed
+
+    @contextmanager
+    def channel(self):
+        slot = self.acquire()
+        try:
+            yield slot
+        except Exception:
+            self.release(slot, discard=True)
+            raise
+        else:
+            self.release(slot)
+
+    def stats(self):
+        idle = self._idle.qsize()
+        return {
+            'size': self.size,
+            'created': self._created,
+            'idle': idle,
+            'in_use': self._created - idle,
+        }
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                slot = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(slot)
+            with self._lock:
+                self._created -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_rabbitmq_pool():
+    """Return this process's pool, rebuilding it after a fork."""
+    global _pool
+    pid = os.getpid()
+    if _pool is not None and _pool.pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool.pid != pid:
+            # Sockets inherited from the parent are never reused; the
+            # parent keeps ownership of them.
+            _pool = RabbitMQPool(
+                settings.RABBITMQ_URL,
+                size=settings.RABBITMQ_POOL_SIZE,
+                connect_retries=settings.RABBITMQ_CONNECT_RETRIES,
+                retry_backoff=settings.RABBITMQ_RETRY_BACKOFF,
+                acquire_timeout=settings.RABBITMQ_POOL_TIMEOUT,
+                confirms=settings.RABBITMQ_PUBLISHER_CONFIRMS,
+                confirm_timeout=settings.RABBITMQ_CONFIRM_TIMEOUT,
+            )
+        return _pool
+
+
+def close_rabbitmq_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+
+atexit.register(close_rabbitmq_pool)
+
+
+class RabbitMQService:
+    def __init__(self, pool=None, breaker=None):
+        self.pool = pool or get_rabbitmq_pool()
+        self.breaker = breaker or get_circuit_breaker('rabbitmq')
+
+    def _publish(self, slot, routing_key, message):
+        body, content_type = encode_message(message)
+        slot.channel.basic_publish(
+            exchange=EXCHANGE_NAME,
+            routing_key=routing_key,
+            body=body,
+            properties=pika.BasicProperties(
+                content_type=content_type,
+                delivery_mode=2,
+                priority=message_priority(message),
             )
-            self.channel.queue_bind(
-                exchange='notifications.direct', 
-                queue='push.queue', 
-                routing_key='push.queue'
+        )
+        if slot.confirms is not None:
+            return slot.confirms.track(notification_ids_of(message))
+        return None
+
+    def _publish_envelope(self, slot, routing_key, messages):
+        if len(messages) == 1:
+            return self._publish(slot, routing_key, messages[0])
+        body, content_type, content_encoding = encode_envelope(
+            messages, settings.NOTIFICATION_ENVELOPE_COMPRESS_MIN_BYTES
+        )
+        slot.channel.basic_publish(
+            exchange=EXCHANGE_NAME,
+            routing_key=routing_key,
+            body=body,
+            properties=pika.BasicProperties(
+                content_type=content_type,
+                content_encoding=content_encoding,
+                type=ENVELOPE_TYPE,
+                headers={'x-notification-count': len(messages)},
+                delivery_mode=2,
+                priority=message_priority(messages[0]),
             )
-            
-            logger.info("Successfully connected to RabbitMQ")
-            
-        except Exception as e:
-            logger.error(f"Failed to connect to RabbitMQ: {str(e)}")
-            raise
-    
+        )
+        if slot.confirms is not None:
+            return slot.confirms.track([i for message in messages for i in notification_ids_of(message)])
+        return None
+
     def publish_message(self, routing_key, message):
+        # With confirms on, this waits up to RABBITMQ_CONFIRM_TIMEOUT for the
+        # broker's ack. A nacked or timed-out message is marked failed, with
+        # any other unconfirmed rows, before returning False.
+        published = False
         try:
-            if not self.connection or self.connection.is_closed:
-                self.connect()
-                
-            self.channel.basic_publish(
-                exchange='notifications.direct',
-                routing_key=routing_key,
-                body=json.dumps(message),
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  
-                )
-            )
-            logger.info(f"Message published to {routing_key}: {message['request_id']}")
-            return True
-            
+            with timed('broker', 'publish'):
+                published = self.breaker.call(self._publish_message, routing_key, message)
+        except CircuitOpenError:
+            logger.warning("Not publishing to %s: broker circuit is open", routing_key)
+            PUBLISHED.labels('failed').inc()
         except Exception as e:
-            logger.error(f"Failed to publish message to {routing_key}: {str(e)}")
-            return False
-    
+            logger.error("Failed to publish message to %s: %s", routing_key, e)
+            PUBLISHED.labels('failed').inc()
+        else:
+            if published:
+                logger.info("Message published to %s: %s", routing_key, message['request_id'])
+                PUBLISHED.labels('published').inc()
+            else:
+                logger.warning("Broker did not confirm message to %s: %s", routing_key, message['request_id'])
+
+        self.fail_unconfirmed()
+        return published
+
+    def _publish_message(self, routing_key, message):
+        """Publish one message; False if the broker nacked it or did not confirm it in time."""
+        # A broken slot is replaced once before giving up on the message.
+        for attempt in range(2):
+            try:
+                with self.pool.channel() as slot:
+                    tag = self._publish(slot, routing_key, message)
+                    if tag is None:
+                        return True
+                    slot.settle(up_to_tag=tag, timeout=self.pool.confirm_timeout)
+                    if not slot.confirms.is_settled(tag):
+                        slot.confirms.expire_through(tag)
+                    # Left on the tracker; the pool collects them on release.
+                    return not set(notification_ids_of(message)) & set(slot.confirms.failed)
+            except (pika.exceptions.AMQPConnectionError,
+                    pika.exceptions.AMQPChannelError) as e:
+                logger.warning("Publish to %s failed on attempt %s: %s", routing_key, attempt + 1, e)
+                if attempt:
+                    raise
+
+    def publish_batch(self, messages, timeout=None, mark_failed=True):
+        """
+        Publish ``(routing_key, message)`` pairs over one channel.
+
+        Publishes are pipelined and, with confirms on, the broker's acks are
+        awaited once for the whole batch. Returns the set of notification ids
+        that were not accepted by the broker; unless ``mark_failed`` is off
+        their rows are already marked failed.
+        """
+        with self.pipeline(mark_failed=mark_failed) as pipeline:
+            failed = pipeline.publish(messages)
+            failed |= pipeline.wait(timeout=timeout)
+        return failed
+
+    def pipeline(self, mark_failed=True):
+        return PublishPipeline(self, mark_failed=mark_failed)
+
+    def fail_unconfirmed(self):
+        failed = self.pool.take_unconfirmed()
+        if failed:
+            PUBLISHED.labels('unconfirmed').inc(len(failed))
+            mark_notifications_failed(failed)
+        return failed
+
     def close(self):
-        if self.connection and not self.connection.is_closed:
-            self.connection.close()
+        # Connections belong to the process-wide pool; see close_rabbitmq_pool.
+        pass
+
+
+class PublishPipeline:
+    """
+    Publishes successive batches over one pooled channel without waiting for
+    confirms in between, so the broker can ack one batch while the caller
+    prepares the next. Failed notification ids are marked failed in the
+    database before they are returned, unless ``mark_failed`` is off.
+    """
+
+    def __init__(self, service, mark_failed=True):
+        self.service = service
+        self.pool = service.pool
+        self.mark_failed = mark_failed
+        self.slot = None
+        self.last_tag = None
+        # Set when a publish was refused by the open breaker, sending nothing
+        self.refused = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def publish(self, messages):
+        messages = list(messages)
+        if not messages:
+            return set()
+
+        envelopes = group_envelopes(messages)
+        sent = 0
+        published = 0
+        state = self.service.breaker.allow()
+        self.refused = state is None
+        start = time.perf_counter()
+        try:
+            if state is None:
+                raise CircuitOpenError("broker circuit is open")
+            if self.slot is None:
+                self.slot = self.pool.acquire()
+            for routing_key, envelope in envelopes:
+                tag = self.service._publish_envelope(self.slot, routing_key, envelope)
+                if tag is not None:
+                    self.last_tag = tag
+                sent += 1
+                published += len(envelope)
+        except Exception as e:
+            logger.error("Failed to publish batch after %s messages: %s", published, e)
+            if isinstance(e, LocalFailure):
+                self.service.breaker.record_skipped(state)
+            elif state is not None:
+                self.service.breaker.record_failure(state)
+                self._drop_slot()
+            unpublished = [
+                notification_id for _, envelope in envelopes[sent:] for message in envelope
+                for notification_id in notification_ids_of(message) if notification_id
+            ]
+            PUBLISHED.labels('published').inc(published)
+            PUBLISHED.labels('failed').inc(len(messages) - published)
+            if unpublished and self.mark_failed:
+                mark_notifications_failed(unpublished)
+            return set(unpublished)
+
+        self.service.breaker.record_success(state)
+        DEPENDENCY_LATENCY.labels('broker', 'publish_batch').observe(time.perf_counter() - start)
+        PUBLISHED.labels('published').inc(len(messages))
+        logger.info("Published batch of %s messages as %s broker messages", len(messages), len(envelopes))
+        return set()
+
+    def wait(self, up_to_tag=None, timeout=None):
+        """Wait for confirms up to ``up_to_tag`` (default: everything published)."""
+        if up_to_tag is None:
+            up_to_tag = self.last_tag
+        if timeout is None:
+            timeout = self.pool.confirm_timeout
+
+        failed = []
+        slot = self.slot
+        if slot is not None and slot.confirms is not None and up_to_tag is not None:
+            try:
+                with timed('broker', 'wait_confirms'):
+                    slot.settle(up_to_tag=up_to_tag, timeout=timeout)
+                if not slot.confirms.is_settled(up_to_tag):
+                    slot.confirms.expire_through(up_to_tag)
+                failed.extend(slot.confirms.take_failed())
+            except Exception as e:
+                logger.error("Lost channel while waiting for confirms: %s", e)
+                self._drop_slot()
+
+        failed.extend(self.pool.take_unconfirmed())
+        if failed:
+            PUBLISHED.labels('unconfirmed').inc(len(failed))
+        if failed and self.mark_failed:
+            mark_notifications_failed(failed)
+        return set(failed)
+
+    def _drop_slot(self):
+        if self.slot is not None:
+            self.pool.release(self.slot, discard=True)
+            self.slot = None
+
+    def close(self):
+        if self.slot is not None:
+            self.pool.release(self.slot)
+            self.slot = None
+
+
+def mark_notifications_failed(notification_ids):
+    updated = Notification.objects.recent().filter(id__in=notification_ids).update(
+        status=NotificationStatus.FAILED,
+        updated_at=timezone.now()
+    )
+    get_status_cache().invalidate(notification_ids)
+    logger.warning("Marked %s unconfirmed notifications as failed", updated)
+    return updated
+
+
+def build_message(notification):
+    return {
+        'notification_id': str(notification.id),
+        'user_id': str(notification.user_id),
+        'template_code': notification.template_code,
+        'variables': notification.variables,
+        'request_id': notification.request_id,
+        'priority': notification.priority,
+    }
+
+
+def notification_ids_of(message):
+    """The notifications a published message carries: one, or a digest's."""
+    if 'notification_ids' in message:
+        return message['notification_ids']
+    return [message.get('notification_id')]
+
+
+def digest_eligible(item):
+    # Consumers cannot look up a digest's recipient themselves, so digests
+    # are only held when they will go out enriched.
+    return bool(
+        settings.NOTIFICATION_DIGEST_WINDOW
+        and settings.NOTIFICATION_ENRICHMENT
+        and item.get('digest')
+        and item.get('priority', 1) == 1
+        and not item.get('scheduled_at')
+    )
+
+
+def digest_entry_for(notification, now):
+    return DigestEntry(
+        notification_id=notification.id,
+        user_id=notification.user_id,
+        notification_type=notification.notification_type,
+        payload=build_message(notification),
+        created_at=now,
+        due_at=now + timedelta(seconds=settings.NOTIFICATION_DIGEST_WINDOW)
+    )
+
+
+def hold_for_digest(notifications):
+    """
+    Append digest entries for ``notifications``; call inside the transaction
+    that inserts them. Buckets they fill to NOTIFICATION_DIGEST_MAX_ITEMS
+    fall due at once.
+    """
+    now = timezone.now()
+    DigestEntry.objects.bulk_create([digest_entry_for(n, now) for n in notifications])
+    touched = {(n.user_id, n.notification_type) for n in notifications}
+    # Counted on the (user_id, notification_type, id) index, so this only
+    # reads the buckets just written to. A bucket filled by concurrent
+    # requests that each missed the other's rows still falls due with its
+    # window.
+    counts = (
+        DigestEntry.objects
+        .filter(
+            user_id__in={user_id for user_id, _ in touched},
+            notification_type__in={notification_type for _, notification_type in touched}
+        )
+        .values('user_id', 'notification_type')
+        .annotate(entries=Count('id'))
+        .filter(entries__gte=settings.NOTIFICATION_DIGEST_MAX_ITEMS)
+    )
+    for bucket in counts:
+        if (bucket['user_id'], bucket['notification_type']) in touched:
+            DigestEntry.objects.filter(
+                user_id=bucket['user_id'], notification_type=bucket['notification_type'], due_at__gt=now
+            ).update(due_at=now)
+
+
+def messages_for(notifications):
+    """``(routing_key, message)`` pairs to publish, enriched when that is enabled."""
+    return enrich_messages(
+        (routing_key_for(n.notification_type, n.priority), build_message(n))
+        for n in notifications
+    )
+
+
+def routing_key_for(notification_type, priority=None):
+    threshold = settings.NOTIFICATION_PRIORITY_LANE_THRESHOLD
+    if threshold and priority is not None and priority >= threshold:
+        return f"{notification_type}.priority.queue"
+    return f"{notification_type}.queue"
+
+
+def group_envelopes(messages):
+    """
+    ``(routing_key, [message, ...])`` for ``(routing_key, message)`` pairs:
+    up to NOTIFICATION_ENVELOPE_SIZE messages for the same queue and AMQP
+    priority per envelope, or one each when envelopes are off.
+    """
+    size = settings.NOTIFICATION_ENVELOPE_SIZE
+    if size <= 1:
+        return [(routing_key, [message]) for routing_key, message in messages]
+    groups = {}
+    for routing_key, message in messages:
+        groups.setdefault((routing_key, message_priority(message)), []).append(message)
+    return [
+        (routing_key, group[start:start + size])
+        for (routing_key, _), group in groups.items()
+        for start in range(0, len(group), size)
+    ]
+
+
+def message_priority(message):
+    """The AMQP priority for ``message``: its notification priority, capped."""
+    max_priority = settings.RABBITMQ_MAX_PRIORITY
+    if not max_priority or message.get('priority') is None:
+        return None
+    return min(int(message['priority']), max_priority)
+
+
+def queue_topology():
+    """``(queue_name, arguments, bound)`` for every queue the gateway declares."""
+    arguments = None
+    if settings.RABBITMQ_MAX_PRIORITY:
+        arguments = {'x-max-priority': settings.RABBITMQ_MAX_PRIORITY}
+    queues = [
+        (queue_name, arguments if queue_name in BOUND_QUEUES else None, queue_name in BOUND_QUEUES)
+        for queue_name in QUEUE_NAMES
+    ]
+    if settings.NOTIFICATION_PRIORITY_LANE_THRESHOLD:
+        queues += [(queue_name, arguments, True) for queue_name in PRIORITY_LANES]
+    return queues
+
+
+def queued_response(request_id):
+    return {
+        'success': True,
+        'data': {
+            'notification_id': request_id,
+            'status': 'queued'
+        },
+        'error': None,
+        'message': 'Notification queued successfully',
+        'meta': None,
+    }
+
+
+def suppressed_response(request_id):
+    return {
+        'success': True,
+        'data': {
+            'notification_id': request_id,
+            'status': 'suppressed'
+        },
+        'error': None,
+        'message': 'Notification suppressed as a repeat of a recent one',
+        'meta': None,
+    }
+
+
+class QueuedBatch:
+    def __init__(self, request_ids, duplicates, notifications, failed, last_tag, rate_limited=None,
+                 suppressed=None):
+        self.request_ids = request_ids
+        self.duplicates = duplicates
+        self.notifications = notifications
+        self.failed = failed
+        self.last_tag = last_tag
+        self.rate_limited = rate_limited or set()
+        self.suppressed = suppressed or set()
+
+
+def outbox_message_for(notification):
+    return OutboxMessage(
+        notification_id=notification.id,
+        routing_key=routing_key_for(notification.notification_type, notification.priority),
+        payload=build_message(notification),
+        available_at=notification.scheduled_at or timezone.now()
+    )
+
+
+class OutboxRelay:
+    """
+    Moves outbox rows to RabbitMQ.
+
+    Each pass locks the rows that are due, oldest due time first, with
+    ``SELECT ... FOR UPDATE SKIP LOCKED`` so any number of relays can drain
+    the table side by side. Scheduled notifications wait here until their
+    ``scheduled_at``. The batch is published with
+    confirms and deletes the rows the broker accepted in the same
+    transaction. Rejected rows stay until they are published, retried with
+    an exponential backoff capped at ``max_delay`` seconds, so a long broker
+    outage delays notifications instead of losing them. While the broker's
+    circuit breaker is open nothing is claimed and no attempt is counted;
+    ``idle_delay`` tells the caller how long to wait for the half-open trial.
+    """
+
+    def __init__(self, batch_size=None, max_delay=None, rabbitmq=None):
+        self.batch_size = batch_size or settings.OUTBOX_RELAY_BATCH_SIZE
+        self.max_delay = max_delay or settings.OUTBOX_RETRY_MAX_DELAY
+        self.rabbitmq = rabbitmq or RabbitMQService()
+
+    def idle_delay(self, interval):
+        """Seconds to sleep after a pass that relayed nothing."""
+        return max(interval, self.rabbitmq.breaker.retry_in())
+
+    def relay_batch(self):
+        if self.rabbitmq.breaker.is_open():
+            logger.info("Broker circuit is open, outbox relay waiting")
+            return 0
+        now = timezone.now()
+        with transaction.atomic():
+            rows = list(
+                OutboxMessage.objects
+                .select_for_update(skip_locked=True)
+                .filter(available_at__lte=now)
+                .order_by('available_at', 'id')[:self.batch_size]
+            )
+            if not rows:
+                return 0
+
+            with self.rabbitmq.pipeline(mark_failed=False) as pipeline:
+                failed = pipeline.publish(enrich_messages((row.routing_key, row.payload) for row in rows))
+                if pipeline.refused:
+                    # Another caller holds the half-open trial; nothing was sent.
+                    logger.info("Broker circuit is open, %s outbox messages left as they were", len(rows))
+                    return 0
+                failed |= pipeline.wait()
+
+            delivered = [row.id for row in rows if str(row.notification_id) not in failed]
+            retry = [row for row in rows if str(row.notification_id) in failed]
+            OutboxMessage.objects.filter(id__in=delivered).delete()
+            if retry:
+                self._reschedule(retry, now)
+
+        logger.info("Relayed %s outbox messages (%s to retry)", len(delivered), len(retry))
+        return len(rows)
+
+    def retry_delay(self, attempts):
+        """Seconds before the next try of a row that has failed ``attempts`` times."""
+        return min(2 ** min(attempts, 32), self.max_delay)
+
+    def _reschedule(self, rows, now):
+        for row in rows:
+            row.attempts += 1
+            row.available_at = now + timedelta(seconds=self.retry_delay(row.attempts))
+        OutboxMessage.objects.bulk_update(rows, ['attempts', 'available_at'])
+
 
 class NotificationService:
     def __init__(self):
         self.rabbitmq = RabbitMQService()
-    
+        self.idempotency = IdempotencyStore()
+        self.user_limiter = get_user_limiter()
+        self.deduplicator = get_deduplicator()
+        # request_id -> content hash claimed by this service, until sent or released
+        self.content_claims = {}
+        self.use_outbox = settings.NOTIFICATION_USE_OUTBOX
+
+    def via_outbox(self):
+        """
+        Whether new notifications go to the outbox instead of being published
+        inline: always with NOTIFICATION_USE_OUTBOX, otherwise while the
+        broker's circuit breaker is open.
+        """
+        return self.use_outbox or self.rabbitmq.breaker.is_open()
+
+    def create_notification(self, notification_data, outbox=None):
+        if outbox is None:
+            outbox = self.use_outbox
+        notification = Notification(
+            notification_type=notification_data['notification_type'],
+            user_id=notification_data['user_id'],
+            template_code=notification_data['template_code'],
+            variables=notification_data['variables'],
+            request_id=notification_data['request_id'],
+            priority=notification_data.get('priority', 1),
+            metadata=notification_data.get('metadata'),
+            scheduled_at=notification_data.get('scheduled_at'),
+            digest=digest_eligible(notification_data)
+        )
+        with timed('database', 'create_notification'), transaction.atomic():
+            if reserve_requests([notification]):
+                raise DuplicateRequest(notification.request_id)
+            notification.save(force_insert=True)
+            if notification.digest:
+                hold_for_digest([notification])
+            elif outbox or notification.scheduled_at:
+                # The relay publishes it; nothing here waits on the broker.
+                outbox_message_for(notification).save()
+        return notification
+
+    def to_publish(self, notifications, outbox):
+        """The notifications to publish inline; the relay sends the rest."""
+        if outbox:
+            return []
+        return [n for n in notifications if n.scheduled_at is None and not n.digest]
+
     def send_notification(self, notification_data):
         try:
-            
-            notification = Notification.objects.create(
-                notification_type=notification_data['notification_type'],
-                user_id=notification_data['user_id'],
-                template_code=notification_data['template_code'],
-                variables=notification_data['variables'],
-                request_id=notification_data['request_id'],
-                priority=notification_data.get('priority', 1),
-                metadata=notification_data.get('metadata')
-            )
-            
-          
-            message = {
-                'notification_id': str(notification.id),
-                'user_id': str(notification_data['user_id']),
-                'template_code': notification_data['template_code'],
-                'variables': notification_data['variables'],
-                'request_id': notification_data['request_id'],
-                'priority': notification_data.get('priority', 1),
-            }
-            
-           
-            routing_key = f"{notification_data['notification_type']}.queue"
+            outbox = self.via_outbox()
+            try:
+                notification = self.create_notification(notification_data, outbox)
+            except DuplicateRequest:
+                # Its idempotency claim was taken over, but the first request
+                # got its notification in; that one is what gets sent.
+                logger.info("Request %s already has a notification", notification_data['request_id'])
+                return True
+
+            if notification.scheduled_at:
+                logger.info("Notification %s scheduled for %s", notification.id, notification.scheduled_at)
+                return True
+            if notification.digest:
+                logger.info("Notification %s held for the next digest", notification.id)
+                return True
+            if outbox:
+                logger.info("Notification %s written to outbox", notification.id)
+                return True
+
+            [(routing_key, message)] = messages_for([notification])
             success = self.rabbitmq.publish_message(routing_key, message)
-            
+
             if not success:
-                notification.status = Notification.Status.FAILED
-                notification.save()
+                notification.status = NotificationStatus.FAILED
+                notification.save(update_fields=['status', 'updated_at'])
+                get_status_cache().invalidate([notification.id])
+                release_requests([notification])
                 return False
-            
-            logger.info(f"Notification {notification.id} queued successfully")
+
+            logger.info("Notification %s queued successfully", notification.id)
             return True
-            
+
         except Exception as e:
-            logger.error(f"Failed to send notification: {str(e)}")
+            logger.error("Failed to send notification: %s", e)
             return False
-    
-    def check_idempotency(self, request_id):
-        
+
+    def send_batch(self, items):
+        """
+        Queue many validated notifications with set-based writes.
+
+        ``items`` must have distinct request ids. Returns one result dict per
+        item, in order, with a ``status`` of queued, duplicate or failed.
+        """
+        with self.rabbitmq.pipeline() as pipeline:
+            batch = self.queue_batch(items, pipeline)
+            failed = batch.failed | pipeline.wait()
+        return self.finish_batch(batch, failed)
+
+    def queue_batch(self, items, pipeline):
+        """
+        Insert rows for ``items`` and publish them on ``pipeline`` without
+        waiting for confirms. Pass the returned batch to ``finish_batch``
+        once the pipeline has waited past ``batch.last_tag``.
+        """
+        outbox = self.via_outbox()
+        batch = self.insert_batch(items, outbox)
+        publish = self.to_publish(batch.notifications, outbox)
+        if publish:
+            batch.failed = pipeline.publish(messages_for(publish))
+        batch.last_tag = pipeline.last_tag
+        return batch
+
+    def insert_batch(self, items, outbox=None):
+        """
+        Claim the request ids of ``items`` and insert rows for the new ones
+        that do not repeat recent content and are within their recipient's
+        rate limit.
+        """
+        request_ids = [item['request_id'] for item in items]
+        # One statement both finds known request ids and claims the new ones.
+        claimed = set()
+        if request_ids:
+            with timed('cache', 'claim_many'):
+                claimed = self.idempotency.claim_many(request_ids)
+        duplicates = set(request_ids) - claimed
+        IDEMPOTENCY.labels('miss').inc(len(claimed))
+        IDEMPOTENCY.labels('hit').inc(len(duplicates))
+
+        pending = [item for item in items if item['request_id'] in claimed]
+        suppressed = self._suppressed(pending)
+        if suppressed:
+            pending = [item for item in pending if item['request_id'] not in suppressed]
+        rate_limited = self._rate_limited(pending)
+        if rate_limited:
+            self.idempotency.release_many(list(rate_limited))
+            self.release_content(rate_limited)
+            claimed -= rate_limited
+            pending = [item for item in pending if item['request_id'] not in rate_limited]
+
+        notifications = [
+            Notification(
+                notification_type=item['notification_type'],
+                user_id=item['user_id'],
+                template_code=item['template_code'],
+                variables=item['variables'],
+                request_id=item['request_id'],
+                priority=item.get('priority', 1),
+                metadata=item.get('metadata'),
+                scheduled_at=item.get('scheduled_at'),
+                digest=digest_eligible(item)
+            )
+            for item in pending
+        ]
+
         try:
-           
-            cached_response = cache.get(f"idempotency_{request_id}")
-            if cached_response:
-                return cached_response
-            
-            
-            try:
-                key_record = IdempotencyKey.objects.get(key=request_id)
-                cache.set(f"idempotency_{request_id}", key_record.response, timeout=86400)
-                return key_record.response
-            except IdempotencyKey.DoesNotExist:
-                return None
-                
+            taken = self._insert_batch(notifications, self.use_outbox if outbox is None else outbox)
+        except Exception:
+            self.idempotency.release_many(list(claimed))
+            self.release_content(claimed)
+            raise
+        if taken:
+            # Claims taken over from requests that did insert their rows.
+            notifications = [n for n in notifications if n.request_id not in taken]
+            duplicates |= taken
+        return QueuedBatch(request_ids, duplicates, notifications, set(), None, rate_limited, suppressed)
+
+    def _insert_batch(self, notifications, outbox):
+        """Insert ``notifications``, less those whose request id is taken; returns those ids."""
+        with timed('database', 'insert_batch'), transaction.atomic():
+            taken = reserve_requests(notifications)
+            if taken:
+                notifications = [n for n in notifications if n.request_id not in taken]
+            Notification.objects.bulk_create(notifications)
+            digested = [n for n in notifications if n.digest]
+            if digested:
+                hold_for_digest(digested)
+            relayed = [n for n in notifications if not n.digest and (outbox or n.scheduled_at)]
+            if relayed:
+                OutboxMessage.objects.bulk_create(
+                    [outbox_message_for(n) for n in relayed]
+                )
+        return taken
+
+    def finish_batch(self, batch, failed):
+        queued = {}
+        for notification in batch.notifications:
+            if str(notification.id) not in failed:
+                queued[notification.request_id] = notification
+
+        self._store_idempotency_keys(queued, batch.suppressed)
+        unsent = [n for n in batch.notifications if n.request_id not in queued]
+        if unsent:
+            release_requests(unsent)
+            unsent = [n.request_id for n in unsent]
+            self.idempotency.release_many(unsent)
+            self.release_content(unsent)
+        for request_id in queued:
+            self.content_claims.pop(request_id, None)
+        logger.info(
+            "Batch of %s notifications: %s queued, %s duplicate, %s suppressed, %s rate limited",
+            len(batch.request_ids), len(queued), len(batch.duplicates), len(batch.suppressed),
+            len(batch.rate_limited)
+        )
+
+        results = []
+        for request_id in batch.request_ids:
+            if request_id in batch.duplicates:
+                status = 'duplicate'
+            elif request_id in batch.suppressed:
+                status = 'suppressed'
+            elif request_id in batch.rate_limited:
+                status = 'rate_limited'
+            elif request_id in queued:
+                status = 'queued'
+            else:
+                status = 'failed'
+            results.append({
+                'request_id': request_id,
+                'notification_id': request_id,
+                'status': status,
+            })
+        return results
+
+    def _store_idempotency_keys(self, queued, suppressed=()):
+        responses = {request_id: queued_response(request_id) for request_id in queued}
+        responses.update((request_id, suppressed_response(request_id)) for request_id in suppressed)
+        if responses:
+            self.idempotency.complete_many(responses)
+
+    def _suppressed(self, items):
+        if not items or self.deduplicator is None:
+            return set()
+        try:
+            suppressed, claimed = self.deduplicator.claim(items)
         except Exception as e:
-            logger.error(f"Error checking idempotency: {str(e)}")
-            return None
-    
-    def store_idempotency_key(self, request_id, response_data):
-       
+            logger.error("Deduplication unavailable, allowing notifications: %s", e)
+            return set()
+        self.content_claims.update(claimed)
+        return suppressed
+
+    def suppress_duplicate(self, notification_data):
+        """Whether the notification repeats recently accepted content and must not be sent."""
+        return notification_data['request_id'] in self._suppressed([notification_data])
+
+    def release_content(self, request_ids):
+        """Let the content of notifications that were not sent be accepted again."""
+        contents = [self.content_claims.pop(r) for r in request_ids if r in self.content_claims]
+        if contents:
+            self.deduplicator.release(contents)
+
+    def _rate_limited(self, items):
+        if not items or self.user_limiter is None:
+            return set()
         try:
-            IdempotencyKey.objects.create(
-                key=request_id,
-                response=response_data
-            )
-            cache.set(f"idempotency_{request_id}", response_data, timeout=86400)
+            rate_limited, _ = self.user_limiter.limit(items)
         except Exception as e:
-            logger.error(f"Error storing idempotency key: {str(e)}")
-
-class CircuitBreaker:
-    def __init__(self, failure_threshold=5, recovery_timeout=60):
-        self.failure_threshold = failure_threshold
-        self.recovery_timeout = recovery_timeout
-        self.failures = 0
-        self.state = "CLOSED"  
-        self.last_failure_time = None
-    
-    def call(self, func, *args, **kwargs):
-        if self.state == "OPEN":
-            
-            if self._can_retry():
-                self.state = "HALF_OPEN"
-                logger.info("Circuit breaker moving to HALF_OPEN state")
-            else:
-                raise Exception("Circuit breaker is OPEN - service unavailable")
-        
+            logger.error("User rate limiter unavailable, allowing notifications: %s", e)
+            return set()
+        return rate_limited
+
+    def user_retry_after(self, notification_data):
+        """Seconds until the recipient may be sent another notification, 0 if now."""
+        if self.user_limiter is None:
+            return 0
         try:
-            result = func(*args, **kwargs)
-            self._on_success()
-            return result
+            _, retry_after = self.user_limiter.limit([notification_data])
         except Exception as e:
-            self._on_failure()
-            raise e
-    
-    def _on_success(self):
-        self.failures = 0
-        if self.state == "HALF_OPEN":
-            self.state = "CLOSED"
-            logger.info("Circuit breaker moving to CLOSED state")
-    
-    def _on_failure(self):
-        self.failures += 1
-        self.last_failure_time = time.time()
-        
-        if self.failures >= self.failure_threshold:
-            self.state = "OPEN"
-            logger.warning("Circuit breaker moving to OPEN state")
-    
-    def _can_retry(self):
-        if not self.last_failure_time:
-            return True
-        return (time.time() - self.last_failure_time) >= self.recovery_timeout
\ No newline at end of file
+            logger.error("User rate limiter unavailable, allowing notification: %s", e)
+            return 0
+        return retry_after
+
+    def claim_idempotency(self, request_id):
+        with timed('cache', 'claim'):
+            claim = self.idempotency.claim(request_id)
+        if claim.response is not None:
+            IDEMPOTENCY.labels('hit').inc()
+        elif claim.claimed:
+            IDEMPOTENCY.labels('miss').inc()
+        else:
+            IDEMPOTENCY.labels('in_progress').inc()
+        return claim
+
+    def store_idempotency_key(self, request_id, response_data):
+        self.idempotency.complete(request_id, response_data)
+        self.content_claims.pop(request_id, None)
+
+    def release_idempotency_key(self, request_id):
+        self.idempotency.release(request_id)
+        self.release_content([request_id])
@@ -0,0 +1,150 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import STATUS_LOOKUPS, timed
+from .models import Notification, NotificationStatus
+from .serializers import NotificationStatusSerializer
+
+logger = logging.getLogger('notifications')
+
+
+class StatusCache:
+    """
+    Read-through cache of compact status records for the status lookup
+    endpoints.
+
+    Records are cached by notification id, next to a request_id -> id
+    mapping that only changes when a request id is released or reserved
+    again, so status writes only have to know the ids they touched to
+    invalidate them. Mappings and delivered records (delivered is final) are
+    kept for ``final_ttl``; other statuses for ``ttl``, which bounds how long
+    a lookup racing with an update can leave the old status behind.
+    """
+
+    def __init__(self, ttl, final_ttl):
+        self.ttl = ttl
+        self.final_ttl = final_ttl
+
+    def record_key(self, notification_id):
+        return f"notification_status_{notification_id}"
+
+    def request_key(self, request_id):
+        return f"notification_status_request_{request_id}"
+
+    def get_many(self, ids=(), request_ids=()):
+        """
+        Records by id and by request_id (the newest notification created
+        with it); unknown ones map to None.
+        """
+        ids = [str(notification_id) for notification_id in ids]
+        request_ids = list(request_ids)
+
+        mapped = {}
+        records = {}
+        keys = [self.record_key(i) for i in ids] + [self.request_key(r) for r in request_ids]
+        cached = self._get(keys)
+        for notification_id in ids:
+            if self.record_key(notification_id) in cached:
+                records[notification_id] = cached[self.record_key(notification_id)]
+        for request_id in request_ids:
+            if self.request_key(request_id) in cached:
+                mapped[request_id] = cached[self.request_key(request_id)]
+        unresolved = set(mapped.values()) - records.keys()
+        if unresolved:
+            cached = self._get([self.record_key(i) for i in unresolved])
+            for notification_id in unresolved:
+                if self.record_key(notification_id) in cached:
+                    records[notification_id] = cached[self.record_key(notification_id)]
+
+        missing_ids = {i for i in ids if i not in records}
+        missing_ids |= {i for i in mapped.values() if i not in records}
+        missing_requests = [r for r in request_ids if r not in mapped]
+        hits = len(ids) + len(request_ids) - len(missing_ids) - len(missing_requests)
+        STATUS_LOOKUPS.labels('hit').inc(hits)
+        if missing_ids or missing_requests:
+            STATUS_LOOKUPS.labels('miss').inc(len(missing_ids) + len(missing_requests))
+            fetched, fetched_mapping = self._load(missing_ids, missing_requests)
+            records.update(fetched)
+            mapped.update(fetched_mapping)
+
+        by_id = {i: records.get(i) for i in ids}
+        by_request_id = {r: records.get(mapped.get(r)) for r in request_ids}
+        return by_id, by_request_id
+
+    def _load(self, ids, request_ids):
+        notifications = []
+        with timed('database', 'status_lookup'):
+            if ids:
+                notifications += Notification.objects.filter(id__in=ids)
+            if request_ids:
+                # The newest notification wins when a request_id was reused
+                # after its idempotency key expired.
+                notifications += Notification.objects.filter(
+                    request_id__in=request_ids
+                ).order_by('request_id', '-created_at')
+
+        records = {}
+        mapping = {}
+        serialized = NotificationStatusSerializer(notifications, many=True).data
+        for notification, record in zip(notifications, serialized):
+            records[record['id']] = record
+            mapping.setdefault(notification.request_id, record['id'])
+        mapping = {request_id: mapping[request_id] for request_id in request_ids if request_id in mapping}
+        self._set(records, mapping)
+        return records, mapping
+
+    def _get(self, keys):
+        if not keys:
+            return {}
+        try:
+            with timed('cache', 'status_lookup'):
+                return cache.get_many(keys)
+        except Exception as e:
+            logger.error("Status cache unavailable: %s", e)
+            return {}
+
+    def _set(self, records, mapping):
+        final = {self.request_key(r): i for r, i in mapping.items()}
+        other = {}
+        for notification_id, record in records.items():
+            target = final if record['status'] == NotificationStatus.DELIVERED else other
+            target[self.record_key(notification_id)] = record
+        try:
+            if final:
+                cache.set_many(final, timeout=self.final_ttl)
+            if other:
+                cache.set_many(other, timeout=self.ttl)
+        except Exception as e:
+            logger.error("Status cache unavailable: %s", e)
+
+    def invalidate(self, ids):
+        """Drop the records of notifications whose status just changed."""
+        keys = [self.record_key(notification_id) for notification_id in ids]
+        if not keys:
+            return
+        try:
+            cache.delete_many(keys)
+        except Exception as e:
+            logger.error("Could not invalidate %s cached statuses: %s", len(keys), e)
+
+    def forget_requests(self, request_ids):
+        """Drop request_id mappings when the ids are released or taken again."""
+        keys = [self.request_key(request_id) for request_id in request_ids]
+        if not keys:
+            return
+        try:
+            cache.delete_many(keys)
+        except Exception as e:
+            logger.error("Could not forget %s cached request ids: %s", len(keys), e)
+
+
+_status_cache = None
+
+
+def get_status_cache():
+    global _status_cache
+    if _status_cache is None:
+        _status_cache = StatusCache(settings.STATUS_CACHE_TTL, settings.STATUS_CACHE_FINAL_TTL)
+    return _status_cache
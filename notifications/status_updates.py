@@ -0,0 +1,180 @@
+import logging
+from django.db import connection
+from django.utils import timezone
+from .metrics import count_transitions
+from .models import Notification, NotificationDigest, NotificationStatus, status_window
+from .status_cache import get_status_cache
+
+logger = logging.getLogger('notifications')
+
+# The statuses a notification may move to from each current status.
+# Delivered is final and nothing goes back to pending; a failed notification
+# can still turn out delivered when a late ack arrives after a timeout.
+TRANSITIONS = {
+    NotificationStatus.PENDING: (NotificationStatus.FAILED, NotificationStatus.DELIVERED),
+    NotificationStatus.FAILED: (NotificationStatus.DELIVERED,),
+    NotificationStatus.DELIVERED: (),
+}
+
+
+def can_transition(current, new):
+    return new in TRANSITIONS.get(current, ())
+
+
+def previous_statuses(new):
+    """The current statuses that ``new`` is allowed to overwrite."""
+    return [current for current, allowed in TRANSITIONS.items() if new in allowed]
+
+
+def coalesce(updates):
+    """
+    Reduce ``updates`` to one final status per notification.
+
+    Updates are replayed in timestamp order (arrival order for those without
+    one) through the same transitions the database enforces, so a batch ends
+    where applying its updates one by one would have.
+    """
+    def order(item):
+        index, update = item
+        timestamp = update.get('timestamp')
+        return (timestamp is None, timestamp.timestamp() if timestamp else 0, index)
+
+    latest = {}
+    for _, update in sorted(enumerate(updates), key=order):
+        notification_id = update['notification_id']
+        current = latest.get(notification_id)
+        if current is None or can_transition(current, update['status']):
+            latest[notification_id] = update['status']
+    return {
+        notification_id: new_status
+        for notification_id, new_status in latest.items()
+        if new_status != NotificationStatus.PENDING
+    }
+
+
+def expand_digests(updates):
+    """
+    Replace updates reported for a digest with one per notification it
+    carried. Digest ids that are not known are dropped.
+    """
+    digest_ids = {
+        update['notification_id'] for update in updates
+        if str(update['notification_id']).startswith('digest:')
+    }
+    if not digest_ids:
+        return list(updates)
+    members = dict(
+        NotificationDigest.objects.filter(request_id__in=digest_ids).values_list('request_id', 'request_ids')
+    )
+    expanded = []
+    for update in updates:
+        if update['notification_id'] in digest_ids:
+            expanded.extend(
+                dict(update, notification_id=request_id)
+                for request_id in members.get(update['notification_id'], ())
+            )
+        else:
+            expanded.append(update)
+    return expanded
+
+
+def apply_status_updates(updates):
+    """
+    Apply many ``(notification_id, status, timestamp, error)`` updates at once.
+
+    ``notification_id`` is the request_id the notification was created with,
+    as on the single status endpoint, or a digest's request_id to update each
+    notification it carried. Only ``status`` and ``updated_at`` are written,
+    and only where the transition is allowed. Returns the set of notification
+    ids that changed.
+    """
+    latest = coalesce(expand_digests(updates))
+    if not latest:
+        return set()
+    if connection.vendor == 'postgresql':
+        updated = _update_from_values(latest)
+    else:
+        updated = _update_by_status(latest)
+    get_status_cache().invalidate(updated.values())
+    count_transitions(latest[notification_id] for notification_id in updated)
+    return set(updated)
+
+
+def _update_from_values(latest):
+    table = Notification._meta.db_table
+    now = timezone.now()
+    since, created_since = status_window()
+    allowed = ' OR '.join(
+        f"(n.status = '{current}' AND v.status IN ({', '.join(repr(str(s)) for s in new)}))"
+        for current, new in TRANSITIONS.items() if new
+    )
+    values = ', '.join(['(%s, %s)'] * len(latest))
+    params = [value for item in latest.items() for value in item]
+    # The subquery picks the newest notification per request_id, since a
+    # request_id can come back once its idempotency key has expired.
+    # Scheduled notifications count from when they were sent, as in
+    # NotificationQuerySet.recent().
+    window = "({alias}.created_at >= %s OR ({alias}.created_at >= %s AND {alias}.scheduled_at >= %s))"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} AS n SET status = v.status, updated_at = %s "
+            f"FROM (VALUES {values}) AS v (request_id, status) "
+            f"WHERE {window.format(alias='n')} AND n.id = ("
+            f"SELECT l.id FROM {table} AS l "
+            f"WHERE l.request_id = v.request_id AND {window.format(alias='l')} "
+            f"ORDER BY l.created_at DESC LIMIT 1"
+            f") AND ({allowed}) "
+            f"RETURNING n.request_id, n.id",
+            [now, *params, since, created_since, since, since, created_since, since]
+        )
+        return dict(cursor.fetchall())
+
+
+def _update_by_status(latest):
+    now = timezone.now()
+    by_status = {}
+    for notification_id, new_status in latest.items():
+        by_status.setdefault(new_status, []).append(notification_id)
+
+    updated = {}
+    for new_status, notification_ids in by_status.items():
+        matching = Notification.objects.recent().filter(
+            request_id__in=notification_ids, status__in=previous_statuses(new_status)
+        )
+        changed = dict(matching.values_list('request_id', 'id'))
+        matching.update(status=new_status, updated_at=now)
+        updated.update(changed)
+    return updated
+
+
+def apply_status_update(notification_id, new_status):
+    """
+    Apply one update. Returns ``None`` when the notification is unknown,
+    otherwise whether its status changed.
+    """
+    if notification_id.startswith('digest:'):
+        updates = expand_digests([{'notification_id': notification_id, 'status': new_status}])
+        if not updates:
+            return None
+        return bool(apply_status_updates(updates))
+
+    notification = (
+        Notification.objects.recent()
+        .filter(request_id=notification_id)
+        .order_by('-created_at')
+        .values('id', 'created_at')
+        .first()
+    )
+    if notification is None:
+        return None
+    updated = bool(
+        Notification.objects.filter(
+            id=notification['id'],
+            created_at=notification['created_at'],
+            status__in=previous_statuses(new_status)
+        ).update(status=new_status, updated_at=timezone.now())
+    )
+    if updated:
+        get_status_cache().invalidate([notification['id']])
+        count_transitions([new_status])
+    return updated
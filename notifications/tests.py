@@ -1,3 +1,1836 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import skipIf
 
-# Create your tests here.
+import pika
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from django.utils import timezone
+
+from . import async_views, metrics, ratelimit
+from .aio import AsyncRabbitMQPublisher
+from .breaker import CLOSED, HALF_OPEN, CircuitBreaker, CircuitOpenError
+from .dedup import ContentDeduplicator, content_hash
+from .digest import DigestFlusher
+from .enrichment import (
+    MISSING, Enricher, InMemoryTemplateService, InMemoryUserService, UserServiceClient, enrich_messages
+)
+from .envelope import DEFLATE, ENVELOPE_TYPE, decode_messages, encode_envelope, encode_message
+from .fanout import FanOut, FanOutWorker, job_payload
+from .idempotency import Claim, DuplicateRequest, IdempotencyStore, release_requests, reserve_requests
+from .log import AccessLogSampler, JSONFormatter, QueueingHandler
+from .middleware import RateLimitMiddleware
+from .models import (
+    DigestEntry, FanOutJob, FanOutStatus, IdempotencyKey, Notification, NotificationDigest,
+    NotificationRequest, NotificationStatus, OutboxMessage
+)
+from .parsers import ORJSONParser
+from .ratelimit import TokenBucket, UserRateLimiter, parse_limits
+from .renderers import ORJSONRenderer
+from .serializers import NotificationCreateSerializer
+from .services import (
+    ConfirmTracker, NotificationService, OutboxRelay, PoolExhausted, PooledChannel, RabbitMQPool, RabbitMQService,
+    close_rabbitmq_pool, digest_eligible, get_rabbitmq_pool, group_envelopes, hold_for_digest,
+    notification_ids_of, outbox_message_for, queue_topology, routing_key_for
+)
+from .status_updates import apply_status_update, apply_status_updates, coalesce
+from .validation import validate_notification
+
+
+class StubBreaker:
+    def __init__(self, open_=False, retry_in=0):
+        self.open = open_
+        self.seconds_to_trial = retry_in
+        self.failures = 0
+        self.successes = 0
+
+    def allow(self):
+        return None if self.open else 'closed'
+
+    def is_open(self):
+        return self.open
+
+    def retry_in(self):
+        return self.seconds_to_trial if self.open else 0
+
+    def reports_success(self, state):
+        return True
+
+    def call(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    def record_success(self, state):
+        self.successes += 1
+
+    def record_failure(self, state):
+        self.failures += 1
+
+
+class StubChannel:
+    def __init__(self):
+        self.is_open = True
+        self.published = []
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((routing_key, body, properties))
+
+
+class StubConnection:
+    """Delivers the acks or nacks queued in ``replies`` once something is awaiting them."""
+
+    def __init__(self):
+        self.is_open = True
+        self.replies = []
+        self.tracker = None
+
+    def process_data_events(self, time_limit=0):
+        while self.replies and self.tracker is not None and self.tracker.outstanding:
+            self.tracker.on_confirm(SimpleNamespace(method=self.replies.pop(0)))
+
+    def close(self):
+        self.is_open = False
+
+
+class StubRabbitMQ:
+    """Stands in for RabbitMQService; ``reject`` decides which notifications fail."""
+
+    def __init__(self, reject=False, open_=False, retry_in=0):
+        self.reject = reject
+        self.breaker = StubBreaker(open_, retry_in)
+        self.batches = []
+
+    def publish_batch(self, messages, mark_failed=True):
+        with self.pipeline(mark_failed) as pipeline:
+            return pipeline.publish(messages) | pipeline.wait()
+
+    def pipeline(self, mark_failed=True):
+        return StubPipeline(self)
+
+
+class StubPipeline:
+    def __init__(self, rabbitmq):
+        self.rabbitmq = rabbitmq
+        self.refused = False
+        self.last_tag = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def publish(self, messages):
+        messages = list(messages)
+        self.refused = self.rabbitmq.breaker.allow() is None
+        if self.refused:
+            return {i for _, message in messages for i in notification_ids_of(message)}
+        self.rabbitmq.batches.append(messages)
+        if not self.rabbitmq.reject:
+            return set()
+        return {i for _, message in messages for i in notification_ids_of(message)}
+
+    def wait(self, up_to_tag=None, timeout=None):
+        return set()
+
+
+class StubClientLimiter:
+    """Grants the first ``allow`` hits, then asks for ``retry_after`` seconds."""
+
+    def __init__(self, allow=0, retry_after=1.5):
+        self.allow = allow
+        self.retry_after = retry_after
+        self.clients = []
+        self.threads = []
+
+    def hit(self, client):
+        self.clients.append(client)
+        self.threads.append(threading.get_ident())
+        return 0 if len(self.clients) <= self.allow else self.retry_after
+
+
+class StubResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return {'success': True, 'data': self.data}
+
+
+class StubSession:
+    """Answers GETs from ``routes`` by path; every call waits at ``barrier`` if one is given."""
+
+    def __init__(self, routes, barrier=None):
+        self.routes = routes
+        self.barrier = barrier
+        self.paths = []
+
+    def get(self, url, params=None, timeout=None):
+        path = url.split('://', 1)[1].split('/', 1)[1]
+        self.paths.append('/' + path)
+        if self.barrier is not None:
+            self.barrier.wait()
+        return self.routes.get('/' + path, StubResponse(404))
+
+
+def stub_pool(confirms=True, confirm_timeout=0.05):
+    """A real RabbitMQPool holding one stub slot, so no broker is needed."""
+    pool = RabbitMQPool('amqp://stub', size=1, confirms=confirms, confirm_timeout=confirm_timeout)
+    connection = StubConnection()
+    slot = PooledChannel(connection, StubChannel())
+    if confirms:
+        slot.confirms = connection.tracker = ConfirmTracker(confirm_timeout)
+    pool._idle.put_nowait(slot)
+    pool._created = 1
+    return pool, slot
+
+
+def create_notification(**fields):
+    values = {
+        'notification_type': 'email',
+        'user_id': uuid.uuid4(),
+        'template_code': 'welcome',
+        'variables': {'name': 'Ada', 'link': 'https://example.com'},
+        'request_id': str(uuid.uuid4()),
+    }
+    values.update(fields)
+    return Notification.objects.create(**values)
+
+
+def notification_data(**fields):
+    values = {
+        'notification_type': 'email',
+        'user_id': uuid.uuid4(),
+        'template_code': 'welcome',
+        'variables': {'name': 'Ada', 'link': 'https://example.com'},
+        'request_id': str(uuid.uuid4()),
+        'priority': 1,
+    }
+    values.update(fields)
+    return values
+
+
+def fail_after_claim(test):
+    """Make NotificationService raise once a create request holds its claim."""
+    def user_retry_after(self, notification_data):
+        raise RuntimeError('rate limiter exploded')
+
+    test.addCleanup(setattr, NotificationService, 'user_retry_after', NotificationService.user_retry_after)
+    NotificationService.user_retry_after = user_retry_after
+
+
+def ndjson(items):
+    return '\n'.join(json.dumps(item, default=str) for item in items)
+
+
+def message_for(notification):
+    return {
+        'notification_id': str(notification.id),
+        'user_id': str(notification.user_id),
+        'template_code': notification.template_code,
+        'variables': notification.variables,
+        'request_id': notification.request_id,
+        'priority': notification.priority,
+    }
+
+
+class PublishConfirmTests(TestCase):
+    def test_publish_message_waits_for_the_ack(self):
+        pool, slot = stub_pool()
+        slot.connection.replies.append(pika.spec.Basic.Ack(delivery_tag=1))
+        notification = create_notification()
+
+        published = RabbitMQService(pool=pool, breaker=StubBreaker()).publish_message(
+            'email.queue', message_for(notification)
+        )
+
+        self.assertTrue(published)
+        self.assertEqual(len(slot.channel.published), 1)
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, NotificationStatus.PENDING)
+
+    def test_nacked_message_fails_before_returning(self):
+        pool, slot = stub_pool()
+        slot.connection.replies.append(pika.spec.Basic.Nack(delivery_tag=1))
+        notification = create_notification()
+
+        published = RabbitMQService(pool=pool, breaker=StubBreaker()).publish_message(
+            'email.queue', message_for(notification)
+        )
+
+        self.assertFalse(published)
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, NotificationStatus.FAILED)
+
+    def test_unconfirmed_message_fails_after_the_timeout(self):
+        pool, slot = stub_pool(confirm_timeout=0.01)
+        notification = create_notification()
+
+        published = RabbitMQService(pool=pool, breaker=StubBreaker()).publish_message(
+            'email.queue', message_for(notification)
+        )
+
+        self.assertFalse(published)
+        self.assertFalse(slot.confirms.outstanding)
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, NotificationStatus.FAILED)
+
+    def test_without_confirms_publishing_is_enough(self):
+        pool, slot = stub_pool(confirms=False)
+        notification = create_notification()
+
+        published = RabbitMQService(pool=pool, breaker=StubBreaker()).publish_message(
+            'email.queue', message_for(notification)
+        )
+
+        self.assertTrue(published)
+        self.assertEqual(len(slot.channel.published), 1)
+
+
+class RabbitMQPoolTests(TestCase):
+    def pool(self, size=2):
+        pool = RabbitMQPool('amqp://stub', size=size, acquire_timeout=0.01)
+        pool.opened = []
+
+        def open_slot():
+            slot = PooledChannel(StubConnection(), StubChannel())
+            pool.opened.append(slot)
+            return slot
+
+        pool._open = open_slot
+        return pool
+
+    def test_channels_are_reused_across_publishes(self):
+        pool = self.pool()
+        for _ in range(3):
+            with pool.channel() as slot:
+                slot.channel.basic_publish('notifications.direct', 'email.queue', b'{}', None)
+
+        self.assertEqual(len(pool.opened), 1)
+        self.assertEqual(len(pool.opened[0].channel.published), 3)
+        self.assertEqual(pool.stats(), {'size': 2, 'created': 1, 'idle': 1, 'in_use': 0})
+
+    def test_broken_channels_are_replaced(self):
+        pool = self.pool()
+        with self.assertRaises(ConnectionError):
+            with pool.channel():
+                raise ConnectionError('connection reset')
+        with pool.channel() as slot:
+            pass
+
+        self.assertEqual(len(pool.opened), 2)
+        self.assertFalse(pool.opened[0].connection.is_open)
+        self.assertIs(slot, pool.opened[1])
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_acquire_waits_for_a_free_slot_then_times_out(self):
+        pool = self.pool(size=1)
+        held = pool.acquire()
+
+        with self.assertRaises(PoolExhausted):
+            pool.acquire()
+        pool.release(held)
+        self.assertIs(pool.acquire(), held)
+
+    def test_exhaustion_does_not_trip_the_breaker(self):
+        pool = self.pool(size=1)
+        pool.acquire()
+        breaker = CircuitBreaker(f'test-{uuid.uuid4()}', failure_threshold=1, recovery_timeout=0.05)
+        breaker.redis = None
+        service = RabbitMQService(pool=pool, breaker=breaker)
+
+        notification = create_notification()
+        self.assertFalse(service.publish_message('email.queue', message_for(notification)))
+        self.assertEqual(service.publish_batch([('email.queue', message_for(notification))]), {str(notification.id)})
+        self.assertFalse(breaker.is_open())
+
+        # Nor does it use up a half-open trial.
+        breaker.record_failure(CLOSED)
+        time.sleep(0.06)
+        with self.assertRaises(PoolExhausted):
+            breaker.call(pool.acquire)
+        self.assertEqual(breaker.allow(), HALF_OPEN)
+
+    def test_pool_is_rebuilt_in_a_forked_process(self):
+        pool = get_rabbitmq_pool()
+        self.assertIs(get_rabbitmq_pool(), pool)
+
+        pool.pid = -1
+        try:
+            self.assertIsNot(get_rabbitmq_pool(), pool)
+        finally:
+            close_rabbitmq_pool()
+
+
+class OutboxRelayTests(TestCase):
+    def queue(self, count=1):
+        notifications = [create_notification() for _ in range(count)]
+        OutboxMessage.objects.bulk_create([outbox_message_for(n) for n in notifications])
+        return notifications
+
+    def test_published_rows_are_deleted(self):
+        self.queue(3)
+        rabbitmq = StubRabbitMQ()
+
+        relayed = OutboxRelay(rabbitmq=rabbitmq).relay_batch()
+
+        self.assertEqual(relayed, 3)
+        self.assertEqual(len(rabbitmq.batches[0]), 3)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_rejected_rows_are_kept_and_backed_off(self):
+        [notification] = self.queue()
+        relay = OutboxRelay(rabbitmq=StubRabbitMQ(reject=True))
+
+        before = timezone.now()
+        relay.relay_batch()
+
+        row = OutboxMessage.objects.get()
+        self.assertEqual(row.attempts, 1)
+        self.assertGreaterEqual(row.available_at, before + timedelta(seconds=2))
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, NotificationStatus.PENDING)
+
+    def test_rows_are_never_given_up(self):
+        [notification] = self.queue()
+        OutboxMessage.objects.update(attempts=50)
+        relay = OutboxRelay(max_delay=300, rabbitmq=StubRabbitMQ(reject=True))
+
+        before = timezone.now()
+        relay.relay_batch()
+
+        row = OutboxMessage.objects.get()
+        self.assertEqual(row.attempts, 51)
+        self.assertLessEqual(row.available_at, timezone.now() + timedelta(seconds=300))
+        self.assertGreaterEqual(row.available_at, before + timedelta(seconds=300))
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, NotificationStatus.PENDING)
+
+    def test_open_breaker_leaves_rows_and_attempts_alone(self):
+        self.queue(2)
+        rabbitmq = StubRabbitMQ(reject=True, open_=True, retry_in=12.5)
+        relay = OutboxRelay(rabbitmq=rabbitmq)
+
+        self.assertEqual(relay.relay_batch(), 0)
+
+        self.assertEqual(rabbitmq.batches, [])
+        self.assertEqual(list(OutboxMessage.objects.values_list('attempts', flat=True)), [0, 0])
+        self.assertEqual(relay.idle_delay(0.5), 12.5)
+
+    def test_publish_refused_mid_pass_counts_no_attempt(self):
+        self.queue()
+        rabbitmq = StubRabbitMQ()
+        # Closed when the relay looks, taken by another caller's trial when it publishes.
+        rabbitmq.breaker.allow = lambda: None
+        relay = OutboxRelay(rabbitmq=rabbitmq)
+
+        self.assertEqual(relay.relay_batch(), 0)
+
+        row = OutboxMessage.objects.get()
+        self.assertEqual(row.attempts, 0)
+        self.assertLessEqual(row.available_at, timezone.now())
+
+    def test_idle_delay_is_the_interval_while_the_breaker_is_closed(self):
+        self.assertEqual(OutboxRelay(rabbitmq=StubRabbitMQ()).idle_delay(0.5), 0.5)
+
+    def test_retry_delay_is_capped(self):
+        relay = OutboxRelay(max_delay=300, rabbitmq=StubRabbitMQ())
+
+        self.assertEqual([relay.retry_delay(n) for n in (1, 2, 8, 9, 1000)], [2, 4, 256, 300, 300])
+
+
+@override_settings(NOTIFICATION_USE_OUTBOX=True)
+class RequestGuardTests(TestCase):
+    def service(self):
+        service = NotificationService()
+        service.rabbitmq = StubRabbitMQ()
+        return service
+
+    def test_second_notification_for_a_request_id_is_refused(self):
+        data = notification_data()
+        first = self.service().create_notification(data)
+
+        with self.assertRaises(DuplicateRequest):
+            self.service().create_notification(notification_data(request_id=data['request_id']))
+
+        self.assertEqual(Notification.objects.filter(request_id=data['request_id']).count(), 1)
+        self.assertEqual(NotificationRequest.objects.get(request_id=data['request_id']).notification_id, first.id)
+
+    def test_duplicate_single_request_counts_as_queued(self):
+        data = notification_data()
+        self.service().create_notification(data)
+
+        self.assertTrue(self.service().send_notification(notification_data(request_id=data['request_id'])))
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_batch_reports_guarded_request_ids_as_duplicates(self):
+        taken = notification_data()
+        self.service().create_notification(taken)
+        # As if the idempotency claim had been taken over after it went stale.
+        service = self.service()
+        service.idempotency.claim_many = lambda request_ids: set(request_ids)
+
+        items = [notification_data(request_id=taken['request_id']), notification_data()]
+        results = service.finish_batch(service.insert_batch(items, outbox=True), set())
+
+        self.assertEqual([r['status'] for r in results], ['duplicate', 'queued'])
+        self.assertEqual(Notification.objects.filter(request_id=taken['request_id']).count(), 1)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    @override_settings(NOTIFICATION_USE_OUTBOX=False)
+    def test_failed_publish_frees_the_request_id_for_a_retry(self):
+        data = notification_data()
+        service = self.service()
+        service.rabbitmq = RabbitMQService(pool=stub_pool(confirm_timeout=0.01)[0], breaker=StubBreaker())
+
+        self.assertFalse(service.send_notification(data))
+        self.assertFalse(NotificationRequest.objects.filter(request_id=data['request_id']).exists())
+
+        retry = self.service().create_notification(notification_data(request_id=data['request_id']))
+        self.assertEqual(NotificationRequest.objects.get(request_id=data['request_id']).notification_id, retry.id)
+
+    def test_unsent_batch_items_free_their_request_ids(self):
+        service = self.service()
+        items = [notification_data(), notification_data()]
+        batch = service.insert_batch(items, outbox=False)
+
+        results = service.finish_batch(batch, {str(batch.notifications[0].id)})
+
+        self.assertEqual([r['status'] for r in results], ['failed', 'queued'])
+        self.assertEqual(
+            list(NotificationRequest.objects.values_list('request_id', flat=True)), [items[1]['request_id']]
+        )
+
+    @override_settings(IDEMPOTENCY_TTL=60)
+    def test_expired_request_id_can_be_used_again(self):
+        data = notification_data()
+        self.service().create_notification(data)
+        NotificationRequest.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+
+        second = self.service().create_notification(notification_data(request_id=data['request_id']))
+
+        self.assertEqual(NotificationRequest.objects.get(request_id=data['request_id']).notification_id, second.id)
+
+
+@override_settings(RATE_LIMIT_ENABLED=True)
+class RateLimitMiddlewareTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.limiter = StubClientLimiter()
+        self.addCleanup(setattr, ratelimit, '_client_limiter', ratelimit._client_limiter)
+        ratelimit._client_limiter = self.limiter
+
+    def test_async_requests_hit_the_limiter_off_the_event_loop(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = RateLimitMiddleware(get_response)
+        request = self.factory.post('/api/v1/notifications/')
+
+        async def call():
+            return threading.get_ident(), await middleware(request)
+
+        loop_thread, response = asyncio.run(call())
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertNotEqual(self.limiter.threads, [loop_thread])
+
+    def test_async_reads_skip_the_limiter(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = RateLimitMiddleware(get_response)
+        response = asyncio.run(middleware(self.factory.get('/api/v1/notifications/')))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.limiter.clients, [])
+
+    def middleware(self):
+        return RateLimitMiddleware(lambda request: HttpResponse())
+
+    def test_client_over_its_limit_gets_429_with_retry_after(self):
+        self.limiter.allow = 1
+        middleware = self.middleware()
+
+        first = middleware(self.factory.post('/api/v1/notifications/'))
+        second = middleware(self.factory.post('/api/v1/notifications/'))
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 429)
+        self.assertEqual(second['Retry-After'], '2')
+
+    def test_clients_are_keyed_on_the_address_the_proxy_appended(self):
+        self.limiter.allow = 10
+        middleware = self.middleware()
+
+        middleware(self.factory.post(
+            '/api/v1/notifications/', HTTP_X_FORWARDED_FOR='203.0.113.9, 198.51.100.7',
+            HTTP_X_CLIENT_ID='someone-else', REMOTE_ADDR='10.0.0.2'
+        ))
+        middleware(self.factory.post('/api/v1/notifications/', REMOTE_ADDR='10.0.0.2'))
+
+        self.assertEqual(self.limiter.clients, ['198.51.100.7', '10.0.0.2'])
+
+    @override_settings(RATE_LIMIT_TRUSTED_PROXIES=0)
+    def test_without_a_proxy_the_peer_address_is_used(self):
+        self.limiter.allow = 10
+
+        self.middleware()(self.factory.post(
+            '/api/v1/notifications/', HTTP_X_FORWARDED_FOR='203.0.113.9', REMOTE_ADDR='10.0.0.2'
+        ))
+
+        self.assertEqual(self.limiter.clients, ['10.0.0.2'])
+
+    def test_status_callbacks_are_exempt(self):
+        middleware = self.middleware()
+
+        for path in ('/api/v1/notifications/email/status/', '/api/v1/notifications/push/status/batch/'):
+            self.assertEqual(middleware(self.factory.post(path)).status_code, 200)
+        self.assertEqual(self.limiter.clients, [])
+
+    @override_settings(RATE_LIMIT_ENABLED=False)
+    def test_disabled_limiter_lets_everything_through(self):
+        self.assertEqual(self.middleware()(self.factory.post('/api/v1/notifications/')).status_code, 200)
+        self.assertEqual(self.limiter.clients, [])
+
+
+class UserServiceClientTests(TestCase):
+    def client_for(self, session):
+        client = UserServiceClient('http://users.test', max_workers=4)
+        client.session = session
+        client.breaker = StubBreaker()
+        return client
+
+    def test_user_and_push_tokens_are_fetched_concurrently(self):
+        user_id = str(uuid.uuid4())
+        session = StubSession({
+            f'/api/v1/users/{user_id}': StubResponse(200, {
+                'email': 'ada@example.com', 'first_name': 'Ada', 'last_name': 'Lovelace',
+                'preferences': {'email_notifications': True, 'push_notifications': False},
+            }),
+            f'/api/v1/users/{user_id}/push-tokens': StubResponse(200, [
+                {'token': 'device-1', 'is_active': True}, {'token': 'device-2', 'is_active': False},
+            ]),
+        }, barrier=threading.Barrier(2, timeout=2))
+
+        user = self.client_for(session).fetch_many([user_id])[user_id]
+
+        self.assertEqual(len(session.paths), 2)
+        self.assertEqual(user, {
+            'email': 'ada@example.com',
+            'name': 'Ada Lovelace',
+            'preferences': {'email_notifications': True, 'push_notifications': False},
+            'push_tokens': ['device-1'],
+        })
+
+    def test_unknown_users_are_missing_and_errors_are_none(self):
+        unknown, broken = str(uuid.uuid4()), str(uuid.uuid4())
+        session = StubSession({f'/api/v1/users/{broken}': StubResponse(500)})
+
+        users = self.client_for(session).fetch_many([unknown, broken])
+
+        self.assertIs(users[unknown], MISSING)
+        self.assertIsNone(users[broken])
+
+    def test_user_is_kept_when_push_tokens_cannot_be_read(self):
+        forbidden, failing = str(uuid.uuid4()), str(uuid.uuid4())
+        session = StubSession({
+            f'/api/v1/users/{forbidden}': StubResponse(200, {'email': 'f@example.com'}),
+            f'/api/v1/users/{forbidden}/push-tokens': StubResponse(403),
+            f'/api/v1/users/{failing}': StubResponse(200, {'email': 'e@example.com'}),
+            f'/api/v1/users/{failing}/push-tokens': StubResponse(500),
+        })
+        client = self.client_for(session)
+
+        users = client.fetch_many([forbidden, failing])
+
+        self.assertEqual(users[forbidden]['email'], 'f@example.com')
+        self.assertEqual(users[forbidden]['push_tokens'], [])
+        self.assertEqual(users[failing]['push_tokens'], [])
+
+
+class FanOutPreferenceTests(TestCase):
+    def test_channels_switched_off_in_user_service_preferences_are_dropped(self):
+        email_only, push_only, unknown = (str(uuid.uuid4()) for _ in range(3))
+        # As GET /api/v1/users/:id embeds them (UserPreferences in the User Service).
+        users = {
+            email_only: {'email': 'a@example.com', 'preferences': {
+                'email_notifications': True, 'push_notifications': False,
+                'notification_frequency': 'immediate', 'timezone': 'UTC', 'language': 'en',
+            }},
+            push_only: {'email': 'b@example.com', 'preferences': {
+                'email_notifications': False, 'push_notifications': True,
+                'notification_frequency': 'daily', 'timezone': 'UTC', 'language': 'en',
+            }},
+        }
+        enricher = Enricher(InMemoryUserService(users), InMemoryTemplateService())
+        data = {
+            'channels': {'email', 'push'}, 'user_ids': [email_only, push_only, unknown],
+            'template_code': 'welcome', 'variables': {'name': 'Ada', 'link': 'https://example.com'},
+            'request_id': 'campaign-1',
+        }
+
+        items, opted_out = FanOut(notification_service=object(), enricher=enricher).expand(
+            data, [email_only, push_only, unknown]
+        )
+
+        self.assertEqual(opted_out, 2)
+        self.assertEqual(
+            sorted((item['user_id'], item['notification_type']) for item in items),
+            sorted([(email_only, 'email'), (push_only, 'push'), (unknown, 'email'), (unknown, 'push')])
+        )
+
+
+def fanout_request(**fields):
+    values = {
+        'channels': ['email', 'push'],
+        'user_ids': [str(uuid.uuid4()), str(uuid.uuid4())],
+        'template_code': 'welcome',
+        'variables': {'name': 'Ada', 'link': 'https://example.com'},
+        'request_id': f'campaign-{uuid.uuid4()}',
+    }
+    values.update(fields)
+    return values
+
+
+@override_settings(USER_SERVICE_URL='')
+class FanOutJobTests(TestCase):
+    def worker(self, **pool_options):
+        service = NotificationService()
+        service.rabbitmq = RabbitMQService(pool=stub_pool(**pool_options)[0], breaker=StubBreaker())
+        return FanOutWorker(notification_service=service)
+
+    def test_request_is_accepted_as_a_job(self):
+        body = fanout_request()
+
+        response = APIClient().post('/api/v1/notifications/fanout/', body, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        job = FanOutJob.objects.get()
+        self.assertEqual(response.json()['data']['job_id'], str(job.id))
+        self.assertEqual(job.status, FanOutStatus.PENDING)
+        self.assertEqual(job.payload['user_ids'], body['user_ids'])
+        self.assertFalse(Notification.objects.exists())
+
+        replay = APIClient().post('/api/v1/notifications/fanout/', body, format='json')
+        self.assertEqual(replay.json()['data']['job_id'], str(job.id))
+        self.assertEqual(FanOutJob.objects.count(), 1)
+
+    @override_settings(FANOUT_MAX_RECIPIENTS=2)
+    def test_audience_size_is_capped(self):
+        body = fanout_request(user_ids=[str(uuid.uuid4()) for _ in range(3)])
+
+        response = APIClient().post('/api/v1/notifications/fanout/', body, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('user_ids', response.json()['data'])
+        self.assertFalse(FanOutJob.objects.exists())
+
+    @override_settings(NOTIFICATION_USE_OUTBOX=True)
+    def test_worker_expands_the_job(self):
+        data = fanout_request()
+        job = FanOutJob.objects.create(request_id=data['request_id'], payload=job_payload(data))
+
+        self.assertEqual(self.worker().run_once().id, job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, FanOutStatus.DONE)
+        self.assertEqual(job.counts['queued'], 4)
+        self.assertEqual(Notification.objects.count(), 4)
+        self.assertIsNone(self.worker().run_once())
+
+        response = APIClient().get(f'/api/v1/notifications/fanout/{job.id}/')
+        self.assertEqual(response.json()['data']['status'], 'done')
+
+    @override_settings(NOTIFICATION_USE_OUTBOX=False)
+    def test_failed_pass_is_retried_later(self):
+        data = fanout_request(channels=['email'])
+        job = FanOutJob.objects.create(request_id=data['request_id'], payload=job_payload(data))
+
+        before = timezone.now()
+        self.worker(confirm_timeout=0.01).run_once()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, FanOutStatus.PENDING)
+        self.assertEqual(job.counts['failed'], 2)
+        self.assertGreaterEqual(job.available_at, before + timedelta(seconds=2))
+
+    def test_job_with_a_live_lease_is_not_taken_over(self):
+        data = fanout_request()
+        FanOutJob.objects.create(
+            request_id=data['request_id'], payload=job_payload(data), status=FanOutStatus.RUNNING,
+            available_at=timezone.now() + timedelta(minutes=5)
+        )
+
+        self.assertIsNone(self.worker().run_once())
+
+
+class StubExchange:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        if self.fail:
+            raise ConnectionError('broker gone')
+        self.published.append(routing_key)
+
+
+class AsyncPublisherBreakerTests(TestCase):
+    def publisher(self, breaker, exchange):
+        publisher = AsyncRabbitMQPublisher('amqp://stub')
+        publisher.breaker = breaker
+
+        async def get_exchange():
+            return exchange
+
+        publisher._get_exchange = get_exchange
+        return publisher
+
+    def test_open_breaker_skips_the_publish(self):
+        exchange = StubExchange()
+        publisher = self.publisher(StubBreaker(open_=True), exchange)
+
+        self.assertFalse(asyncio.run(publisher.publish('email.queue', {'notification_id': 'n1'})))
+        self.assertEqual(exchange.published, [])
+
+    def test_outcomes_are_recorded_with_the_allowed_state(self):
+        breaker = StubBreaker()
+        ok = self.publisher(breaker, StubExchange())
+        broken = self.publisher(breaker, StubExchange(fail=True))
+
+        self.assertTrue(asyncio.run(ok.publish('email.queue', {'notification_id': 'n1'})))
+        self.assertFalse(asyncio.run(broken.publish('email.queue', {'notification_id': 'n2'})))
+
+        self.assertEqual((breaker.successes, breaker.failures), (1, 1))
+
+    def test_half_open_trial_closes_a_real_breaker(self):
+        breaker = CircuitBreaker('test-async', failure_threshold=1, recovery_timeout=0.05)
+        breaker.redis = None
+        breaker.record_failure(CLOSED)
+        self.assertTrue(breaker.is_open())
+        self.assertGreater(breaker.retry_in(), 0)
+
+        time.sleep(0.06)
+        self.assertTrue(asyncio.run(self.publisher(breaker, StubExchange()).publish('email.queue', {})))
+
+        self.assertFalse(breaker.is_open())
+        self.assertEqual(breaker.retry_in(), 0)
+
+    def test_failed_digests_report_every_notification_they_carry(self):
+        publisher = self.publisher(StubBreaker(), StubExchange(fail=True))
+        messages = [
+            ('push.queue', {'notification_ids': ['n1', 'n2'], 'request_id': 'digest:n1'}),
+            ('email.queue', {'notification_id': 'n3', 'request_id': 'r3'}),
+        ]
+
+        self.assertEqual(asyncio.run(publisher.publish_many(messages)), {'n1', 'n2', 'n3'})
+
+
+class FailingEnricher:
+    def enrich(self, messages):
+        raise ConnectionError('user service down')
+
+
+@override_settings(NOTIFICATION_DIGEST_WINDOW=60, NOTIFICATION_ENRICHMENT=True)
+class DigestTests(TestCase):
+    template = {'name': 'Digest', 'subject': 'You have news', 'body': 'Catch up on what you missed'}
+
+    def hold(self, user_id, count=2, notification_type='push', age=120):
+        notifications = [
+            create_notification(user_id=user_id, notification_type=notification_type, digest=True)
+            for _ in range(count)
+        ]
+        hold_for_digest(notifications)
+        if age:
+            held_at = timezone.now() - timedelta(seconds=age)
+            DigestEntry.objects.update(created_at=held_at, due_at=held_at + timedelta(seconds=60))
+        return notifications
+
+    def flusher(self, users, rabbitmq=None, **options):
+        enricher = Enricher(InMemoryUserService(users), InMemoryTemplateService({'digest': self.template}))
+        return DigestFlusher(rabbitmq=rabbitmq or StubRabbitMQ(), enricher=enricher, **options)
+
+    def user(self, push_tokens):
+        return {
+            'email': 'ada@example.com', 'push_tokens': push_tokens,
+            'preferences': {'email_notifications': True, 'push_notifications': True},
+        }
+
+    def test_digests_go_out_enriched_for_the_push_consumer(self):
+        user_id = uuid.uuid4()
+        self.hold(user_id)
+        rabbitmq = StubRabbitMQ()
+
+        self.assertEqual(self.flusher({str(user_id): self.user(['token-1'])}, rabbitmq).flush_batch(), 2)
+
+        [[(routing_key, message)]] = rabbitmq.batches
+        self.assertTrue(routing_key.startswith('push'))
+        self.assertEqual(message['recipient_id'], str(user_id))
+        self.assertEqual(message['device_token'], 'token-1')
+        self.assertEqual(message['payload']['title'], 'You have news')
+        self.assertFalse(DigestEntry.objects.exists())
+
+    @override_settings(NOTIFICATION_DIGEST_MAX_ITEMS=3)
+    def test_full_buckets_fall_due_before_their_window(self):
+        user_id = uuid.uuid4()
+        self.hold(user_id, count=2, age=0)
+        flusher = self.flusher({str(user_id): self.user(['token-1'])}, max_items=3)
+        self.assertEqual(flusher.due_buckets(timezone.now()), [])
+
+        self.hold(user_id, count=2, age=0)
+        self.assertEqual(flusher.flush_batch(), 3)
+
+        self.assertEqual(DigestEntry.objects.count(), 1)
+        self.assertEqual(flusher.due_buckets(timezone.now()), [])
+
+    def test_digest_status_reaches_every_notification_it_carried(self):
+        user_id = uuid.uuid4()
+        held = self.hold(user_id)
+        rabbitmq = StubRabbitMQ()
+        self.flusher({str(user_id): self.user(['token-1'])}, rabbitmq).flush_batch()
+        digest_id = rabbitmq.batches[0][0][1]['request_id']
+
+        updated = apply_status_updates([{'notification_id': digest_id, 'status': NotificationStatus.DELIVERED}])
+
+        self.assertEqual(updated, {n.request_id for n in held})
+        self.assertEqual(
+            set(Notification.objects.filter(id__in=[n.id for n in held]).values_list('status', flat=True)),
+            {NotificationStatus.DELIVERED}
+        )
+
+    def test_single_status_update_for_a_digest(self):
+        NotificationDigest.objects.create(request_id='digest:known', request_ids=[
+            create_notification().request_id, create_notification().request_id
+        ])
+
+        self.assertTrue(apply_status_update('digest:known', NotificationStatus.FAILED))
+        self.assertIsNone(apply_status_update('digest:unknown', NotificationStatus.FAILED))
+
+    def test_push_digest_for_a_user_without_devices_fails(self):
+        user_id = uuid.uuid4()
+        held = self.hold(user_id)
+        rabbitmq = StubRabbitMQ()
+
+        self.flusher({str(user_id): self.user([])}, rabbitmq).flush_batch()
+
+        self.assertEqual(rabbitmq.batches, [])
+        self.assertFalse(DigestEntry.objects.exists())
+        self.assertEqual(
+            set(Notification.objects.filter(id__in=[n.id for n in held]).values_list('status', flat=True)),
+            {NotificationStatus.FAILED}
+        )
+
+    def test_push_digest_for_an_unresolved_user_waits_until_max_age(self):
+        user_id = uuid.uuid4()
+        self.hold(user_id)
+
+        self.flusher({}, max_age=3600).flush_batch()
+        self.assertEqual(DigestEntry.objects.count(), 2)
+
+        DigestEntry.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        self.flusher({}, max_age=3600).flush_batch()
+        self.assertFalse(DigestEntry.objects.exists())
+
+    def test_failed_enrichment_leaves_entries_for_the_next_pass(self):
+        self.hold(uuid.uuid4())
+        rabbitmq = StubRabbitMQ()
+
+        self.assertEqual(DigestFlusher(rabbitmq=rabbitmq, enricher=FailingEnricher()).flush_batch(), 0)
+
+        self.assertEqual(rabbitmq.batches, [])
+        self.assertEqual(DigestEntry.objects.count(), 2)
+
+    def test_digests_are_only_held_when_they_will_be_enriched(self):
+        item = notification_data(digest=True)
+        self.assertTrue(digest_eligible(item))
+        with override_settings(NOTIFICATION_ENRICHMENT=False):
+            self.assertFalse(digest_eligible(item))
+
+
+class BatchEndpointTests(TestCase):
+    def post(self, body, **options):
+        return APIClient().post('/api/v1/notifications/batch/', body, format='json', **options)
+
+    def test_each_item_gets_its_own_result(self):
+        item = notification_data()
+        invalid = notification_data(template_code=None)
+
+        response = self.post([item, invalid, dict(item)])
+
+        self.assertEqual(response.status_code, 202)
+        data = response.json()['data']
+        self.assertEqual(
+            [result['status'] for result in data['results']], ['queued', 'invalid', 'duplicate']
+        )
+        self.assertEqual((data['queued'], data['invalid'], data['duplicate']), (1, 1, 1))
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_ndjson_bodies_are_accepted(self):
+        response = APIClient().post(
+            '/api/v1/notifications/batch/', ndjson([notification_data() for _ in range(3)]),
+            content_type='application/x-ndjson'
+        )
+
+        self.assertEqual(response.json()['data']['queued'], 3)
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_a_request_id_sent_before_is_a_duplicate(self):
+        item = notification_data()
+        self.post([item])
+
+        response = self.post([item, notification_data()])
+
+        self.assertEqual([r['status'] for r in response.json()['data']['results']], ['duplicate', 'queued'])
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_all_invalid_or_oversized_batches_are_rejected(self):
+        self.assertEqual(self.post([notification_data(user_id='nobody')]).status_code, 400)
+        with override_settings(NOTIFICATION_BATCH_MAX_ITEMS=2):
+            self.assertEqual(self.post([notification_data() for _ in range(3)]).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertFalse(Notification.objects.exists())
+
+
+class StreamEndpointTests(TestCase):
+    def post(self, body, content_type='application/x-ndjson'):
+        return APIClient().post('/api/v1/notifications/stream/', body, content_type=content_type)
+
+    @override_settings(NOTIFICATION_STREAM_CHUNK_SIZE=2)
+    def test_results_stream_back_in_order_across_chunks(self):
+        items = [notification_data() for _ in range(4)]
+        body = ndjson(items[:2]) + '\n{not json\n\n' + ndjson(items[2:] + [items[0]])
+
+        response = self.post(body)
+
+        self.assertEqual(response.status_code, 200)
+        results = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3, 4, 5])
+        self.assertEqual(
+            [result['status'] for result in results],
+            ['queued', 'queued', 'invalid', 'queued', 'queued', 'duplicate']
+        )
+        self.assertEqual(Notification.objects.count(), 4)
+
+    def test_only_ndjson_is_accepted(self):
+        response = self.post(json.dumps([]), content_type='application/json')
+
+        self.assertEqual(response.status_code, 415)
+
+
+@override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.1, IDEMPOTENCY_CLAIM_TTL=30)
+class IdempotencyStoreTests(TestCase):
+    def test_first_claim_wins_and_the_response_is_replayed(self):
+        store = IdempotencyStore()
+        request_id = str(uuid.uuid4())
+
+        self.assertTrue(store.claim(request_id).claimed)
+        store.complete(request_id, {'success': True})
+
+        replay = store.claim(request_id)
+        self.assertEqual(replay.state, Claim.DONE)
+        self.assertEqual(replay.response, {'success': True})
+
+    def test_duplicate_of_an_in_flight_request_waits_then_gives_up(self):
+        store = IdempotencyStore()
+        request_id = str(uuid.uuid4())
+        store.claim(request_id)
+
+        started = time.monotonic()
+        self.assertEqual(store.claim(request_id).state, Claim.IN_PROGRESS)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+    def test_duplicate_picks_up_a_response_that_arrives_while_waiting(self):
+        store = IdempotencyStore()
+        request_id = str(uuid.uuid4())
+        store.claim(request_id)
+        finisher = threading.Timer(0.02, store._cache_set, [request_id, {'success': True}])
+        finisher.start()
+
+        with override_settings(IDEMPOTENCY_WAIT_TIMEOUT=1.0):
+            claim = IdempotencyStore().claim(request_id)
+
+        finisher.join()
+        self.assertEqual(claim.response, {'success': True})
+
+    def test_database_answers_when_the_cache_lost_the_key(self):
+        store = IdempotencyStore()
+        request_id = str(uuid.uuid4())
+        store.claim(request_id)
+        store.complete(request_id, {'success': True})
+        cache.delete(store.cache_key(request_id))
+
+        self.assertEqual(store.claim(request_id).response, {'success': True})
+        self.assertIsNotNone(cache.get(store.cache_key(request_id)))
+
+    def test_claim_left_by_a_dead_request_is_taken_over(self):
+        store = IdempotencyStore()
+        request_id = str(uuid.uuid4())
+        store.claim(request_id)
+        IdempotencyKey.objects.filter(key=request_id).update(
+            created_at=timezone.now() - timedelta(minutes=5)
+        )
+        cache.delete(store.cache_key(request_id))
+
+        self.assertTrue(store.claim(request_id).claimed)
+
+    def test_released_claim_lets_a_retry_run(self):
+        store = IdempotencyStore()
+        request_id = str(uuid.uuid4())
+        store.claim(request_id)
+        store.release(request_id)
+
+        self.assertTrue(store.claim(request_id).claimed)
+
+    def test_create_endpoint_replays_the_first_response(self):
+        item = notification_data()
+
+        first = APIClient().post('/api/v1/notifications/', item, format='json')
+        second = APIClient().post('/api/v1/notifications/', item, format='json')
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_create_endpoint_releases_the_claim_on_errors(self):
+        item = notification_data()
+        fail_after_claim(self)
+
+        response = APIClient().post('/api/v1/notifications/', item, format='json')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertTrue(IdempotencyStore().claim(item['request_id']).claimed)
+
+
+class IdempotencyExpiryTests(TestCase):
+    def test_expired_key_is_claimed_again(self):
+        store = IdempotencyStore()
+        request_id = str(uuid.uuid4())
+        store.claim(request_id)
+        store.complete(request_id, {'success': True})
+        IdempotencyKey.objects.filter(key=request_id).update(expires_at=timezone.now())
+        cache.delete(store.cache_key(request_id))
+
+        self.assertTrue(store.claim(request_id).claimed)
+        key = IdempotencyKey.objects.get(key=request_id)
+        self.assertIsNone(key.response)
+        self.assertGreater(key.expires_at, timezone.now())
+
+    def test_prune_deletes_only_expired_keys(self):
+        now = timezone.now()
+        IdempotencyKey.objects.bulk_create(
+            [IdempotencyKey(key=f'old-{i}', expires_at=now - timedelta(seconds=1)) for i in range(5)]
+            + [IdempotencyKey(key='live', expires_at=now + timedelta(hours=1))]
+        )
+
+        call_command('prune_idempotency_keys', batch_size=2, stdout=io.StringIO())
+
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['live'])
+
+
+class CursorPaginationTests(TestCase):
+    def list(self, **params):
+        return APIClient().get('/api/v1/notifications/', params).json()
+
+    def test_cursors_walk_every_row_once_including_ties(self):
+        user_id = uuid.uuid4()
+        held = [create_notification(user_id=user_id) for _ in range(5)]
+        create_notification()
+        same_time = timezone.now()
+        Notification.objects.filter(id__in=[n.id for n in held[:3]]).update(created_at=same_time)
+
+        seen, cursor = [], None
+        while True:
+            body = self.list(user_id=user_id, limit=2, **({'cursor': cursor} if cursor else {}))
+            seen += [row['id'] for row in body['data']]
+            cursor = body['meta']['next_cursor']
+            self.assertEqual(body['meta']['has_next'], cursor is not None)
+            if cursor is None:
+                break
+
+        expected = Notification.objects.filter(user_id=user_id).order_by('-created_at', '-id')
+        self.assertEqual(seen, [str(n.id) for n in expected])
+
+    def test_total_is_only_counted_on_request(self):
+        user_id = uuid.uuid4()
+        for _ in range(3):
+            create_notification(user_id=user_id)
+
+        self.assertIsNone(self.list(user_id=user_id, limit=1)['meta']['total'])
+        self.assertEqual(self.list(user_id=user_id, limit=1, include_total='exact')['meta']['total'], 3)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = APIClient().get('/api/v1/notifications/', {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.json()['data'])
+
+    def test_page_numbers_still_work(self):
+        for _ in range(3):
+            create_notification()
+
+        body = self.list(page=2, limit=2)
+
+        self.assertEqual(len(body['data']), 1)
+        self.assertEqual(body['meta']['total'], 3)
+
+
+def status_update(notification_id, new_status, seconds=None):
+    timestamp = None
+    if seconds is not None:
+        timestamp = timezone.now().replace(microsecond=0) + timedelta(seconds=seconds)
+    return {'notification_id': notification_id, 'status': new_status, 'timestamp': timestamp}
+
+
+class StatusCoalescingTests(TestCase):
+    def test_updates_replay_in_timestamp_order(self):
+        latest = coalesce([
+            status_update('a', NotificationStatus.DELIVERED, seconds=2),
+            status_update('a', NotificationStatus.FAILED, seconds=1),
+            status_update('b', NotificationStatus.FAILED, seconds=1),
+            status_update('b', NotificationStatus.PENDING, seconds=2),
+            status_update('c', NotificationStatus.PENDING),
+        ])
+
+        self.assertEqual(latest, {'a': NotificationStatus.DELIVERED, 'b': NotificationStatus.FAILED})
+
+    def test_late_failure_does_not_undo_a_delivery(self):
+        self.assertEqual(
+            coalesce([
+                status_update('a', NotificationStatus.DELIVERED),
+                status_update('a', NotificationStatus.FAILED),
+            ]),
+            {'a': NotificationStatus.DELIVERED}
+        )
+
+    def test_batch_applies_only_allowed_transitions(self):
+        pending = create_notification()
+        delivered = create_notification(status=NotificationStatus.DELIVERED)
+
+        updated = apply_status_updates([
+            status_update(pending.request_id, NotificationStatus.FAILED),
+            status_update(pending.request_id, NotificationStatus.DELIVERED),
+            status_update(delivered.request_id, NotificationStatus.FAILED),
+            status_update('unknown', NotificationStatus.DELIVERED),
+        ])
+
+        self.assertEqual(updated, {pending.request_id})
+        pending.refresh_from_db()
+        delivered.refresh_from_db()
+        self.assertEqual(pending.status, NotificationStatus.DELIVERED)
+        self.assertEqual(delivered.status, NotificationStatus.DELIVERED)
+
+    def test_batch_endpoint_reports_counts(self):
+        notification = create_notification()
+        body = [
+            {'notification_id': notification.request_id, 'status': 'delivered'},
+            {'notification_id': notification.request_id, 'status': 'failed'},
+            {'notification_id': notification.request_id, 'status': 'bogus'},
+        ]
+
+        response = APIClient().post('/api/v1/notifications/email/status/batch/', body, format='json')
+
+        data = response.json()['data']
+        self.assertEqual((data['received'], data['notifications'], data['updated']), (3, 1, 1))
+        self.assertEqual([item['index'] for item in data['invalid']], [2])
+
+
+class AsyncIngestionTests(TransactionTestCase):
+    # The async views run their database work on executor threads, which
+    # cannot see a TestCase's open transaction.
+
+    def post(self, view, body):
+        request = AsyncRequestFactory().post(
+            '/api/v1/notifications/', json.dumps(body, default=str), content_type='application/json'
+        )
+        response = asyncio.run(view(request))
+        return response.status_code, json.loads(response.content)
+
+    def test_create_queues_once_and_replays(self):
+        item = notification_data()
+
+        first = self.post(async_views.create_notification, item)
+        second = self.post(async_views.create_notification, item)
+
+        self.assertEqual(first[0], 202)
+        self.assertEqual(second[1], first[1])
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_batch_reports_each_item(self):
+        item = notification_data()
+
+        response_status, body = self.post(
+            async_views.create_notifications_batch, [item, notification_data(variables={}), item]
+        )
+
+        self.assertEqual(response_status, 202)
+        self.assertEqual(
+            [result['status'] for result in body['data']['results']], ['queued', 'invalid', 'duplicate']
+        )
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_invalid_body_is_rejected_without_touching_the_database(self):
+        response_status, body = self.post(async_views.create_notification, {'request_id': 'x'})
+
+        self.assertEqual(response_status, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_create_releases_the_claim_on_errors(self):
+        item = notification_data()
+        fail_after_claim(self)
+
+        response_status, _ = self.post(async_views.create_notification, item)
+
+        self.assertEqual(response_status, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class PriorityRoutingTests(TestCase):
+    @override_settings(NOTIFICATION_PRIORITY_LANE_THRESHOLD=8)
+    def test_urgent_notifications_take_the_priority_lane(self):
+        self.assertEqual(routing_key_for('email', 7), 'email.queue')
+        self.assertEqual(routing_key_for('email', 8), 'email.priority.queue')
+        self.assertEqual(routing_key_for('push', 10), 'push.priority.queue')
+        self.assertEqual(routing_key_for('push'), 'push.queue')
+
+    @override_settings(NOTIFICATION_PRIORITY_LANE_THRESHOLD=0)
+    def test_without_a_threshold_everything_shares_a_queue(self):
+        self.assertEqual(routing_key_for('email', 10), 'email.queue')
+
+    @override_settings(RABBITMQ_MAX_PRIORITY=5)
+    def test_amqp_priority_is_capped(self):
+        pool, slot = stub_pool(confirms=False)
+        service = RabbitMQService(pool=pool, breaker=StubBreaker())
+
+        service.publish_batch([
+            ('email.queue', message_for(create_notification(priority=3))),
+            ('email.queue', message_for(create_notification(priority=9))),
+        ])
+
+        self.assertEqual([properties.priority for _, _, properties in slot.channel.published], [3, 5])
+
+    @override_settings(RABBITMQ_MAX_PRIORITY=10, NOTIFICATION_PRIORITY_LANE_THRESHOLD=8)
+    def test_topology_declares_priority_queues_and_lanes(self):
+        topology = {name: (arguments, bound) for name, arguments, bound in queue_topology()}
+
+        self.assertEqual(topology['email.queue'], ({'x-max-priority': 10}, True))
+        self.assertEqual(topology['push.priority.queue'], ({'x-max-priority': 10}, True))
+        self.assertEqual(topology['failed.queue'], (None, False))
+
+    @override_settings(NOTIFICATION_ENVELOPE_SIZE=10, RABBITMQ_MAX_PRIORITY=10)
+    def test_envelopes_never_mix_priorities(self):
+        messages = [('email.queue', {'notification_id': str(i), 'priority': i % 2 + 1}) for i in range(4)]
+
+        groups = group_envelopes(messages)
+
+        self.assertEqual(
+            sorted((routing_key, [m['priority'] for m in envelope]) for routing_key, envelope in groups),
+            [('email.queue', [1, 1]), ('email.queue', [2, 2])]
+        )
+
+
+class TokenBucketTests(TestCase):
+    def test_burst_is_granted_then_callers_wait_for_the_refill(self):
+        bucket = TokenBucket(f'test:{uuid.uuid4()}', rate=2, capacity=3)
+
+        self.assertEqual(bucket.take({'a': 2}), {'a': (2, 0)})
+        granted, retry_after = bucket.take({'a': 2})['a']
+
+        self.assertEqual(granted, 1)
+        self.assertAlmostEqual(retry_after, 0.5, places=1)
+        self.assertEqual(bucket.take({'b': 3})['b'], (3, 0))
+
+    def test_tokens_refill_over_time(self):
+        bucket = TokenBucket(f'test:{uuid.uuid4()}', rate=100, capacity=1)
+        bucket.take({'a': 1})
+
+        time.sleep(0.02)
+
+        self.assertEqual(bucket.take({'a': 1})['a'], (1, 0))
+
+    def test_overrides_are_parsed_per_client(self):
+        self.assertEqual(
+            parse_limits('partner-a:50:100, partner-b:0.5:5,'),
+            {'partner-a': (50.0, 100), 'partner-b': (0.5, 5)}
+        )
+
+    @override_settings(USER_RATE_LIMIT_RATE=1, USER_RATE_LIMIT_BURST=2)
+    def test_earlier_items_win_a_recipients_budget(self):
+        user_id = uuid.uuid4()
+        items = [notification_data(user_id=user_id, request_id=f'r{i}') for i in range(3)]
+        items.append(notification_data(request_id='other'))
+
+        limited, retry_after = UserRateLimiter().limit(items)
+
+        self.assertEqual(limited, {'r2'})
+        self.assertGreater(retry_after, 0)
+
+
+class EnrichmentTests(TestCase):
+    def setUp(self):
+        self.user_id = str(uuid.uuid4())
+        self.template_code = f'welcome-{uuid.uuid4()}'
+        self.users = InMemoryUserService({self.user_id: {
+            'email': 'ada@example.com', 'push_tokens': ['token-1'], 'preferences': {'push_notifications': True},
+        }})
+        self.templates = InMemoryTemplateService({self.template_code: {
+            'name': 'Welcome', 'subject': 'Hi {{ name }}', 'body': 'Go to {{link}} {{ missing }}',
+        }})
+
+    def message(self):
+        return {
+            'notification_id': str(uuid.uuid4()), 'user_id': self.user_id, 'template_code': self.template_code,
+            'variables': {'name': 'Ada', 'link': 'https://example.com'}, 'request_id': str(uuid.uuid4()),
+        }
+
+    def test_messages_carry_contact_data_and_rendered_content(self):
+        [(_, message)] = Enricher(self.users, self.templates).enrich([('push.queue', self.message())])
+
+        self.assertEqual(message['recipient_id'], self.user_id)
+        self.assertEqual(message['email'], 'ada@example.com')
+        self.assertEqual(message['device_token'], 'token-1')
+        self.assertEqual(message['subject'], 'Hi Ada')
+        self.assertEqual(message['body'], 'Go to https://example.com {{ missing }}')
+        self.assertEqual(message['payload']['title'], 'Hi Ada')
+
+    def test_each_user_and_template_is_fetched_once(self):
+        enricher = Enricher(self.users, self.templates)
+        enricher.enrich([('email.queue', self.message()) for _ in range(3)])
+        enricher.enrich([('email.queue', self.message())])
+        # A second process finds them in the shared cache.
+        Enricher(self.users, self.templates).enrich([('email.queue', self.message())])
+
+        self.assertEqual((self.users.calls, self.templates.calls), (1, 1))
+
+    def test_failed_lookups_are_retried(self):
+        class FlakyUserService(InMemoryUserService):
+            def fetch_many(self, user_ids):
+                self.calls += 1
+                if self.calls == 1:
+                    return {user_id: None for user_id in user_ids}
+                return super().fetch_many(user_ids)
+
+        users = FlakyUserService(self.users.users)
+        enricher = Enricher(users, self.templates)
+
+        [(_, first)] = enricher.enrich([('email.queue', self.message())])
+        [(_, second)] = enricher.enrich([('email.queue', self.message())])
+
+        self.assertNotIn('email', first)
+        self.assertEqual(second['email'], 'ada@example.com')
+
+    def test_messages_go_out_unenriched_when_enrichment_fails(self):
+        messages = [('email.queue', self.message())]
+
+        self.assertEqual(enrich_messages(messages, FailingEnricher()), messages)
+
+
+class ScheduledNotificationTests(TestCase):
+    @override_settings(NOTIFICATION_USE_OUTBOX=False)
+    def test_scheduled_notification_waits_in_the_outbox(self):
+        send_at = timezone.now() + timedelta(hours=1)
+        rabbitmq = StubRabbitMQ()
+        service = NotificationService()
+        service.rabbitmq = rabbitmq
+
+        self.assertTrue(service.send_notification(notification_data(scheduled_at=send_at)))
+
+        row = OutboxMessage.objects.get()
+        self.assertEqual(row.available_at, send_at)
+        self.assertEqual(rabbitmq.batches, [])
+        self.assertEqual(OutboxRelay(rabbitmq=rabbitmq).relay_batch(), 0)
+
+        OutboxMessage.objects.update(available_at=timezone.now())
+        self.assertEqual(OutboxRelay(rabbitmq=rabbitmq).relay_batch(), 1)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_due_rows_go_out_in_due_time_order(self):
+        now = timezone.now()
+        late, early = create_notification(), create_notification()
+        OutboxMessage.objects.bulk_create([outbox_message_for(late), outbox_message_for(early)])
+        OutboxMessage.objects.filter(notification_id=late.id).update(available_at=now - timedelta(seconds=1))
+        OutboxMessage.objects.filter(notification_id=early.id).update(available_at=now - timedelta(minutes=1))
+        rabbitmq = StubRabbitMQ()
+
+        OutboxRelay(batch_size=1, rabbitmq=rabbitmq).relay_batch()
+
+        self.assertEqual(rabbitmq.batches[0][0][1]['notification_id'], str(early.id))
+
+    def test_past_send_times_mean_now(self):
+        response = APIClient().post(
+            '/api/v1/notifications/',
+            notification_data(scheduled_at=(timezone.now() - timedelta(minutes=1)).isoformat()),
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(Notification.objects.get().scheduled_at)
+
+    def test_send_times_are_capped(self):
+        response = APIClient().post(
+            '/api/v1/notifications/',
+            notification_data(scheduled_at=(timezone.now() + timedelta(days=31)).isoformat()),
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_status_window_counts_from_the_send_time(self):
+        now = timezone.now()
+        notification = create_notification()
+        Notification.objects.filter(pk=notification.pk).update(
+            created_at=now - timedelta(days=10), scheduled_at=now - timedelta(days=1)
+        )
+
+        self.assertTrue(apply_status_update(notification.request_id, NotificationStatus.DELIVERED))
+
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, NotificationStatus.DELIVERED)
+        Notification.objects.filter(pk=notification.pk).update(scheduled_at=None)
+        self.assertIsNone(apply_status_update(notification.request_id, NotificationStatus.FAILED))
+
+
+@skipIf(metrics.prometheus_client is None, 'prometheus_client is not installed')
+class MetricsTests(TestCase):
+    def sample(self, name, **labels):
+        return metrics.prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_are_labelled_by_route_pattern(self):
+        notification = create_notification()
+        labels = {'method': 'GET', 'route': 'api/v1/notifications/<uuid:notification_id>/', 'status': '200'}
+        before = self.sample('http_request_duration_seconds_count', **labels)
+
+        APIClient().get(f'/api/v1/notifications/{notification.id}/')
+        APIClient().get(f'/api/v1/notifications/{create_notification().id}/')
+
+        self.assertEqual(self.sample('http_request_duration_seconds_count', **labels), before + 2)
+
+    def test_status_transitions_are_counted(self):
+        before = self.sample('notification_status_transitions_total', status='delivered')
+
+        apply_status_updates([
+            status_update(create_notification().request_id, NotificationStatus.DELIVERED) for _ in range(3)
+        ])
+
+        self.assertEqual(self.sample('notification_status_transitions_total', status='delivered'), before + 3)
+
+    def test_metrics_endpoint_exposes_the_registry(self):
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'notifications_published_total', response.content)
+
+
+class LoggingTests(TestCase):
+    def test_sampler_keeps_failures_and_slow_requests(self):
+        sampler = AccessLogSampler(rate=0.25, slow_seconds=1.0)
+
+        kept = [sampler.keep(200, 0.01) for _ in range(8)]
+
+        self.assertEqual(kept.count(True), 2)
+        self.assertTrue(sampler.keep(503, 0.01))
+        self.assertTrue(sampler.keep(200, 1.5))
+        self.assertFalse(AccessLogSampler(rate=0, slow_seconds=1.0).keep(404, 0.01))
+
+    def test_records_are_written_as_json_off_the_calling_thread(self):
+        stream = io.StringIO()
+        handler = QueueingHandler(JSONFormatter(), stream=stream)
+        record = logging.makeLogRecord({
+            'name': 'notifications', 'levelno': logging.INFO, 'levelname': 'INFO',
+            'msg': 'Queued %s', 'args': ('n1',), 'request_id': 'r1',
+        })
+
+        handler.handle(record)
+        handler._stop()
+
+        entry = json.loads(stream.getvalue())
+        self.assertEqual((entry['message'], entry['request_id']), ('Queued n1', 'r1'))
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = QueueingHandler(JSONFormatter(), stream=io.StringIO(), maxsize=0)
+        handler._stop()
+
+        handler.handle(logging.makeLogRecord({'msg': 'dropped'}))
+
+        self.assertEqual(handler.dropped, 1)
+
+
+class SerializationFastPathTests(TestCase):
+    def payload(self, **fields):
+        return json.loads(json.dumps(notification_data(**fields), default=str))
+
+    def test_compiled_validator_matches_the_serializer(self):
+        payload = self.payload(metadata={'campaign': 'spring'})
+
+        self.assertEqual(
+            validate_notification(payload), dict(NotificationCreateSerializer().run_validation(payload))
+        )
+
+    def test_anything_unusual_falls_back_to_the_serializer(self):
+        for payload in (
+            self.payload(user_id='not-a-uuid'),
+            self.payload(priority=11),
+            self.payload(variables={'name': 'Ada', 'link': 'not a url'}),
+            self.payload(notification_type='sms'),
+            self.payload(scheduled_at=timezone.now().isoformat()),
+            [self.payload()],
+        ):
+            with self.subTest(payload=payload):
+                self.assertIsNone(validate_notification(payload))
+
+    def test_renderer_output_matches_drf(self):
+        data = {
+            'id': uuid.uuid4(), 'created_at': timezone.now(), 'amount': Decimal('1.50'),
+            'text': 'café  ', 'items': [1, None, True],
+        }
+
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_parse_errors_match_drf(self):
+        body = b'{"request_id": '
+        messages = []
+        for parser in (ORJSONParser(), JSONParser()):
+            with self.assertRaises(ParseError) as raised:
+                parser.parse(io.BytesIO(body))
+            messages.append(str(raised.exception))
+
+        self.assertEqual(messages[0], messages[1])
+
+
+class EnvelopeTests(TestCase):
+    def messages(self, count):
+        return [message_for(create_notification()) for _ in range(count)]
+
+    def test_plain_message_round_trip(self):
+        [message] = self.messages(1)
+        body, content_type = encode_message(message)
+
+        self.assertEqual(decode_messages(body, content_type), [message])
+
+    def test_envelope_round_trip_with_and_without_compression(self):
+        messages = self.messages(3)
+        for compress_min_bytes in (0, 10 ** 6, 1):
+            with self.subTest(compress_min_bytes=compress_min_bytes):
+                body, content_type, content_encoding = encode_envelope(messages, compress_min_bytes)
+
+                self.assertEqual(content_encoding, DEFLATE if compress_min_bytes == 1 else None)
+                self.assertEqual(
+                    decode_messages(body, content_type, content_encoding, ENVELOPE_TYPE), messages
+                )
+
+    @override_settings(NOTIFICATION_ENVELOPE_SIZE=2, NOTIFICATION_ENVELOPE_COMPRESS_MIN_BYTES=0)
+    def test_batch_is_published_as_envelopes(self):
+        pool, slot = stub_pool(confirms=False)
+        messages = self.messages(3)
+
+        failed = RabbitMQService(pool=pool, breaker=StubBreaker()).publish_batch(
+            [('email.queue', message) for message in messages]
+        )
+
+        self.assertEqual(failed, set())
+        decoded = []
+        for _, body, properties in slot.channel.published:
+            decoded += decode_messages(body, properties.content_type, properties.content_encoding, properties.type)
+        self.assertEqual(len(slot.channel.published), 2)
+        self.assertEqual(slot.channel.published[0][2].headers, {'x-notification-count': 2})
+        self.assertEqual(slot.channel.published[1][2].type, None)
+        self.assertEqual(decoded, messages)
+
+    @override_settings(NOTIFICATION_ENVELOPE_SIZE=3)
+    def test_confirm_covers_every_notification_in_the_envelope(self):
+        pool, slot = stub_pool()
+        slot.connection.replies.append(pika.spec.Basic.Nack(delivery_tag=1))
+        notifications = [create_notification() for _ in range(3)]
+
+        failed = RabbitMQService(pool=pool, breaker=StubBreaker()).publish_batch(
+            [('email.queue', message_for(n)) for n in notifications]
+        )
+
+        self.assertEqual(failed, {str(n.id) for n in notifications})
+
+
+class StatusCacheTests(TestCase):
+    def test_second_lookup_is_served_from_the_cache(self):
+        notification = create_notification()
+        url = f'/api/v1/notifications/{notification.id}/'
+        APIClient().get(url)
+
+        with self.assertNumQueries(0):
+            response = APIClient().get(url)
+
+        self.assertEqual(response.json()['data']['status'], NotificationStatus.PENDING)
+
+    def test_status_updates_invalidate_the_cached_record(self):
+        notification = create_notification()
+        url = f'/api/v1/notifications/{notification.id}/'
+        APIClient().get(url)
+
+        apply_status_updates([status_update(notification.request_id, NotificationStatus.DELIVERED)])
+
+        self.assertEqual(APIClient().get(url).json()['data']['status'], NotificationStatus.DELIVERED)
+
+    def test_request_id_lookups_follow_the_mapping(self):
+        notification = create_notification()
+        url = f'/api/v1/notifications/requests/{notification.request_id}/'
+        APIClient().get(url)
+        apply_status_update(notification.request_id, NotificationStatus.FAILED)
+
+        with self.assertNumQueries(1):
+            response = APIClient().get(url)
+
+        self.assertEqual(response.json()['data']['status'], NotificationStatus.FAILED)
+        self.assertEqual(response.json()['data']['id'], str(notification.id))
+
+    def test_reused_request_ids_map_to_the_new_notification(self):
+        old = create_notification()
+        url = f'/api/v1/notifications/requests/{old.request_id}/'
+        reserve_requests([old])
+        APIClient().get(url)
+
+        release_requests([old])
+        APIClient().get(url)
+        retry = Notification(**notification_data(request_id=old.request_id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reserve_requests([retry]), set())
+            retry.save()
+
+        self.assertEqual(APIClient().get(url).json()['data']['id'], str(retry.id))
+
+    def test_bulk_lookup_reports_unknown_ids(self):
+        notification = create_notification()
+        unknown = str(uuid.uuid4())
+
+        response = APIClient().post(
+            '/api/v1/notifications/statuses/',
+            {'ids': [str(notification.id), unknown], 'request_ids': ['nope']}, format='json'
+        )
+
+        data = response.json()['data']
+        self.assertEqual(data['ids'][str(notification.id)]['status'], NotificationStatus.PENDING)
+        self.assertIsNone(data['ids'][unknown])
+        self.assertIsNone(data['request_ids']['nope'])
+
+
+class ContentDedupTests(TestCase):
+    def test_hash_ignores_request_id_and_key_order(self):
+        item = notification_data()
+        repeat = dict(item, request_id='retry', variables=dict(reversed(list(item['variables'].items()))))
+
+        self.assertEqual(content_hash(item), content_hash(repeat))
+        self.assertNotEqual(content_hash(item), content_hash(dict(item, template_code='reminder')))
+
+    def test_repeats_are_suppressed_until_released(self):
+        deduplicator = ContentDeduplicator(window=60, local_size=100)
+        item = notification_data()
+        retry = dict(item, request_id='retry')
+
+        suppressed, claimed = deduplicator.claim([item, retry])
+        self.assertEqual(suppressed, {'retry'})
+        # Another process only has the shared claim to go by.
+        self.assertEqual(ContentDeduplicator(window=60, local_size=0).claim([retry])[0], {'retry'})
+
+        deduplicator.release(list(claimed.values()))
+        self.assertEqual(deduplicator.claim([retry])[0], set())
+
+    @override_settings(NOTIFICATION_DEDUP_WINDOW=60)
+    def test_create_endpoint_suppresses_a_repeat_under_a_new_request_id(self):
+        item = notification_data()
+
+        APIClient().post('/api/v1/notifications/', item, format='json')
+        retry = dict(item, request_id=f"{item['request_id']}-retry")
+        response = APIClient().post('/api/v1/notifications/', retry, format='json')
+
+        self.assertEqual(response.json()['data']['status'], 'suppressed')
+        self.assertEqual(Notification.objects.count(), 1)
+
+    @override_settings(NOTIFICATION_DEDUP_WINDOW=60, NOTIFICATION_USE_OUTBOX=False)
+    def test_unsent_notifications_release_their_content(self):
+        service = NotificationService()
+        service.rabbitmq = StubRabbitMQ(reject=True)
+        items = [notification_data(), notification_data()]
+
+        results = service.send_batch(items)
+
+        self.assertEqual({result['status'] for result in results}, {'failed'})
+        retries = [dict(item, request_id=f"{item['request_id']}-retry") for item in items]
+        self.assertEqual(service._suppressed(retries), set())
+
+
+class CircuitBreakerTests(TestCase):
+    def breaker(self, **options):
+        options = {'failure_threshold': 2, 'recovery_timeout': 0.05, **options}
+        breaker = CircuitBreaker(f'test-{uuid.uuid4()}', **options)
+        breaker.redis = None
+        return breaker
+
+    def fail(self, breaker):
+        with self.assertRaises(ConnectionError):
+            breaker.call(self.raise_error)
+
+    def raise_error(self):
+        raise ConnectionError('broker down')
+
+    def test_opens_at_the_threshold_and_fails_fast(self):
+        breaker = self.breaker()
+        self.fail(breaker)
+        self.assertFalse(breaker.is_open())
+        self.fail(breaker)
+
+        self.assertTrue(breaker.is_open())
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(lambda: 'sent')
+
+    def test_one_trial_after_the_recovery_timeout(self):
+        breaker = self.breaker()
+        self.fail(breaker)
+        self.fail(breaker)
+        time.sleep(0.06)
+
+        self.assertEqual(breaker.allow(), HALF_OPEN)
+        self.assertIsNone(breaker.allow())
+        self.assertGreater(breaker.retry_in(), 0)
+
+        breaker.record_success(HALF_OPEN)
+        self.assertFalse(breaker.is_open())
+        self.assertEqual(breaker.call(lambda: 'sent'), 'sent')
+
+    def test_failed_trial_opens_it_again(self):
+        breaker = self.breaker()
+        self.fail(breaker)
+        self.fail(breaker)
+        time.sleep(0.06)
+
+        breaker.record_failure(breaker.allow())
+
+        self.assertTrue(breaker.is_open())
+        self.assertIsNone(breaker.allow())
+
+    def test_failures_outside_the_window_do_not_add_up(self):
+        breaker = self.breaker(failure_window=0.02)
+        self.fail(breaker)
+        time.sleep(0.03)
+        self.fail(breaker)
+
+        self.assertFalse(breaker.is_open())
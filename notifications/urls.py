@@ -1,8 +1,21 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.NOTIFICATION_ASYNC_VIEWS:
+    from . import async_views as ingestion_views
+else:
+    ingestion_views = views
+
 urlpatterns = [
-    path('notifications/', views.create_notification, name='create-notification'),
-    path('notifications/', views.list_notifications, name='list-notifications'),
-    path('notifications/<str:notification_type>/status/', views.update_notification_status, name='update-status'),
+    path('notifications/', ingestion_views.notifications_collection, name='notifications'),
+    path('notifications/batch/', ingestion_views.create_notifications_batch, name='create-notifications-batch'),
+    path('notifications/stream/', views.stream_notifications, name='stream-notifications'),
+    path('notifications/fanout/', views.create_notification_fanout, name='create-notification-fanout'),
+    path('notifications/fanout/<uuid:job_id>/', views.get_fanout_job, name='fanout-job'),
+    path('notifications/statuses/', views.lookup_notification_statuses, name='lookup-statuses'),
+    path('notifications/requests/<str:request_id>/', views.get_request_status, name='request-status'),
+    path('notifications/<uuid:notification_id>/', views.get_notification_status, name='notification-status'),
+    path('notifications/<str:notification_type>/status/', ingestion_views.update_notification_status, name='update-status'),
+    path('notifications/<str:notification_type>/status/batch/', ingestion_views.update_notification_status_batch, name='update-status-batch'),
 ]
\ No newline at end of file
@@ -0,0 +1,255 @@
+import functools
+import re
+import uuid
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.validators import (
+    MaxLengthValidator,
+    MaxValueValidator,
+    MinLengthValidator,
+    MinValueValidator,
+    ProhibitNullCharactersValidator,
+    URLValidator,
+)
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import _UnvalidatedField, empty
+from rest_framework.validators import ProhibitSurrogateCharactersValidator
+
+from .serializers import NotificationCreateSerializer
+
+
+class Fallback(Exception):
+    """The value needs the serializer, which also reports any errors."""
+
+
+class Unsupported(Exception):
+    """The serializer uses something the compiled validator does not replicate."""
+
+
+SURROGATES = re.compile('[\ud800-\udfff]')
+
+
+def _inline(validator):
+    """A cheaper equivalent for the validators DRF adds to most fields, or None."""
+    if isinstance(validator, ProhibitNullCharactersValidator):
+        return lambda value: '\x00' in value
+    if isinstance(validator, ProhibitSurrogateCharactersValidator):
+        return lambda value: not value.isascii() and SURROGATES.search(value) is not None
+    if type(validator) is URLValidator:
+        # Links repeat across requests (one per template or campaign), and
+        # the full check costs more than the rest of the payload together.
+        @functools.lru_cache(maxsize=4096)
+        def fails(value):
+            try:
+                validator(value)
+            except DjangoValidationError:
+                return True
+            return False
+        return fails
+    limit = getattr(validator, 'limit_value', None)
+    if callable(limit):
+        return None
+    if type(validator) is MaxLengthValidator:
+        return lambda value: len(value) > limit
+    if type(validator) is MinLengthValidator:
+        return lambda value: len(value) < limit
+    if type(validator) is MaxValueValidator:
+        return lambda value: value > limit
+    if type(validator) is MinValueValidator:
+        return lambda value: value < limit
+    return None
+
+
+def _validators(field):
+    """The field's validators as one callable, compiled once."""
+    inline = []
+    other = []
+    for validator in field.validators:
+        fails = _inline(validator)
+        if fails is not None:
+            inline.append(fails)
+        elif getattr(validator, 'requires_context', False):
+            other.append(lambda value, validator=validator: validator(value, field))
+        else:
+            other.append(validator)
+
+    def run(value):
+        for fails in inline:
+            if fails(value):
+                raise Fallback
+        try:
+            for validator in other:
+                validator(value)
+        except (DjangoValidationError, ValidationError):
+            raise Fallback
+        return value
+    return run
+
+
+def _compile_char(field):
+    allow_blank = field.allow_blank
+    trim = field.trim_whitespace
+    run_validators = _validators(field)
+
+    def check(value):
+        # Only values the field would keep unchanged: already-trimmed strings
+        if type(value) is not str or not (value or allow_blank) or (trim and value != value.strip()):
+            raise Fallback
+        return run_validators(value)
+    return check
+
+
+def _compile_choice(field):
+    choices = field.choice_strings_to_values
+    run_validators = _validators(field)
+
+    def check(value):
+        if type(value) is not str or value not in choices:
+            raise Fallback
+        return run_validators(choices[value])
+    return check
+
+
+def _compile_uuid(field):
+    run_validators = _validators(field)
+
+    def check(value):
+        if type(value) is not str:
+            raise Fallback
+        try:
+            value = uuid.UUID(value)
+        except ValueError:
+            raise Fallback
+        return run_validators(value)
+    return check
+
+
+def _compile_integer(field):
+    run_validators = _validators(field)
+
+    def check(value):
+        if type(value) is not int:
+            raise Fallback
+        return run_validators(value)
+    return check
+
+
+def _compile_boolean(field):
+    run_validators = _validators(field)
+
+    def check(value):
+        if type(value) is not bool:
+            raise Fallback
+        return run_validators(value)
+    return check
+
+
+def _compile_dict(field):
+    if type(field.child) is not _UnvalidatedField:
+        raise Unsupported(field)
+    allow_empty = field.allow_empty
+    run_validators = _validators(field)
+
+    def check(value):
+        if type(value) is not dict or not (allow_empty or value):
+            raise Fallback
+        for key in value:
+            if type(key) is not str:
+                raise Fallback
+        return run_validators(dict(value))
+    return check
+
+
+def _unsupported_field(field):
+    # Present at all, it goes to the serializer; absent, the usual
+    # required/default handling applies.
+    def check(value):
+        raise Fallback
+    return check
+
+
+COMPILERS = {
+    serializers.CharField: _compile_char,
+    serializers.URLField: _compile_char,
+    serializers.ChoiceField: _compile_choice,
+    serializers.UUIDField: _compile_uuid,
+    serializers.IntegerField: _compile_integer,
+    serializers.BooleanField: _compile_boolean,
+    serializers.DictField: _compile_dict,
+}
+
+
+def _compile_serializer(serializer):
+    if (type(serializer).validate is not serializers.Serializer.validate
+            or serializer.validators
+            or any(hasattr(serializer, f'validate_{name}') for name in serializer.fields)):
+        raise Unsupported(serializer)
+
+    plan = []
+    for name, field in serializer.fields.items():
+        if field.read_only:
+            continue
+        if field.source != name:
+            raise Unsupported(field)
+        if isinstance(field, serializers.Serializer):
+            check = _compile_serializer(field)
+        else:
+            check = COMPILERS.get(type(field), _unsupported_field)(field)
+        if field.default is not empty and callable(field.default):
+            raise Unsupported(field)
+        plan.append((name, check, field.required, field.default, field.allow_null))
+
+    def check(data):
+        if type(data) is not dict:
+            raise Fallback
+        validated = {}
+        for name, field_check, required, default, allow_null in plan:
+            value = data.get(name, empty)
+            if value is empty:
+                if required:
+                    raise Fallback
+                if default is not empty:
+                    validated[name] = default
+            elif value is None:
+                if not allow_null:
+                    raise Fallback
+                validated[name] = None
+            else:
+                validated[name] = field_check(value)
+        return validated
+    return check
+
+
+class CompiledValidator:
+    """
+    Validates payloads for a serializer without running DRF's field
+    machinery, from checks compiled once out of the serializer's fields.
+
+    It only accepts input the serializer would accept unchanged, and returns
+    the same ``validated_data``. For anything else, including every invalid
+    payload, it returns None and the caller runs the serializer, so error
+    responses are exactly DRF's. A serializer with custom validation compiles
+    to a validator that always returns None.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._check = None
+
+    def compile(self):
+        try:
+            return _compile_serializer(self.serializer_class())
+        except Unsupported:
+            return _unsupported_field(None)
+
+    def __call__(self, data):
+        if self._check is None:
+            self._check = self.compile()
+        try:
+            return self._check(data)
+        except Fallback:
+            return None
+
+
+validate_notification = CompiledValidator(NotificationCreateSerializer)
@@ -1,18 +1,39 @@
+import base64
+import io
+import json
 import logging
+import uuid
+from datetime import datetime
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
 from django.core.cache import cache
-from .models import Notification
+from django.db import connection
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from .middleware import rate_limited_response
+from .fanout import job_payload
+from .fastjson import loads
+from .models import FanOutJob, Notification
+from .parsers import NDJSONParser, ORJSONParser
+from .renderers import ORJSONRenderer
 from .serializers import (
     NotificationCreateSerializer,
+    NotificationFanoutSerializer,
+    NotificationListQuerySerializer,
+    NotificationStatusLookupSerializer,
     NotificationStatusUpdateSerializer,
     NotificationResponseSerializer,
-    APIResponseSerializer,
-    PaginationMetaSerializer
+    api_response
 )
-from .services import NotificationService, CircuitBreaker
+from .services import NotificationService, suppressed_response
+from .status_cache import get_status_cache
+from .status_updates import apply_status_update, apply_status_updates
+from .validation import validate_notification
 
 logger = logging.getLogger('notifications')
 
@@ -22,80 +43,443 @@ class NotificationPagination(PageNumberPagination):
     max_page_size = 100
 
     def get_paginated_response(self, data):
-        return APIResponseSerializer({
+        # api_response's data is a dict and cannot carry a list.
+        return Response({
             'success': True,
             'data': data,
+            'error': None,
             'message': 'Notifications retrieved successfully',
-            'meta': PaginationMetaSerializer({
+            'meta': {
                 'total': self.page.paginator.count,
                 'limit': self.get_page_size(self.request),
                 'page': self.page.number,
                 'total_pages': self.page.paginator.num_pages,
                 'has_next': self.page.has_next(),
                 'has_previous': self.page.has_previous(),
-            }).data
-        }).data
+            }
+        })
+
+class NotificationKeysetPagination:
+    """
+    Keyset pagination on ``(created_at, id)``, newest first.
+
+    The cursor carries the last row's sort key, so every page is one index
+    range scan however deep it is, and no ``COUNT(*)`` runs unless the
+    client asks for a total.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+
+    @staticmethod
+    def encode_cursor(notification):
+        raw = json.dumps([notification.created_at.isoformat(), str(notification.id)])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            created_at, notification_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return datetime.fromisoformat(created_at), uuid.UUID(notification_id)
+        except (ValueError, TypeError):
+            raise ValidationError({'cursor': ['Invalid cursor.']})
+
+    def paginate_queryset(self, queryset, cursor):
+        queryset = queryset.order_by('-created_at', '-id')
+        if cursor:
+            created_at, notification_id = self.decode_cursor(cursor)
+            # The first condition is the index range; the second breaks ties.
+            queryset = queryset.filter(created_at__lte=created_at).filter(
+                Q(created_at__lt=created_at) | Q(id__lt=notification_id)
+            )
+        rows = list(queryset[:self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        self.page = rows[:self.limit]
+        return self.page
+
+    def next_cursor(self):
+        if self.has_next and self.page:
+            return self.encode_cursor(self.page[-1])
+        return None
+
+def _estimated_count(queryset):
+    if connection.vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
 
 @api_view(['POST'])
 def create_notification(request):
 
+    claimed = None
+    notification_service = NotificationService()
     try:
-        serializer = NotificationCreateSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(
-                APIResponseSerializer({
-                    'success': False,
-                    'error': 'Validation failed',
-                    'message': 'Invalid request data',
-                    'data': serializer.errors
-                }).data,
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        data = serializer.validated_data
+        data = validate_notification(request.data)
+        if data is None:
+            serializer = NotificationCreateSerializer(data=request.data)
+            if not serializer.is_valid():
+                return Response(
+                    api_response({
+                        'success': False,
+                        'error': 'Validation failed',
+                        'message': 'Invalid request data',
+                        'data': serializer.errors
+                    }),
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            data = serializer.validated_data
+
         request_id = data['request_id']
         
      
-        notification_service = NotificationService()
-        existing_response = notification_service.check_idempotency(request_id)
-        if existing_response:
-            logger.info(f"Idempotent request detected: {request_id}")
-            return Response(existing_response)
+        claim = notification_service.claim_idempotency(request_id)
+        if claim.response is not None:
+            logger.info("Idempotent request detected: %s", request_id)
+            return Response(claim.response)
+        if not claim.claimed:
+            return Response(
+                api_response({
+                    'success': False,
+                    'error': 'Request in progress',
+                    'message': 'A request with this request_id is already being processed'
+                }),
+                status=status.HTTP_409_CONFLICT
+            )
+        claimed = request_id
+
+        if notification_service.suppress_duplicate(data):
+            logger.info("Notification %s repeats recent content, suppressed", request_id)
+            response_data = suppressed_response(request_id)
+            notification_service.store_idempotency_key(request_id, response_data)
+            return Response(response_data)
+
+        retry_after = notification_service.user_retry_after(data)
+        if retry_after:
+            notification_service.release_idempotency_key(request_id)
+            return rate_limited_response(retry_after, 'Too many notifications for this user')
         
      
         success = notification_service.send_notification(data)
         
         if success:
-            response_data = APIResponseSerializer({
+            response_data = api_response({
                 'success': True,
                 'data': {
                     'notification_id': data['request_id'],
                     'status': 'queued'
                 },
                 'message': 'Notification queued successfully'
-            }).data
+            })
         
             notification_service.store_idempotency_key(request_id, response_data)
             
             return Response(response_data, status=status.HTTP_202_ACCEPTED)
         else:
+            notification_service.release_idempotency_key(request_id)
             return Response(
-                APIResponseSerializer({
+                api_response({
                     'success': False,
                     'error': 'Queueing failed',
                     'message': 'Failed to queue notification'
-                }).data,
+                }),
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
             
     except Exception as e:
-        logger.error(f"Error creating notification: {str(e)}")
+        logger.error("Error creating notification: %s", e)
+        if claimed is not None:
+            notification_service.release_idempotency_key(claimed)
         return Response(
-            APIResponseSerializer({
+            api_response({
                 'success': False,
                 'error': 'Internal server error',
                 'message': 'An error occurred while processing your request'
-            }).data,
+            }),
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+def _validate_batch(serializer, items, start_index=0):
+    """
+    Validate ``items`` with one reusable serializer instance.
+
+    Returns per-item results (``None`` for items still to be sent), the
+    validated data and the indexes it came from. Repeated request ids within
+    ``items`` are reported as duplicates.
+    """
+    results = [None] * len(items)
+    valid = []
+    valid_indexes = []
+    seen = set()
+    for offset, item in enumerate(items):
+        index = start_index + offset
+        if isinstance(item, ValidationError):
+            results[offset] = {'index': index, 'status': 'invalid', 'errors': item.detail}
+            continue
+        data = validate_notification(item)
+        if data is None:
+            try:
+                data = serializer.run_validation(item)
+            except ValidationError as e:
+                results[offset] = {'index': index, 'status': 'invalid', 'errors': e.detail}
+                continue
+
+        if data['request_id'] in seen:
+            results[offset] = {
+                'index': index,
+                'request_id': data['request_id'],
+                'notification_id': data['request_id'],
+                'status': 'duplicate',
+            }
+            continue
+
+        seen.add(data['request_id'])
+        valid.append(data)
+        valid_indexes.append(offset)
+    return results, valid, valid_indexes
+
+def _batch_response(results):
+    counts = {'queued': 0, 'duplicate': 0, 'suppressed': 0, 'invalid': 0, 'failed': 0, 'rate_limited': 0}
+    for result in results:
+        counts[result['status']] += 1
+
+    # Duplicates and suppressed repeats were accepted earlier.
+    accepted = counts['queued'] or counts['duplicate'] or counts['suppressed']
+    if counts['invalid'] == len(results):
+        response_status = status.HTTP_400_BAD_REQUEST
+    elif counts['failed'] and not accepted:
+        response_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+    elif counts['rate_limited'] and not accepted:
+        response_status = status.HTTP_429_TOO_MANY_REQUESTS
+    else:
+        response_status = status.HTTP_202_ACCEPTED
+
+    response_data = api_response({
+        'success': response_status == status.HTTP_202_ACCEPTED,
+        'data': {
+            'results': results,
+            **counts,
+        },
+        'message': f"{counts['queued']} of {len(results)} notifications queued"
+    })
+    return response_data, response_status
+
+@api_view(['POST'])
+@parser_classes([ORJSONParser, NDJSONParser])
+def create_notifications_batch(request):
+
+    try:
+        items = request.data
+        max_items = settings.NOTIFICATION_BATCH_MAX_ITEMS
+        if not isinstance(items, list) or not items or len(items) > max_items:
+            return Response(
+                api_response({
+                    'success': False,
+                    'error': 'Validation failed',
+                    'message': f'Expected a JSON array or NDJSON body of 1 to {max_items} notifications'
+                }),
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results, valid, valid_indexes = _validate_batch(NotificationCreateSerializer(), items)
+
+        if valid:
+            notification_service = NotificationService()
+            for index, result in zip(valid_indexes, notification_service.send_batch(valid)):
+                results[index] = {'index': index, **result}
+
+        return Response(*_batch_response(results))
+
+    except Exception as e:
+        logger.error("Error creating notification batch: %s", e)
+        return Response(
+            api_response({
+                'success': False,
+                'error': 'Internal server error',
+                'message': 'An error occurred while processing your request'
+            }),
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+def _body_stream(request):
+    meta = request.META
+    if not meta.get('CONTENT_LENGTH') and meta.get('wsgi.input_terminated'):
+        # Chunked upload: the server de-chunks wsgi.input and marks its end,
+        # but Django only exposes bodies with a Content-Length.
+        return meta['wsgi.input']
+    return request.stream or io.BytesIO()
+
+def _read_chunks(stream, chunk_size):
+    chunk = []
+    for line in iter(stream.readline, b''):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            chunk.append(loads(line))
+        except ValueError as e:
+            chunk.append(ValidationError({'non_field_errors': [f'JSON parse error - {e}']}))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _stream_results(stream, chunk_size):
+    """
+    Validate, persist and publish an NDJSON upload one chunk at a time.
+
+    Each chunk is published without waiting for confirms; its results are
+    written out after the next chunk has been parsed and inserted, by which
+    time the broker has usually acked it. Only two chunks are ever held in
+    memory.
+    """
+    notification_service = NotificationService()
+    serializer = NotificationCreateSerializer()
+    renderer = ORJSONRenderer()
+    failed = set()
+    pending = None
+    start_index = 0
+
+    def emit(batch, results, valid_indexes, batch_start):
+        for offset, result in zip(valid_indexes, notification_service.finish_batch(batch, failed)):
+            results[offset] = {'index': batch_start + offset, **result}
+        for notification in batch.notifications:
+            failed.discard(str(notification.id))
+        return b''.join(renderer.render(result) + b'\n' for result in results)
+
+    with notification_service.rabbitmq.pipeline() as pipeline:
+        for items in _read_chunks(stream, chunk_size):
+            results, valid, valid_indexes = _validate_batch(serializer, items, start_index)
+            batch = notification_service.queue_batch(valid, pipeline)
+            failed |= batch.failed
+            if pending is not None:
+                failed |= pipeline.wait(up_to_tag=pending[0].last_tag)
+                yield emit(*pending)
+            pending = (batch, results, valid_indexes, start_index)
+            start_index += len(items)
+
+        if pending is not None:
+            failed |= pipeline.wait()
+            yield emit(*pending)
+
+@api_view(['POST'])
+def stream_notifications(request):
+    if request.content_type.split(';')[0].strip() != NDJSONParser.media_type:
+        return Response(
+            api_response({
+                'success': False,
+                'error': 'Unsupported media type',
+                'message': f'Expected a {NDJSONParser.media_type} body'
+            }),
+            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+
+    stream = _body_stream(request)
+    return StreamingHttpResponse(
+        _stream_results(stream, settings.NOTIFICATION_STREAM_CHUNK_SIZE),
+        content_type=NDJSONParser.media_type,
+        status=status.HTTP_200_OK
+    )
+
+@api_view(['POST'])
+def create_notification_fanout(request):
+
+    request_id = None
+    notification_service = NotificationService()
+    try:
+        serializer = NotificationFanoutSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                api_response({
+                    'success': False,
+                    'error': 'Validation failed',
+                    'message': 'Invalid request data',
+                    'data': serializer.errors
+                }),
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        data = serializer.validated_data
+        claim = notification_service.claim_idempotency(data['request_id'])
+        if claim.response is not None:
+            logger.info("Idempotent request detected: %s", data['request_id'])
+            return Response(claim.response)
+        if not claim.claimed:
+            return Response(
+                api_response({
+                    'success': False,
+                    'error': 'Request in progress',
+                    'message': 'A request with this request_id is already being processed'
+                }),
+                status=status.HTTP_409_CONFLICT
+            )
+        request_id = data['request_id']
+
+        # Expanding a large audience outlasts any request; run_fanouts does it.
+        job, _ = FanOutJob.objects.get_or_create(
+            request_id=request_id, defaults={'payload': job_payload(data)}
+        )
+        response_data = api_response({
+            'success': True,
+            'data': _fanout_job_data(job),
+            'message': 'Fan-out accepted'
+        })
+        notification_service.store_idempotency_key(request_id, response_data)
+        return Response(response_data, status=status.HTTP_202_ACCEPTED)
+
+    except Exception as e:
+        logger.error("Error accepting fan-out: %s", e)
+        if request_id is not None:
+            notification_service.release_idempotency_key(request_id)
+        return Response(
+            api_response({
+                'success': False,
+                'error': 'Internal server error',
+                'message': 'An error occurred while processing your request'
+            }),
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+def _fanout_job_data(job):
+    return {
+        'job_id': str(job.id),
+        'request_id': job.request_id,
+        'status': job.status,
+        'counts': job.counts,
+        'attempts': job.attempts,
+        'error': job.error,
+    }
+
+@api_view(['GET'])
+def get_fanout_job(request, job_id):
+
+    try:
+        job = FanOutJob.objects.filter(id=job_id).first()
+        if job is None:
+            return Response(
+                api_response({
+                    'success': False,
+                    'error': 'Not found',
+                    'message': 'Fan-out job not found'
+                }),
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(
+            api_response({
+                'success': True,
+                'data': _fanout_job_data(job),
+                'message': 'Fan-out job retrieved successfully'
+            })
+        )
+
+    except Exception as e:
+        logger.error("Error looking up fan-out job %s: %s", job_id, e)
+        return Response(
+            api_response({
+                'success': False,
+                'error': 'Internal server error',
+                'message': 'Failed to retrieve fan-out job'
+            }),
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
@@ -106,70 +490,295 @@ def update_notification_status(request, notification_type):
         serializer = NotificationStatusUpdateSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(
-                APIResponseSerializer({
+                api_response({
                     'success': False,
                     'error': 'Validation failed',
                     'message': 'Invalid status update data'
-                }).data,
+                }),
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         data = serializer.validated_data
         notification_id = data['notification_id']
         
-        try:
-            notification = Notification.objects.get(request_id=notification_id)
-            notification.status = data['status']
-            notification.save()
-            
-            logger.info(f"Notification {notification_id} status updated to {data['status']}")
-            
-            return Response(
-                APIResponseSerializer({
-                    'success': True,
-                    'message': 'Status updated successfully'
-                }).data
-            )
-            
-        except Notification.DoesNotExist:
+        updated = apply_status_update(notification_id, data['status'])
+        if updated is None:
             return Response(
-                APIResponseSerializer({
+                api_response({
                     'success': False,
                     'error': 'Not found',
                     'message': 'Notification not found'
-                }).data,
+                }),
                 status=status.HTTP_404_NOT_FOUND
             )
+
+        if not updated:
+            # A late or out-of-order update; the stored status is newer.
+            logger.info("Notification %s kept its status, ignoring %s", notification_id, data['status'])
+            return Response(
+                api_response({
+                    'success': True,
+                    'message': 'Status unchanged'
+                })
+            )
+
+        logger.info("Notification %s status updated to %s", notification_id, data['status'])
+
+        return Response(
+            api_response({
+                'success': True,
+                'message': 'Status updated successfully'
+            })
+        )
             
     except Exception as e:
-        logger.error(f"Error updating notification status: {str(e)}")
+        logger.error("Error updating notification status: %s", e)
         return Response(
-            APIResponseSerializer({
+            api_response({
                 'success': False,
                 'error': 'Internal server error',
                 'message': 'Failed to update status'
-            }).data,
+            }),
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+def _validate_status_updates(items):
+    serializer = NotificationStatusUpdateSerializer()
+    updates = []
+    invalid = []
+    for index, item in enumerate(items):
+        try:
+            updates.append(serializer.run_validation(item))
+        except ValidationError as e:
+            invalid.append({'index': index, 'errors': e.detail})
+    return updates, invalid
+
+def _status_batch_response(items, updates, invalid, updated):
+    notification_ids = {update['notification_id'] for update in updates}
+    return api_response({
+        'success': True,
+        'data': {
+            'received': len(items),
+            'notifications': len(notification_ids),
+            'updated': len(updated),
+            'unchanged': len(notification_ids) - len(updated),
+            'invalid': invalid,
+        },
+        'message': f"{len(updated)} of {len(notification_ids)} notifications updated"
+    })
+
+@api_view(['POST'])
+def update_notification_status_batch(request, notification_type):
+
+    try:
+        items = request.data
+        max_items = settings.NOTIFICATION_BATCH_MAX_ITEMS
+        if not isinstance(items, list) or not items or len(items) > max_items:
+            return Response(
+                api_response({
+                    'success': False,
+                    'error': 'Validation failed',
+                    'message': f'Expected a JSON array of 1 to {max_items} status updates'
+                }),
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        updates, invalid = _validate_status_updates(items)
+        if not updates:
+            return Response(
+                api_response({
+                    'success': False,
+                    'error': 'Validation failed',
+                    'message': 'Invalid status update data',
+                    'data': {'invalid': invalid}
+                }),
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        updated = apply_status_updates(updates)
+        logger.info("Applied %s of %s %s status updates", len(updated), len(updates), notification_type)
+
+        return Response(_status_batch_response(items, updates, invalid, updated))
+
+    except Exception as e:
+        logger.error("Error updating notification statuses: %s", e)
+        return Response(
+            api_response({
+                'success': False,
+                'error': 'Internal server error',
+                'message': 'Failed to update statuses'
+            }),
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@csrf_exempt
+def notifications_collection(request):
+    # GET and POST share one path; Django would only ever match the first
+    # of two separate routes.
+    if request.method == 'GET':
+        return list_notifications(request)
+    return create_notification(request)
+
 @api_view(['GET'])
 def list_notifications(request):
 
     try:
-        paginator = NotificationPagination()
-        notifications = Notification.objects.all().order_by('-created_at')
-        result_page = paginator.paginate_queryset(notifications, request)
-        
+        if 'page' in request.query_params:
+            paginator = NotificationPagination()
+            notifications = Notification.objects.all().order_by('-created_at', '-id')
+            result_page = paginator.paginate_queryset(notifications, request)
+
+            serializer = NotificationResponseSerializer(result_page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
+        query = NotificationListQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(
+                api_response({
+                    'success': False,
+                    'error': 'Validation failed',
+                    'message': 'Invalid query parameters',
+                    'data': query.errors
+                }),
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        params = query.validated_data
+        notifications = Notification.objects.all()
+        for field in ('user_id', 'status', 'notification_type'):
+            if field in params:
+                notifications = notifications.filter(**{field: params[field]})
+        # Bounds on created_at let Postgres skip whole partitions.
+        if 'created_after' in params:
+            notifications = notifications.filter(created_at__gte=params['created_after'])
+        if 'created_before' in params:
+            notifications = notifications.filter(created_at__lt=params['created_before'])
+
+        total = None
+        if params.get('include_total') == 'exact':
+            total = notifications.count()
+        elif params.get('include_total') == 'estimate':
+            total = _estimated_count(notifications)
+
+        paginator = NotificationKeysetPagination(params['limit'])
+        try:
+            result_page = paginator.paginate_queryset(notifications, params.get('cursor'))
+        except ValidationError as e:
+            return Response(
+                api_response({
+                    'success': False,
+                    'error': 'Validation failed',
+                    'message': 'Invalid query parameters',
+                    'data': e.detail
+                }),
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         serializer = NotificationResponseSerializer(result_page, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        return Response({
+            'success': True,
+            'data': serializer.data,
+            'error': None,
+            'message': 'Notifications retrieved successfully',
+            'meta': {
+                'total': total,
+                'limit': params['limit'],
+                'has_next': paginator.has_next,
+                'has_previous': bool(params.get('cursor')),
+                'next_cursor': paginator.next_cursor(),
+            }
+        })
         
     except Exception as e:
-        logger.error(f"Error listing notifications: {str(e)}")
+        logger.error("Error listing notifications: %s", e)
         return Response(
-            APIResponseSerializer({
+            api_response({
                 'success': False,
                 'error': 'Internal server error',
                 'message': 'Failed to retrieve notifications'
-            }).data,
+            }),
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+def _status_response(record):
+    if record is None:
+        return Response(
+            api_response({
+                'success': False,
+                'error': 'Not found',
+                'message': 'Notification not found'
+            }),
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return Response(
+        api_response({
+            'success': True,
+            'data': record,
+            'message': 'Notification status retrieved successfully'
+        })
+    )
+
+def _status_lookup_error():
+    return Response(
+        api_response({
+            'success': False,
+            'error': 'Internal server error',
+            'message': 'Failed to retrieve notification status'
+        }),
+        status=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
+
+@api_view(['GET'])
+def get_notification_status(request, notification_id):
+
+    try:
+        by_id, _ = get_status_cache().get_many(ids=[notification_id])
+        return _status_response(by_id[str(notification_id)])
+
+    except Exception as e:
+        logger.error("Error looking up notification %s: %s", notification_id, e)
+        return _status_lookup_error()
+
+@api_view(['GET'])
+def get_request_status(request, request_id):
+
+    try:
+        _, by_request_id = get_status_cache().get_many(request_ids=[request_id])
+        return _status_response(by_request_id[request_id])
+
+    except Exception as e:
+        logger.error("Error looking up request %s: %s", request_id, e)
+        return _status_lookup_error()
+
+@api_view(['POST'])
+def lookup_notification_statuses(request):
+
+    try:
+        serializer = NotificationStatusLookupSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                api_response({
+                    'success': False,
+                    'error': 'Validation failed',
+                    'message': 'Invalid status lookup',
+                    'data': serializer.errors
+                }),
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        data = serializer.validated_data
+        by_id, by_request_id = get_status_cache().get_many(
+            ids=data.get('ids', []), request_ids=data.get('request_ids', [])
+        )
+        found = sum(record is not None for record in [*by_id.values(), *by_request_id.values()])
+        return Response(
+            api_response({
+                'success': True,
+                'data': {'ids': by_id, 'request_ids': by_request_id},
+                'message': f"{found} of {len(by_id) + len(by_request_id)} notifications found"
+            })
+        )
+
+    except Exception as e:
+        logger.error("Error looking up notification statuses: %s", e)
+        return _status_lookup_error()